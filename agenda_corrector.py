@@ -0,0 +1,186 @@
+import heapq
+import math
+from correction import Correction
+
+NEG_INF = float('-inf')
+
+# Best first error correcting parser over the compiled CNF grammar, an alternative to filling every cell of
+# parse_with_err_correction_beam. Items (A, s, l) are popped from an agenda in order of the number of edits of
+# their correction, then of their log probability, each plus an estimate of what completing them into the goal
+# over the whole input costs at least, as in A* parsing. The first time the goal over the whole input is popped,
+# its correction has the fewest edits, and the most probable correction among those.
+#
+# The edits of an item are those of its token corrections plus the tokens of its inserted children, whose
+# minimal insertions are those of I.json. Completing an item that starts the input needs at least the insertion
+# of whatever comes before it in the goal, and one that ends it the insertion of what comes after it, so the
+# estimate there is the cheapest such insertions over the grammar. Elsewhere, an item whose head can't directly
+# follow the token before it (by the FOLLOW tables of the early exit recogniser) needs at least one edit before
+# it, and likewise after it. Its log probability is bounded by the best outside log probability of its head.
+# The estimates never overstate what is left, and never drop more from a parent to a child than the sibling
+# costs, so no item is popped before a better one of the same span.
+# insertion_log_probs has the log probability of inserting each non terminal, -inf if it has no insertion
+class Agenda_Corrector():
+  def __init__(self, compiled_grammar, insertion_log_probs):
+    self.grammar = compiled_grammar
+    self.insertion_log_probs = insertion_log_probs
+    self.correction_service = Correction()
+
+    # Rules indexed by a child whose sibling can be inserted, as (sibling, head, rule id), without rules that
+    # have probability 0
+    insertions = compiled_grammar.insertions
+    rule_log_probs = compiled_grammar.rule_log_probs
+    self.insertion_rules_by_left = [[(C, A, rule_id) for C, A, rule_id in rules if insertions[C] is not None and rule_log_probs[rule_id] > NEG_INF] for rules in compiled_grammar.rules_by_left]
+    self.insertion_rules_by_right = [[(B, A, rule_id) for B, A, rule_id in rules if insertions[B] is not None and rule_log_probs[rule_id] > NEG_INF] for rules in compiled_grammar.rules_by_right]
+
+    # Edits of inserting each non terminal, inf if it has no insertion
+    self.insertion_edits = [math.inf if sigma is None else len(sigma) for sigma in insertions]
+    self.inside_log_probs = self.get_inside_log_probs()
+
+    # Outside estimates by goal
+    self.estimates = {}
+
+  # Upper bound of the log probability of any item of each non terminal, corrected or not. Tokens have log
+  # probability at most 0, and either child of a rule can be an item or inserted
+  def get_inside_log_probs(self):
+    grammar = self.grammar
+    inside = [0.0 if grammar.terminal_rules[A] else NEG_INF for A in range(grammar.num_symbols)]
+    changed = True
+    while changed:
+      changed = False
+      for (A, B, C), rule_log_prob in zip(grammar.binary_rules, grammar.rule_log_probs):
+        log_prob = rule_log_prob + max(inside[B], self.insertion_log_probs[B]) + max(inside[C], self.insertion_log_probs[C])
+        if log_prob > inside[A]:
+          inside[A] = log_prob
+          changed = True
+
+    return inside
+
+  # For each non terminal, the fewest edits to insert what comes before it in the goal, and after it, and its best
+  # outside log probability, with inf, inf and -inf for non terminals the goal never derives
+  def get_estimates(self, goal):
+    if goal in self.estimates:
+      return self.estimates[goal]
+
+    grammar = self.grammar
+    before_edits = [math.inf] * grammar.num_symbols
+    after_edits = [math.inf] * grammar.num_symbols
+    outside_log_probs = [NEG_INF] * grammar.num_symbols
+    before_edits[goal] = after_edits[goal] = 0
+    outside_log_probs[goal] = 0.0
+
+    changed = True
+    while changed:
+      changed = False
+      for (A, B, C), rule_log_prob in zip(grammar.binary_rules, grammar.rule_log_probs):
+        if outside_log_probs[A] == NEG_INF:
+          continue
+        for child, before, after, log_prob in ((B, before_edits[A], after_edits[A] + self.insertion_edits[C], rule_log_prob + max(self.inside_log_probs[C], self.insertion_log_probs[C])),
+                                               (C, before_edits[A] + self.insertion_edits[B], after_edits[A], rule_log_prob + max(self.inside_log_probs[B], self.insertion_log_probs[B]))):
+          if before < before_edits[child]:
+            before_edits[child] = before
+            changed = True
+          if after < after_edits[child]:
+            after_edits[child] = after
+            changed = True
+          if outside_log_probs[A] + log_prob > outside_log_probs[child]:
+            outside_log_probs[child] = outside_log_probs[A] + log_prob
+            changed = True
+
+    self.estimates[goal] = (before_edits, after_edits, outside_log_probs)
+    return self.estimates[goal]
+
+  # Fewest edit correction of the tokens as goal, from token_corrections, which maps each non terminal a token
+  # can be to (correction, log probability) at each position. Returns the correction and counts of the search,
+  # or None as the correction once max_pops items were popped without reaching the goal
+  def get_correction(self, token_corrections, goal, max_pops):
+    grammar = self.grammar
+    rules_by_left = grammar.rules_by_left
+    rules_by_right = grammar.rules_by_right
+    rule_log_probs = grammar.rule_log_probs
+    insertion_edits = self.insertion_edits
+    insertion_log_probs = self.insertion_log_probs
+    before_edits, after_edits, outside_log_probs = self.get_estimates(goal)
+    len_input = len(token_corrections)
+
+    # Heads that can directly follow the token before each position and directly precede the token at it,
+    # from the non terminals each token is without a correction
+    token_masks = [grammar.close_mask(grammar.ids_to_mask(A for A, (correction, log_prob) in corrections.items() if not correction)) for corrections in token_corrections]
+    follow_heads = [0] + [grammar.union_masks(mask, grammar.follow_masks) for mask in token_masks[:-1]]
+    precede_heads = [grammar.union_masks(mask, grammar.precede_masks) for mask in token_masks] + [0]
+
+    # Best edits, log probability and backpointer found for each item, and the popped items by start and end
+    best = {}
+    done = set()
+    lengths_by_start = [{} for _ in range(len_input+1)]
+    starts_by_end = [{} for _ in range(len_input+1)]
+    agenda = []
+    num_pushed = num_popped = 0
+
+    def push(A, s, l, edits, log_prob, backpointer):
+      nonlocal num_pushed
+      item = (A, s, l)
+      if item in done:
+        return
+      if item in best and (best[item][0], -best[item][1]) <= (edits, -log_prob):
+        return
+
+      estimate = (before_edits[A] if s == 0 else 1 - (follow_heads[s] >> A & 1)) + (after_edits[A] if s + l == len_input else 1 - (precede_heads[s+l] >> A & 1))
+      if estimate == math.inf or outside_log_probs[A] == NEG_INF:
+        return
+      best[item] = (edits, log_prob, backpointer)
+      heapq.heappush(agenda, (edits + estimate, -log_prob - outside_log_probs[A], A, s, l))
+      num_pushed += 1
+
+    for i, corrections in enumerate(token_corrections):
+      for A, (correction, log_prob) in corrections.items():
+        push(A, i, 1, len(correction), log_prob, None)
+
+    while agenda:
+      _, _, B, s, l = heapq.heappop(agenda)
+      if (B, s, l) in done:
+        continue
+      done.add((B, s, l))
+      num_popped += 1
+
+      if B == goal and s == 0 and l == len_input:
+        counts = {'candidates_pushed': num_pushed, 'agenda_pops': num_popped, 'cells_filled': len(set((s, l) for A, s, l in done))}
+        return self.get_item_correction(goal, 0, len_input, best, token_corrections), counts
+      if num_popped >= max_pops:
+        break
+
+      edits, log_prob, backpointer = best[B, s, l]
+      lengths_by_start[s].setdefault(B, []).append(l)
+      starts_by_end[s+l].setdefault(B, []).append(s)
+
+      # The item as left child of an item already popped right after it, and as right child of one right before it
+      for C, A, rule_id in rules_by_left[B]:
+        for right_l in lengths_by_start[s+l].get(C, ()):
+          right_edits, right_log_prob, _ = best[C, s+l, right_l]
+          push(A, s, l+right_l, edits + right_edits, log_prob + right_log_prob + rule_log_probs[rule_id], (l, B, C))
+      for left_B, A, rule_id in rules_by_right[B]:
+        for left_s in starts_by_end[s].get(left_B, ()):
+          left_edits, left_log_prob, _ = best[left_B, left_s, s-left_s]
+          push(A, left_s, s+l-left_s, left_edits + edits, left_log_prob + log_prob + rule_log_probs[rule_id], (s-left_s, left_B, B))
+
+      # The item with its sibling inserted after it, and before it. Their backpointers have the partition at the
+      # end and at the start of the span
+      for C, A, rule_id in self.insertion_rules_by_left[B]:
+        push(A, s, l, edits + insertion_edits[C], log_prob + insertion_log_probs[C] + rule_log_probs[rule_id], (l, B, C))
+      for left_B, A, rule_id in self.insertion_rules_by_right[B]:
+        push(A, s, l, insertion_edits[left_B] + edits, insertion_log_probs[left_B] + log_prob + rule_log_probs[rule_id], (0, left_B, B))
+
+    return None, {'candidates_pushed': num_pushed, 'agenda_pops': num_popped}
+
+  # Correction of a popped item, composed from its children the way parse_with_err_correction_beam composes it
+  def get_item_correction(self, A, s, l, best, token_corrections):
+    backpointer = best[A, s, l][2]
+    if backpointer is None:
+      return token_corrections[s][A][0]
+
+    p, B, C = backpointer
+    correction_service = self.correction_service
+    if p == l:
+      return correction_service.compose_for_insertion_forward(self.get_item_correction(B, s, l, best, token_corrections), self.grammar.insertions[C], s+l)
+    if p == 0:
+      return correction_service.compose_for_insertion_backward(self.get_item_correction(C, s, l, best, token_corrections), correction_service.offset_indices(self.grammar.insertions[B], s), s)
+    return correction_service.compose(self.get_item_correction(B, s, p, best, token_corrections), self.get_item_correction(C, s+p, l-p, best, token_corrections))
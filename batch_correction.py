@@ -0,0 +1,104 @@
+import glob
+import os
+import time
+from lexer import Lexer
+from cyk_parser import CYK_Parser
+from parser_pool import Parser_Pool
+from block_cache import Block_Cache
+
+# Files given as directories are searched for files with this extension
+SOURCE_EXTENSION = '.py'
+
+# Expands paths into file names, in order: directories to the source files under them and glob patterns to their matches
+def get_filenames(paths):
+  for path in paths:
+    if os.path.isdir(path):
+      for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+          if file_name.endswith(SOURCE_EXTENSION):
+            yield os.path.join(dir_path, file_name)
+    elif any(char in path for char in '*?['):
+      yield from sorted(glob.glob(path, recursive=True))
+    else:
+      yield path
+
+# Corrects many files with one parser, one warm worker pool and one block cache, so the grammar is loaded once.
+# Files are lexed batch_size at a time and the blocks of a whole batch are scheduled together, so a file with a
+# few long blocks doesn't leave the workers idle
+class Batch_Corrector():
+  def __init__(self, parser_args, parser_kwargs, threads=30, beam_search_n=5, batch_size=100, block_cache_entries=10000, block_cache_file=None):
+    self.batch_size = batch_size
+
+    self.pool = None
+    if threads > 1:
+      self.pool = Parser_Pool(threads, parser_args, parser_kwargs)
+      self.pool.warm_up()
+    block_cache = Block_Cache(block_cache_entries, block_cache_file)
+    self.parser = CYK_Parser(*parser_args, beam_search_n=beam_search_n, threads=threads, pool=self.pool, block_cache=block_cache, **parser_kwargs)
+
+  # Result of each file, in the order of filenames, as a dict to write as a JSON line. Seconds are split into
+  # reading and lexing, time the workers spent on the file's blocks, and the total with reconstructing the code
+  def correct_files(self, filenames):
+    batch = []
+    for filename in filenames:
+      batch.append(filename)
+      if len(batch) == self.batch_size:
+        yield from self.correct_batch(batch)
+        batch = []
+
+    if batch:
+      yield from self.correct_batch(batch)
+
+  def correct_batch(self, filenames):
+    results = []
+    # (result, lexer, tokens, value map) of each file that lexed
+    lexed_files = []
+    for filename in filenames:
+      result = {'file': filename}
+      start = time.perf_counter()
+      try:
+        with open(filename) as f:
+          lexer = Lexer(f.read())
+        lexer.tokenise()
+        tokens_with_id, value_map = lexer.get_id_mapped_tokens()
+        lexed_files.append((result, lexer, tokens_with_id[:-1], value_map))
+      except Exception as e:
+        result.update({'output': '', 'error': str(e)})
+      result['lex_seconds'] = time.perf_counter() - start
+      result['block_seconds'] = 0
+      result['seconds'] = result['lex_seconds']
+      results.append(result)
+
+    try:
+      corrected = self.parser.correct_codes_with_err_correction_beam_block_optimised([tokens_with_id for _, _, tokens_with_id, _ in lexed_files])
+    except Exception:
+      # Correct the files one at a time, so an error only fails the file that caused it
+      corrected = []
+      for _, _, tokens_with_id, _ in lexed_files:
+        try:
+          corrected += self.parser.correct_codes_with_err_correction_beam_block_optimised([tokens_with_id])
+        except Exception as e:
+          corrected.append(e)
+
+    for (result, lexer, tokens_with_id, value_map), file_corrected in zip(lexed_files, corrected):
+      start = time.perf_counter()
+      if isinstance(file_corrected, Exception):
+        result.update({'output': '', 'error': str(file_corrected)})
+        block_seconds = 0
+      else:
+        corrected_code, num_corrected_blocks, block_seconds = file_corrected
+        try:
+          result['output'] = lexer.reverse_lex(corrected_code, value_map, lexer.values_appeared)
+          result['valid'] = num_corrected_blocks == 0
+          result['corrected_blocks'] = num_corrected_blocks
+        except Exception as e:
+          result.update({'output': '', 'error': str(e)})
+      result['block_seconds'] = block_seconds
+      result['seconds'] = result['lex_seconds'] + block_seconds + time.perf_counter() - start
+
+    return results
+
+  def shutdown(self):
+    if self.pool is not None:
+      self.pool.shutdown()
@@ -0,0 +1,51 @@
+from lexer import Lexer
+import sys
+import time
+
+# Compares the scan modes of Lexer on many small snippets and on one large input.
+# Usage: python bench_lexer.py [file ...], using the files given as snippets, or generated code otherwise
+SNIPPET = '''def f{i}(a, b):
+  x = a + b * 2
+  if x == {i}:
+    return f'{{x}}'
+  return g(x, 'abc', [1, 2, 3])
+'''
+REPEATS = 3
+
+def lex(source, scan_mode):
+  lexer = Lexer(source, scan_mode=scan_mode)
+  lexer.tokenise()
+  return lexer.get_id_mapped_tokens()[0]
+
+def time_lexing(lex_fn, sources):
+  best = None
+  for _ in range(REPEATS):
+    start = time.perf_counter()
+    for source in sources:
+      lex_fn(source)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+
+  return best
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    snippets = []
+    for filename in sys.argv[1:]:
+      with open(filename) as f:
+        snippets.append(f.read())
+  else:
+    snippets = [SNIPPET.format(i=i) for i in range(2000)]
+  large_input = '\n'.join(snippets)
+
+  lexers = [('step', lambda source: lex(source, 'step')), ('regex', lambda source: lex(source, 'regex'))]
+
+  for source in (snippets[0], large_input):
+    if lex(source, 'step') != lex(source, 'regex'):
+      raise Exception('SCAN MODES DISAGREE')
+
+  print(f'{len(snippets)} snippets, large input of {len(large_input)} characters')
+  for name, lex_fn in lexers:
+    snippets_time = time_lexing(lex_fn, snippets)
+    large_time = time_lexing(lex_fn, [large_input])
+    print(f'{name:>5}: snippets {snippets_time*1000:.1f} ms ({snippets_time/len(snippets)*1e6:.1f} us each) | large input {large_time*1000:.1f} ms')
@@ -0,0 +1,108 @@
+from cyk_parser import CYK_Parser
+from utils import split_into_blocks
+from corpus import generate_corpus, lex
+from benchmark import PARSER_ARGS, PARSER_KWARGS, summarise, time_each, get_commit
+import argparse
+import json
+import os
+import platform
+import resource
+import time
+
+# Compares the recogniser modes of CYK_Parser on the blocks of the same corpus and on single long statements,
+# timing is_parse_successful and build_parse_tree on both, and checks every mode gives the same validity.
+# Usage: python bench_recogniser.py [-o results.json] [--modes early_exit earley] [--lengths 25 50 100 200] ...
+MODES = ['beam', 'bitset', 'early_exit', 'earley']
+
+# Statements whose number of tokens grows with n, which the CYK chart takes cubic time over
+def get_long_statement(kind, n):
+  if kind == 'list':
+    return 'x = [' + ', '.join(f'a{i}' for i in range(n)) + ']\n'
+  if kind == 'call':
+    return 'x = g(' + ', '.join(f'a{i}' for i in range(n)) + ')\n'
+  if kind == 'arithmetic':
+    return 'x = ' + ' + '.join(f'a{i} * {i}' for i in range(n)) + '\n'
+  return 'x = ' + ' and '.join(f'a{i} == {i}' for i in range(n)) + '\n'
+
+def get_blocks(tokens_collection):
+  return [block for tokens in tokens_collection for blocks in split_into_blocks(tokens) for block in blocks]
+
+def run_modes(modes, beam_search_n, corpus, lengths, max_cubic_tokens):
+  results = []
+  # Blocks of the broken and the valid snippets, and of the long statements by kind and length
+  corpus_blocks = get_blocks([lex(snippet['source']) for snippet in corpus] + [lex(snippet['valid_source']) for snippet in corpus])
+  num_tokens = sum(len(block) for block in corpus_blocks)
+  long_blocks = [(kind, n, get_blocks([lex(get_long_statement(kind, n))])[0]) for kind in ('list', 'call', 'arithmetic', 'boolean') for n in lengths]
+  parsers = {mode: CYK_Parser(*PARSER_ARGS, beam_search_n=beam_search_n, threads=0, **dict(PARSER_KWARGS, recogniser_mode=mode)) for mode in modes}
+
+  valid_by_mode = {}
+  for mode, parser in parsers.items():
+    valid_by_mode[mode], latencies, peak_rss = time_each(parser.is_parse_successful, corpus_blocks)
+    results.append(dict(summarise('is_parse_successful', beam_search_n, None, latencies, num_tokens, peak_rss), recogniser_mode=mode))
+
+  # The exact modes must agree, while the beam can lose parses it pruned
+  exact_modes = [mode for mode in modes if mode != 'beam']
+  expected = valid_by_mode[exact_modes[0] if exact_modes else modes[0]]
+  for mode in exact_modes:
+    if valid_by_mode[mode] != expected:
+      raise Exception(f'RECOGNISER MODES DISAGREE: {mode} and {exact_modes[0]}')
+  for result in results:
+    result['disagreements'] = sum(valid != is_valid for valid, is_valid in zip(valid_by_mode[result['recogniser_mode']], expected))
+
+  valid_blocks = [block for block, is_valid in zip(corpus_blocks, expected) if is_valid]
+  for mode, parser in parsers.items():
+    _, latencies, peak_rss = time_each(lambda block: parser.build_parse_tree(block, 'statements'), valid_blocks)
+    results.append(dict(summarise('build_parse_tree', beam_search_n, None, latencies, sum(len(block) for block in valid_blocks), peak_rss), recogniser_mode=mode))
+
+    for kind, n, block in long_blocks:
+      # The CYK modes are left out past max_cubic_tokens, where a single block takes seconds to minutes
+      if mode != 'earley' and len(block) > max_cubic_tokens:
+        continue
+      valid, latencies, peak_rss = time_each(parser.is_parse_successful, [block])
+      results.append(dict(summarise('is_parse_successful_long', beam_search_n, None, latencies, len(block), peak_rss), recogniser_mode=mode, kind=kind, length=n, valid=valid[0]))
+      _, latencies, peak_rss = time_each(lambda block: parser.build_parse_tree(block, 'statements'), [block])
+      results.append(dict(summarise('build_parse_tree_long', beam_search_n, None, latencies, len(block), peak_rss), recogniser_mode=mode, kind=kind, length=n))
+
+  return results
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description='Compare the recogniser modes, writing the results as JSON')
+  arg_parser.add_argument('-o', '--output', help='file to write the JSON results to, stdout by default')
+  arg_parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+  arg_parser.add_argument('--beam-search-n', type=int, default=5, help='beam width of the beam mode')
+  arg_parser.add_argument('--seed', type=int, default=0)
+  arg_parser.add_argument('--sizes', type=int, nargs='+', default=[2, 5, 10], help='lines per snippet')
+  arg_parser.add_argument('--errors', type=int, nargs='+', default=[0, 1, 2], help='errors per snippet')
+  arg_parser.add_argument('--per-cell', type=int, default=5, help='snippets per size and number of errors')
+  arg_parser.add_argument('--corpus', help='JSON corpus (as saved by benchmark.py) to use instead of generating one')
+  arg_parser.add_argument('--lengths', type=int, nargs='+', default=[10, 25, 50, 100, 200], help='items in each long statement')
+  arg_parser.add_argument('--max-cubic-tokens', type=int, default=250, help='longest statement timed with the CYK modes')
+  args = arg_parser.parse_args()
+
+  if args.corpus:
+    with open(args.corpus) as f:
+      corpus = json.load(f)
+  else:
+    corpus = generate_corpus(args.seed, args.sizes, args.errors, args.per_cell)
+
+  start = time.perf_counter()
+  results = run_modes(args.modes, args.beam_search_n, corpus, args.lengths, args.max_cubic_tokens)
+  total_seconds = time.perf_counter() - start
+
+  report = {
+    'commit': get_commit(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'settings': {'modes': args.modes, 'beam_search_n': args.beam_search_n, 'seed': args.seed, 'sizes': args.sizes, 'errors': args.errors, 'per_cell': args.per_cell, 'corpus': args.corpus, 'lengths': args.lengths, 'max_cubic_tokens': args.max_cubic_tokens},
+    'snippets': len(corpus),
+    'total_seconds': total_seconds,
+    'lifetime_peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'results': results,
+  }
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
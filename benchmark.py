@@ -0,0 +1,217 @@
+from cyk_parser import CYK_Parser
+from corpus import generate_corpus, lex
+from parser_pool import Parser_Pool
+from utils import split_into_blocks
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+
+# Reproducible benchmark of the lexer, block splitting, beam parser, recogniser and corrector over a generated corpus
+# of valid and broken snippets, written as JSON so runs on different commits can be compared.
+# Usage: python benchmark.py [-o results.json] [--beams 3 5] [--threads 0 2] [--corpus-out corpus.json] ...
+PARSER_ARGS = ('./additional_files/grammar_probabilities.json',)
+PARSER_KWARGS = {'fast_mode': True, 'grammar_mode': 'from_data'}
+
+def get_token_types(tokens):
+  return [token for token, token_id, code_pos in tokens if token != 'ENDMARKER']
+
+def get_edit_distance(a, b):
+  prev_row = list(range(len(b)+1))
+  for i in range(1, len(a)+1):
+    row = [i] + [0] * len(b)
+    for j in range(1, len(b)+1):
+      row[j] = min(prev_row[j] + 1, row[j-1] + 1, prev_row[j-1] + (a[i-1] != b[j-1]))
+    prev_row = row
+
+  return prev_row[-1]
+
+def get_percentile(values, percentile):
+  values = sorted(values)
+  return values[min(len(values)-1, int(percentile / 100 * len(values)))]
+
+# Peak resident memory in kB of a process since it started or since reset_peak_rss, from its VmHWM in /proc.
+# None where there is no /proc (not Linux)
+def get_peak_rss_kb(pid='self'):
+  try:
+    with open(f'/proc/{pid}/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except OSError:
+    pass
+  return None
+
+# Lowers the peak resident memory of a process to the memory it holds now, so get_peak_rss_kb gives the peak from now on.
+# False where that isn't possible
+def reset_peak_rss(pid='self'):
+  try:
+    with open(f'/proc/{pid}/clear_refs', 'w') as f:
+      f.write('5')
+    return True
+  except OSError:
+    return False
+
+# Timing summary of one stage, from the latency and number of tokens of each run and the peak memory of time_each
+def summarise(stage, beam_search_n, threads, latencies, num_tokens, peak_rss):
+  seconds = sum(latencies)
+  return {
+    'stage': stage,
+    'beam_search_n': beam_search_n,
+    'threads': threads,
+    'runs': len(latencies),
+    'tokens': num_tokens,
+    'seconds': seconds,
+    'tokens_per_sec': num_tokens / seconds if seconds > 0 else None,
+    'p50_ms': get_percentile(latencies, 50) * 1000,
+    'p99_ms': get_percentile(latencies, 99) * 1000,
+    **peak_rss,
+  }
+
+# Runs fn on every item, returning the results, the seconds each took, and the peak resident memory in kB during the
+# runs of this process ('peak_rss_kb') and of the largest worker of the pool the runs use ('worker_peak_rss_kb').
+# A peak is None where it can't be measured for the stage alone
+def time_each(fn, items, pool=None):
+  worker_pids = sorted(pool.worker_pids) if pool is not None else []
+  can_reset = reset_peak_rss() and all([reset_peak_rss(pid) for pid in worker_pids])
+
+  results, latencies = [], []
+  for item in items:
+    start = time.perf_counter()
+    results.append(fn(item))
+    latencies.append(time.perf_counter() - start)
+
+  worker_peaks = [get_peak_rss_kb(pid) for pid in worker_pids]
+  peak_rss = {
+    'peak_rss_kb': get_peak_rss_kb() if can_reset else None,
+    'worker_peak_rss_kb': max(worker_peaks) if can_reset and worker_peaks and None not in worker_peaks else None,
+  }
+  return results, latencies, peak_rss
+
+def get_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except Exception:
+    return None
+
+def run_benchmark(corpus, beams, thread_counts, recogniser_mode, correction_mode):
+  results, quality = [], []
+
+  all_tokens, latencies, peak_rss = time_each(lambda snippet: lex(snippet['source']), corpus)
+  num_tokens = sum(len(tokens) for tokens in all_tokens)
+  results.append(summarise('lex', None, None, latencies, num_tokens, peak_rss))
+
+  all_blocks, latencies, peak_rss = time_each(split_into_blocks, all_tokens)
+  results.append(summarise('split_into_blocks', None, None, latencies, num_tokens, peak_rss))
+
+  valid_types = [get_token_types(lex(snippet['valid_source'])) for snippet in corpus]
+
+  for threads in thread_counts:
+    parser_kwargs = dict(PARSER_KWARGS, recogniser_mode=recogniser_mode, correction_mode=correction_mode)
+    pool = Parser_Pool(threads, PARSER_ARGS, parser_kwargs) if threads > 1 else None
+    if pool is not None:
+      pool.warm_up()
+    parser = CYK_Parser(*PARSER_ARGS, threads=threads, pool=pool, **parser_kwargs)
+
+    for beam_search_n in beams:
+      parser.beam_search_n = beam_search_n
+
+      # The beam parser runs in this process on each block, whatever the number of threads
+      if threads == thread_counts[0]:
+        _, latencies, peak_rss = time_each(lambda blocks: [parser.parse_beam(block) for indent_blocks in blocks for block in indent_blocks], all_blocks)
+        results.append(summarise('parse_beam', beam_search_n, None, latencies, num_tokens, peak_rss))
+
+      _, latencies, peak_rss = time_each(parser.is_parse_successful_parse_beam_block, all_tokens, pool)
+      results.append(summarise('is_parse_successful_parse_beam_block', beam_search_n, threads, latencies, num_tokens, peak_rss))
+
+      def correct(tokens):
+        try:
+          return parser.correct_code_with_err_correction_beam_block_optimised(tokens)
+        except Exception:
+          return None
+      corrected, latencies, peak_rss = time_each(correct, all_tokens, pool)
+      results.append(summarise('correct_code_with_err_correction_beam_block_optimised', beam_search_n, threads, latencies, num_tokens, peak_rss))
+
+      # Corrections don't depend on the number of threads, so quality is measured once per beam width
+      if threads == thread_counts[0]:
+        for num_errors in sorted(set(snippet['errors'] for snippet in corpus)):
+          indices = [i for i, snippet in enumerate(corpus) if snippet['errors'] == num_errors]
+          failed = repaired = exact = distance = 0
+          for i in indices:
+            if corrected[i] is None:
+              failed += 1
+              continue
+            corrected_tokens = [token for token in corrected[i] if token[0] != 'ENDMARKER']
+            repaired += parser.is_parse_successful_parse_beam_block(corrected_tokens)[0]
+            exact += get_token_types(corrected_tokens) == valid_types[i]
+            distance += get_edit_distance(get_token_types(corrected_tokens), valid_types[i])
+          corrected_count = len(indices) - failed
+          quality.append({
+            'beam_search_n': beam_search_n,
+            'errors': num_errors,
+            'snippets': len(indices),
+            # Correction raised an error
+            'failed': failed,
+            # Corrected code parses
+            'repaired_rate': repaired / corrected_count if corrected_count else None,
+            # Corrected code has the token types of the code before it was broken
+            'exact_rate': exact / corrected_count if corrected_count else None,
+            'mean_token_edit_distance': distance / corrected_count if corrected_count else None,
+          })
+
+    if pool is not None:
+      pool.shutdown()
+
+  return results, quality
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description='Benchmark the lexer, parser and corrector, writing the results as JSON')
+  arg_parser.add_argument('-o', '--output', help='file to write the JSON results to, stdout by default')
+  arg_parser.add_argument('--seed', type=int, default=0)
+  arg_parser.add_argument('--sizes', type=int, nargs='+', default=[2, 5, 10], help='lines per snippet')
+  arg_parser.add_argument('--errors', type=int, nargs='+', default=[0, 1, 2], help='errors per snippet')
+  arg_parser.add_argument('--per-cell', type=int, default=5, help='snippets per size and number of errors')
+  arg_parser.add_argument('--beams', type=int, nargs='+', default=[3, 5])
+  arg_parser.add_argument('--threads', type=int, nargs='+', default=[0])
+  arg_parser.add_argument('--recogniser-mode', default='early_exit')
+  arg_parser.add_argument('--correction-mode', default='block', choices=['block', 'window', 'agenda'])
+  arg_parser.add_argument('--corpus', help='JSON corpus to use instead of generating one')
+  arg_parser.add_argument('--corpus-out', help='file to save the corpus to, to reuse with --corpus')
+  args = arg_parser.parse_args()
+
+  if args.corpus:
+    with open(args.corpus) as f:
+      corpus = json.load(f)
+  else:
+    corpus = generate_corpus(args.seed, args.sizes, args.errors, args.per_cell)
+  if args.corpus_out:
+    with open(args.corpus_out, 'w') as f:
+      json.dump(corpus, f, indent=1)
+
+  start = time.perf_counter()
+  results, quality = run_benchmark(corpus, args.beams, args.threads, args.recogniser_mode, args.correction_mode)
+  total_seconds = time.perf_counter() - start
+
+  report = {
+    'commit': get_commit(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'settings': {'seed': args.seed, 'sizes': args.sizes, 'errors': args.errors, 'per_cell': args.per_cell, 'beams': args.beams, 'threads': args.threads, 'recogniser_mode': args.recogniser_mode, 'correction_mode': args.correction_mode, 'corpus': args.corpus},
+    'snippets': len(corpus),
+    'total_seconds': total_seconds,
+    # Peaks over the whole run, of this process and of the largest worker process that has exited
+    'lifetime_peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'lifetime_peak_children_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    'results': results,
+    'quality': quality,
+  }
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Code computing the cached results, whose checksum is part of the key, so a persistent cache never serves
+# results from before the parser changed
+PARSER_CODE_FILES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename) for filename in ('cyk_parser.py', 'earley_recogniser.py', 'agenda_corrector.py'))
+
+def get_code_checksum():
+  digest = hashlib.sha256()
+  for filename in PARSER_CODE_FILES:
+    with open(filename, 'rb') as f:
+      digest.update(f.read())
+
+  return digest.hexdigest()
+
+# Cache of block results, keyed by the block's token types and the parser settings that affect the result.
+# Entries are kept in memory with LRU eviction, and optionally in an sqlite file shared between runs
+class Block_Cache():
+  def __init__(self, max_entries=10000, cache_file=None):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+    self.hits = 0
+    self.misses = 0
+
+    self.db = None
+    if cache_file is not None:
+      self.db = sqlite3.connect(cache_file, check_same_thread=False)
+      self.db.execute('CREATE TABLE IF NOT EXISTS block_results (key TEXT PRIMARY KEY, result BLOB)')
+      self.db.commit()
+
+  # Ids and code positions are left out of the key, so the same statements anywhere in any file share an entry
+  def get_key(self, method_name, block, settings):
+    token_types = tuple(token for token, token_id, code_pos in block)
+    return (method_name, token_types) + settings
+
+  # Returns (found, result), since a cached result can itself be falsy
+  def get(self, key):
+    with self.lock:
+      if key in self.entries:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, self.entries[key]
+
+      if self.db is not None:
+        row = self.db.execute('SELECT result FROM block_results WHERE key = ?', (self.get_disk_key(key),)).fetchone()
+        if row is not None:
+          result = pickle.loads(row[0])
+          self.add_to_memory(key, result)
+          self.hits += 1
+          return True, result
+
+      self.misses += 1
+      return False, None
+
+  def put(self, key, result):
+    with self.lock:
+      self.add_to_memory(key, result)
+      if self.db is not None:
+        self.db.execute('INSERT OR REPLACE INTO block_results VALUES (?, ?)', (self.get_disk_key(key), pickle.dumps(result)))
+        self.db.commit()
+
+  def add_to_memory(self, key, result):
+    self.entries[key] = result
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+  def get_disk_key(self, key):
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+      self.db = None
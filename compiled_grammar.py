@@ -0,0 +1,261 @@
+import math
+from array import array
+
+# Backpointer id used where a nullable child was skipped
+NONE = -1
+
+# Grammar compiled once into integer ids so the chart loops only touch rules whose children are present
+class Compiled_Grammar():
+  def __init__(self, grammar, nullable, insertion_map):
+    # Non terminals are interned in sorted order, so comparing ids orders the same way as comparing names
+    self.symbols = sorted(grammar.keys())
+    self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+    self.num_symbols = len(self.symbols)
+
+    self.nullable_ids = set(self.symbol_ids[head] for head in nullable if head in self.symbol_ids)
+
+    # Minimal pure insertion correction (packed) of each non terminal, None if it has none
+    self.insertions = [insertion_map.get(symbol) for symbol in self.symbols]
+
+    # Binary rules A -> B C as (A, B, C) id triples, with the rule log probabilities in a parallel flat array
+    self.binary_rules = []
+    self.rule_log_probs = array('d')
+
+    # Binary rules indexed by left child as (C, A, rule id) and by right child as (B, A, rule id)
+    self.rules_by_left = [[] for _ in range(self.num_symbols)]
+    self.rules_by_right = [[] for _ in range(self.num_symbols)]
+
+    # Binary rules where one child is nullable, indexed by the other child as (A, rule id)
+    self.nullable_right_rules_by_left = [[] for _ in range(self.num_symbols)]
+    self.nullable_left_rules_by_right = [[] for _ in range(self.num_symbols)]
+
+    # Terminal (length one) productions of each head in grammar order, and the heads producing each terminal
+    self.terminal_rules = [[] for _ in range(self.num_symbols)]
+    self.terminal_heads = {}
+
+    for head, productions in grammar.items():
+      A = self.symbol_ids[head]
+      for production, rule_prob in productions.items():
+        production_arr = production.split(' ')
+
+        if len(production_arr) == 1:
+          self.terminal_rules[A].append(production)
+          if production in self.terminal_heads:
+            self.terminal_heads[production].append(A)
+          else:
+            self.terminal_heads[production] = [A]
+          continue
+
+        B, C = self.symbol_ids[production_arr[0]], self.symbol_ids[production_arr[1]]
+        rule_id = len(self.binary_rules)
+        self.binary_rules.append((A, B, C))
+        self.rule_log_probs.append(math.log(rule_prob) if rule_prob > 0 else float('-inf'))
+
+        self.rules_by_left[B].append((C, A, rule_id))
+        self.rules_by_right[C].append((B, A, rule_id))
+
+        if C in self.nullable_ids:
+          self.nullable_right_rules_by_left[B].append((A, rule_id))
+        if B in self.nullable_ids:
+          self.nullable_left_rules_by_right[C].append((A, rule_id))
+
+    # Heads that have at least one terminal production, in grammar order
+    self.heads_with_terminal_rules = [self.symbol_ids[head] for head in grammar if self.terminal_rules[self.symbol_ids[head]]]
+
+    self.build_bitset_tables()
+    self.build_corner_tables()
+    self.build_yield_tables()
+
+  # Tables for the recogniser, where a chart cell is a bitset of non terminal ids held in a python int
+  def build_bitset_tables(self):
+    # Bitset of heads producing each terminal
+    self.terminal_masks = {}
+    for token, heads in self.terminal_heads.items():
+      self.terminal_masks[token] = self.ids_to_mask(heads)
+
+    # For a left child B, the bitset of right children it pairs with, and the heads of each pair
+    self.right_partner_masks = [0] * self.num_symbols
+    self.pair_head_masks = [{} for _ in range(self.num_symbols)]
+    for A, B, C in self.binary_rules:
+      self.right_partner_masks[B] |= 1 << C
+      self.pair_head_masks[B][C] = self.pair_head_masks[B].get(C, 0) | (1 << A)
+
+    # Heads reachable from each non terminal through rules with a nullable child, including itself
+    unit_heads = [set() for _ in range(self.num_symbols)]
+    for A, B, C in self.binary_rules:
+      if C in self.nullable_ids:
+        unit_heads[B].add(A)
+      if B in self.nullable_ids:
+        unit_heads[C].add(A)
+
+    self.unit_closure_masks = [0] * self.num_symbols
+    self.has_unit_rules_mask = 0
+    for symbol in range(self.num_symbols):
+      if not unit_heads[symbol]:
+        self.unit_closure_masks[symbol] = 1 << symbol
+        continue
+
+      self.has_unit_rules_mask |= 1 << symbol
+      self.unit_closure_masks[symbol] = self.ids_to_mask(self.get_reachable(symbol, unit_heads))
+
+  # Tables to prune recogniser cells by the tokens around a span, in the way FOLLOW sets prune a parser.
+  # left_corner_masks[A] holds every X with A =>* X ... and right_corner_masks[A] every X with A =>* ... X.
+  # precede_masks[X] holds every A that can be directly followed by a string starting with X,
+  # follow_masks[X] every A that can directly follow a string ending with X
+  def build_corner_tables(self):
+    left_children = [set() for _ in range(self.num_symbols)]
+    right_children = [set() for _ in range(self.num_symbols)]
+    for A, B, C in self.binary_rules:
+      left_children[A].add(B)
+      right_children[A].add(C)
+      if B in self.nullable_ids:
+        left_children[A].add(C)
+      if C in self.nullable_ids:
+        right_children[A].add(B)
+
+    left_corners = [self.get_reachable(symbol, left_children) for symbol in range(self.num_symbols)]
+    right_corners = [self.get_reachable(symbol, right_children) for symbol in range(self.num_symbols)]
+    self.left_corner_masks = [self.ids_to_mask(corners) for corners in left_corners]
+    self.right_corner_masks = [self.ids_to_mask(corners) for corners in right_corners]
+
+    # In A -> B C, a right corner of B can be directly followed by a left corner of C
+    precede_by_right = [0] * self.num_symbols
+    follow_by_left = [0] * self.num_symbols
+    for A, B, C in self.binary_rules:
+      precede_by_right[C] |= self.right_corner_masks[B]
+      follow_by_left[B] |= self.left_corner_masks[C]
+
+    self.precede_masks = [0] * self.num_symbols
+    self.follow_masks = [0] * self.num_symbols
+    for C in range(self.num_symbols):
+      for X in left_corners[C]:
+        self.precede_masks[X] |= precede_by_right[C]
+    for B in range(self.num_symbols):
+      for X in right_corners[B]:
+        self.follow_masks[X] |= follow_by_left[B]
+
+  # Tables to skip chart cells no parse can use, built from the corner tables.
+  # min_yields[A] and max_yields[A] bound the number of tokens A derives (max_yields is inf for a recursive A),
+  # first_masks[token] holds every A whose FIRST set has the token and last_masks[token] every A whose LAST set has it
+  def build_yield_tables(self):
+    terminal_yields = [[0 if production == "''" else 1 for production in productions] for productions in self.terminal_rules]
+    self.min_yields = [min(yields) if yields else math.inf for yields in terminal_yields]
+    for A in self.nullable_ids:
+      self.min_yields[A] = 0
+    changed = True
+    while changed:
+      changed = False
+      for A, B, C in self.binary_rules:
+        if self.min_yields[B] + self.min_yields[C] < self.min_yields[A]:
+          self.min_yields[A] = self.min_yields[B] + self.min_yields[C]
+          changed = True
+
+    # A symbol reaching itself through its children derives ever longer strings, as does any symbol reaching it.
+    # Any other symbol only reaches symbols reaching fewer, so taking them by the number they reach does the
+    # children of each before it
+    children = [set() for _ in range(self.num_symbols)]
+    rules_by_head = [[] for _ in range(self.num_symbols)]
+    for A, B, C in self.binary_rules:
+      children[A].update((B, C))
+      rules_by_head[A].append((B, C))
+    reachable = [self.get_reachable(symbol, children) for symbol in range(self.num_symbols)]
+    recursive = set(symbol for symbol in range(self.num_symbols) if any(symbol in reachable[child] for child in children[symbol]))
+
+    self.max_yields = [max(yields, default=0) for yields in terminal_yields]
+    for A in sorted(range(self.num_symbols), key=lambda symbol: len(reachable[symbol])):
+      if reachable[A] & recursive:
+        self.max_yields[A] = math.inf
+        continue
+      for B, C in rules_by_head[A]:
+        self.max_yields[A] = max(self.max_yields[A], self.max_yields[B] + self.max_yields[C])
+    self.length_masks = {}
+
+    self.first_masks = {}
+    self.last_masks = {}
+    for token, mask in self.terminal_masks.items():
+      self.first_masks[token] = self.ids_to_mask(A for A in range(self.num_symbols) if self.left_corner_masks[A] & mask)
+      self.last_masks[token] = self.ids_to_mask(A for A in range(self.num_symbols) if self.right_corner_masks[A] & mask)
+
+  # Bitset of the non terminals that can derive exactly length tokens as far as their yield bounds tell
+  def get_length_mask(self, length):
+    if length not in self.length_masks:
+      self.length_masks[length] = self.ids_to_mask(A for A in range(self.num_symbols) if self.min_yields[A] <= length <= self.max_yields[A])
+    return self.length_masks[length]
+
+  # The grammar of the reversed token sequences, with the children of every binary rule swapped, for parsing
+  # the end of a block from its last token. Non terminals keep their ids, and there are no insertions
+  def get_reversed(self):
+    grammar = {symbol: {} for symbol in self.symbols}
+    for (A, B, C), log_prob in zip(self.binary_rules, self.rule_log_probs):
+      grammar[self.symbols[A]][f'{self.symbols[C]} {self.symbols[B]}'] = math.exp(log_prob)
+    for A, productions in enumerate(self.terminal_rules):
+      for production in productions:
+        grammar[self.symbols[A]][production] = 1.0
+
+    return Compiled_Grammar(grammar, set(self.symbols[A] for A in self.nullable_ids), {})
+
+  # Symbols reachable from a symbol through a relation given as a list of sets, including itself
+  def get_reachable(self, symbol, relation):
+    reached = {symbol}
+    stack = [symbol]
+    while stack:
+      for A in relation[stack.pop()]:
+        if A not in reached:
+          reached.add(A)
+          stack.append(A)
+    return reached
+
+  # Union of a per symbol bitset table over every symbol in a cell
+  def union_masks(self, mask, masks):
+    union = 0
+    while mask:
+      low_bit = mask & -mask
+      union |= masks[low_bit.bit_length() - 1]
+      mask ^= low_bit
+    return union
+
+  def ids_to_mask(self, symbol_ids):
+    mask = 0
+    for symbol_id in symbol_ids:
+      mask |= 1 << symbol_id
+    return mask
+
+  def mask_to_ids(self, mask):
+    symbol_ids = []
+    while mask:
+      low_bit = mask & -mask
+      symbol_ids.append(low_bit.bit_length() - 1)
+      mask ^= low_bit
+    return symbol_ids
+
+  # Adds every head reachable through rules with a nullable child to a bitset cell
+  def close_mask(self, mask):
+    to_close = mask & self.has_unit_rules_mask
+    while to_close:
+      low_bit = to_close & -to_close
+      mask |= self.unit_closure_masks[low_bit.bit_length() - 1]
+      to_close ^= low_bit
+    return mask
+
+  def get_id(self, symbol):
+    return self.symbol_ids.get(symbol, NONE)
+
+  def get_name(self, symbol_id):
+    if symbol_id is None:
+      return None
+    return 'NONE' if symbol_id == NONE else self.symbols[symbol_id]
+
+  # Converts an id backpointer (p, B, C) into one with non terminal names
+  def backpointer_to_names(self, backpointer):
+    if backpointer is None:
+      return None
+    p, B, C = backpointer
+    return (p, self.get_name(B), self.get_name(C))
+
+  def mask_to_names(self, mask):
+    return set(self.symbols[A] for A in self.mask_to_ids(mask))
+
+  # Converts a chart cell keyed by ids into one keyed by non terminal names
+  def to_names(self, cell):
+    symbols = self.symbols
+    return {symbols[A]: value for A, value in cell.items()}
@@ -0,0 +1,40 @@
+import pytest
+from cyk_parser import CYK_Parser
+from corpus import generate_corpus, lex
+from utils import split_into_blocks
+
+# Fixtures shared by the tests: the blocks of a generated corpus, and parsers built once for the whole session
+GRAMMAR_FILE = './additional_files/grammar_probabilities.json'
+PARSER_KWARGS = {'fast_mode': True, 'grammar_mode': 'from_data', 'beam_search_n': 5, 'threads': 0, 'recogniser_mode': 'earley'}
+
+@pytest.fixture(scope='session')
+def corpus():
+  return generate_corpus(0, [2, 5, 10], [0, 1, 2], 3)
+
+# Blocks of the snippets with errors and of the valid code they were broken from
+@pytest.fixture(scope='session')
+def corpus_blocks(corpus):
+  return [block for snippet in corpus for source in (snippet['source'], snippet['valid_source']) for blocks in split_into_blocks(lex(source)) for block in blocks]
+
+# Returns the parser with PARSER_KWARGS updated by the keyword arguments given, built the first time it is asked for
+@pytest.fixture(scope='session')
+def get_parser():
+  parsers = {}
+  def get_parser(**kwargs):
+    key = tuple(sorted(kwargs.items()))
+    if key not in parsers:
+      parsers[key] = CYK_Parser(GRAMMAR_FILE, **dict(PARSER_KWARGS, **kwargs))
+    return parsers[key]
+  return get_parser
+
+@pytest.fixture(scope='session')
+def broken_blocks(corpus_blocks, get_parser):
+  parser = get_parser()
+  return [block for block in corpus_blocks if not parser.is_parse_successful(block)]
+
+# Blocks that don't parse for which the error correcting beam finds a correction as statements, which it needn't
+# where its beam pruned them all
+@pytest.fixture(scope='session')
+def beam_corrected_blocks(broken_blocks, get_parser):
+  parser = get_parser()
+  return [block for block in broken_blocks if 'statements' in parser.parse_with_err_correction_beam(block)[0][0][len(block)]]
@@ -0,0 +1,97 @@
+from lexer import Lexer, TOKEN_REGEX
+import random
+
+# Generated corpus of Python snippets, each broken with a number of token errors and kept with the valid code it
+# was broken from, which the benchmarks and tests run over
+
+# No names start with f, which the lexer takes as the prefix of an f-string before a string
+NAMES = ['x', 'y', 'total', 'item', 'count']
+FUNCTIONS = ['g', 'print', 'len', 'compute']
+NUMBERS = ['0', '1', '2', '10', '42']
+# Tokens inserted or put in place of another when breaking a snippet
+ERROR_TOKENS = ['(', ')', ':', '=', '+', ',', '[', 'x', '1', 'if']
+
+def get_expression(rng, depth=0):
+  choice = rng.randrange(6 if depth < 2 else 3)
+  if choice == 0:
+    return rng.choice(NAMES)
+  if choice == 1:
+    return rng.choice(NUMBERS)
+  if choice == 2:
+    return f"'{rng.choice(NAMES)}'"
+  if choice == 3:
+    return f'{get_expression(rng, depth+1)} + {get_expression(rng, depth+1)}'
+  if choice == 4:
+    return f'{rng.choice(FUNCTIONS)}({get_expression(rng, depth+1)})'
+  # The grammar has no parenthesised expressions
+  return f'{get_expression(rng, depth+1)} * {rng.choice(NUMBERS)}'
+
+def get_simple_statement(rng):
+  choice = rng.randrange(4)
+  if choice == 0:
+    return f'{rng.choice(NAMES)} = {get_expression(rng)}'
+  if choice == 1:
+    return f'{rng.choice(FUNCTIONS)}({get_expression(rng)}, {get_expression(rng)})'
+  if choice == 2:
+    return f'{rng.choice(NAMES)} = [{get_expression(rng)}, {get_expression(rng)}]'
+  return f'import {rng.choice(NAMES)}'
+
+# Lines of statements, with compound statements opening indented blocks
+def get_statement_lines(rng, num_lines, indent=0):
+  lines = []
+  while len(lines) < num_lines:
+    remaining = num_lines - len(lines)
+    choice = rng.randrange(5) if remaining > 2 and indent < 4 else 0
+    if choice == 0:
+      lines.append(' ' * indent + get_simple_statement(rng))
+      continue
+
+    if choice == 1:
+      header = f'if {rng.choice(NAMES)} == {rng.choice(NUMBERS)}:'
+    elif choice == 2:
+      header = f'for {rng.choice(NAMES)} in range({rng.choice(NUMBERS)}):'
+    elif choice == 3:
+      header = f'while {rng.choice(NAMES)} < {rng.choice(NUMBERS)}:'
+    else:
+      header = f'def {rng.choice(FUNCTIONS)}({rng.choice(NAMES)}, {rng.choice(NAMES)}):'
+    lines.append(' ' * indent + header)
+    lines += get_statement_lines(rng, rng.randint(1, min(remaining-1, 3)), indent+2)
+
+  return lines
+
+# Breaks a snippet with one token deleted, inserted or replaced on each of num_errors different lines
+def add_errors(rng, lines, num_errors):
+  lines = list(lines)
+  for line_i in rng.sample(range(len(lines)), min(num_errors, len(lines))):
+    line = lines[line_i]
+    indent = len(line) - len(line.lstrip())
+    tokens = [match.span(match.lastgroup) for match in TOKEN_REGEX.finditer(line, indent)]
+    start, end = rng.choice(tokens)
+    error = rng.randrange(3)
+    if error == 0:
+      lines[line_i] = line[:start] + line[end:]
+    elif error == 1:
+      lines[line_i] = line[:start] + rng.choice(ERROR_TOKENS) + ' ' + line[start:]
+    else:
+      lines[line_i] = line[:start] + rng.choice(ERROR_TOKENS) + line[end:]
+
+  return lines
+
+# Snippets of every number of lines and errors, each with the valid code it was broken from
+def generate_corpus(seed, sizes, error_counts, per_cell):
+  rng = random.Random(seed)
+  corpus = []
+  for num_lines in sizes:
+    for num_errors in error_counts:
+      for _ in range(per_cell):
+        lines = get_statement_lines(rng, num_lines)
+        corpus.append({'lines': num_lines, 'errors': num_errors, 'source': '\n'.join(add_errors(rng, lines, num_errors)) + '\n', 'valid_source': '\n'.join(lines) + '\n'})
+
+  return corpus
+
+# Tokens of a source with their ids, without the ENDMARKER
+def lex(source):
+  lexer = Lexer(source)
+  lexer.tokenise()
+  tokens_with_id, value_map = lexer.get_id_mapped_tokens()
+  return tokens_with_id[:-1]
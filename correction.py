@@ -1,122 +1,209 @@
 import re
-from uuid import uuid4
 
+# Operation codes of a packed correction, in the order operations appear in a normalised correction
+REPLACE = 0
+DELETE = 1
+INSERT = 2
+
+OP_CODES = {'r': REPLACE, 'd': DELETE, 'i': INSERT}
+OP_NAMES = {REPLACE: 'r', DELETE: 'd', INSERT: 'i'}
+
+# Inserted and replaced tokens get negative ids counting down from here, so they never clash with lexer ids,
+# which count up from 0, nor with -1, the id of the ENDMARKER added after correction
+FIRST_SYNTHETIC_ID = -2
+
+# Allocates the ids of the tokens corrections insert or replace. One allocator is used for all the blocks
+# corrected together, so their ids are unique and the same on every run
+class Token_Id_Allocator():
+  def __init__(self):
+    self.next_id = FIRST_SYNTHETIC_ID
+
+  def get_id(self):
+    token_id = self.next_id
+    self.next_id -= 1
+    return token_id
+
+# A correction is a tuple of (op code, index, terminal) operations, with terminal None for deletions.
+# Corrections are immutable and hashable, so compositions share operations instead of copying them
 class Correction:
   def __init__(self):
     pass
-  
-  def apply_correction(self, corrections, code):
-    code_copy = []
-    for tok in code:
-      code_copy.append(tok)
-
-    for correction in corrections:
-      op, ind = correction[0], int(correction[1])
-      if op == 'd':
+
+  # Converts a correction written as lists like ['r', '3', 'NAME'] (as in I.json) into a packed correction
+  def pack(self, correction_lists):
+    if correction_lists is None:
+      return None
+    return tuple((OP_CODES[op[0]], int(op[1]), op[2] if len(op) > 2 else None) for op in correction_lists)
+
+  # Converts a packed correction back into lists like ['r', '3', 'NAME']
+  def unpack(self, correction):
+    if correction is None:
+      return None
+    return [[OP_NAMES[op], str(ind)] if op == DELETE else [OP_NAMES[op], str(ind), terminal] for op, ind, terminal in correction]
+
+  # Tokens inserted or replaced get ids from id_allocator, or from a new allocator if none is given
+  def apply_correction(self, corrections, code, id_allocator=None):
+    if id_allocator is None:
+      id_allocator = Token_Id_Allocator()
+
+    code_copy = list(code)
+    for op, ind, terminal in corrections:
+      if op == DELETE:
         code_copy.pop(ind)
-      elif op == 'i':
-        to_insert = (correction[2], uuid4(), ())
-        code_copy = code_copy[:ind] + [to_insert] + code_copy[ind:]
+      elif op == INSERT:
+        code_copy.insert(ind, (terminal, id_allocator.get_id(), ()))
       else:
-        to_replace = correction[2]
-        code_copy[ind] = (to_replace, uuid4(), ())
-    
+        code_copy[ind] = (terminal, id_allocator.get_id(), ())
+
     return code_copy
 
-  def normalise(self, correction_arr):
-    # Returns True if elem1 > elem2 according to normalisation rules
-    def compare_more_than(elem1, elem2):
-      if len(elem1) == 0: return True
-      elif len(elem2) == 0: return False
-
-      op1, i1 = elem1[0], elem1[1]
-      op2, i2 = elem2[0], elem2[1]
-
-      if op1 == op2:
-        return int(i1) < int(i2)
-      elif op1 == 'i':
-        return True
-      elif op1 == 'd' and op2 == 'r':
-        return True
-      
-      return False
-    
-    # Implements a swap while keeping semantics of correction
-    def swap_elem(correction_arr, i, j):
-      elem1, elem2 = correction_arr[i], correction_arr[j]
-      op1, ind1 = elem1[0], int(elem1[1])
-      op2, ind2 = elem2[0], int(elem2[1])
-
-      if op1 == 'r' and op2 == 'r':
-        correction_arr[i], correction_arr[j] = correction_arr[j], correction_arr[i]
-      
-      elif op1 == 'd' and op2 == 'r':
-        if ind2 >= ind1:
-          correction_arr[i], correction_arr[j] = self.offset_single_correction(correction_arr[j], 1), correction_arr[i]          
-        else:
-          correction_arr[i], correction_arr[j] = correction_arr[j], correction_arr[i]
-      elif op1 == 'd' and op2 == 'd':
-        if ind1 < ind2:
-          correction_arr[i], correction_arr[j] = self.offset_single_correction(correction_arr[j], 1), correction_arr[i]
-
-      elif op1 == 'i' and op2 == 'r':
-        if ind1 == ind2:
-          # Directly insert what we were going to replace
-          to_replace = elem2[2]
-          correction_arr[i] = [op1, str(ind1), to_replace]
-          correction_arr[j] = []
-        elif ind2 > ind1:
-          correction_arr[i], correction_arr[j] = self.offset_single_correction(correction_arr[j], -1), correction_arr[i]
-        else:
-          correction_arr[i], correction_arr[j] = correction_arr[j], correction_arr[i]  
-      elif op1 == 'i' and op2 == 'i':
-        correction_arr[i], correction_arr[j] = self.offset_single_correction(correction_arr[j], -1), correction_arr[i]
-      elif op1 == 'i' and op2 == 'd':
-        if ind1 == ind2:
-          correction_arr[i] = []
-          correction_arr[j] = []
-        elif ind2 > ind1:
-          correction_arr[i], correction_arr[j] = self.offset_single_correction(correction_arr[j], -1), correction_arr[i]
-        else:
-          correction_arr[i], correction_arr[j] = correction_arr[j], self.offset_single_correction(correction_arr[i], -1)
-    
+  # Returns True if elem1 > elem2 according to normalisation rules.
+  # Operations removed while swapping are None and go to the end
+  def compare_more_than(self, elem1, elem2):
+    if elem1 is None: return True
+    elif elem2 is None: return False
+
+    op1, i1 = elem1[0], elem1[1]
+    op2, i2 = elem2[0], elem2[1]
+
+    # Replacements come first, then deletions, then insertions, each by decreasing index
+    if op1 == op2:
+      return i1 < i2
+    return op1 > op2
+
+  # Implements a swap of adjacent operations while keeping semantics of correction.
+  # Returns the operations now in the two places, either of which can be None if operations were merged
+  def swap_elem(self, elem1, elem2):
+    if elem1 is None:
+      return elem2, elem1
+
+    op1, ind1 = elem1[0], elem1[1]
+    op2, ind2 = elem2[0], elem2[1]
+
+    if op1 == REPLACE and op2 == REPLACE:
+      return elem2, elem1
+
+    elif op1 == DELETE and op2 == REPLACE:
+      if ind2 >= ind1:
+        return self.offset_single_correction(elem2, 1), elem1
+      return elem2, elem1
+    elif op1 == DELETE and op2 == DELETE:
+      if ind1 < ind2:
+        return self.offset_single_correction(elem2, 1), elem1
+
+    elif op1 == INSERT and op2 == REPLACE:
+      if ind1 == ind2:
+        # Directly insert what we were going to replace
+        return (INSERT, ind1, elem2[2]), None
+      elif ind2 > ind1:
+        return self.offset_single_correction(elem2, -1), elem1
+      return elem2, elem1
+    elif op1 == INSERT and op2 == INSERT:
+      return self.offset_single_correction(elem2, -1), elem1
+    elif op1 == INSERT and op2 == DELETE:
+      if ind1 == ind2:
+        return None, None
+      elif ind2 > ind1:
+        return self.offset_single_correction(elem2, -1), elem1
+      return elem2, self.offset_single_correction(elem1, -1)
+
+    return elem1, elem2
+
+  def normalise(self, correction):
+    correction_arr = list(correction)
+
     n = len(correction_arr)
     # Traverse through all array elements
     for i in range(n):
       # Last i elements are already in place, so no need to check them
-      swapped = False      
+      swapped = False
       for j in range(0, n - i - 1):
-        if compare_more_than(correction_arr[j], correction_arr[j + 1]):
-          swap_elem(correction_arr, j, j+1)
+        if self.compare_more_than(correction_arr[j], correction_arr[j + 1]):
+          correction_arr[j], correction_arr[j + 1] = self.swap_elem(correction_arr[j], correction_arr[j + 1])
           swapped = True
 
       if not swapped:
         break
-    
-    # Merge instructions if possible
+
+    return self.merge_adjacent(correction_arr)
+
+  # Merge instructions if possible, up to the first removed operation
+  def merge_adjacent(self, correction_arr):
+    n = len(correction_arr)
     new_correction_arr = []
     for i in range(0, n-1):
       elem1, elem2 = correction_arr[i], correction_arr[i+1]
-      if len(elem1) == 0: break
-      elif len(elem2) == 0: break
+      if elem1 is None: break
+      elif elem2 is None: break
 
-      op1, ind1 = elem1[0], int(elem1[1])
-      op2, ind2 = elem2[0], int(elem2[1])
+      op1, ind1 = elem1[0], elem1[1]
+      op2, ind2 = elem2[0], elem2[1]
 
       # Deletion followed by insertion is just a replacement
-      if op1 == 'd' and op2 == 'i' and ind1 == ind2:
-        new_correction_arr.append(['r', f'{ind1}', elem2[2]])
+      if op1 == DELETE and op2 == INSERT and ind1 == ind2:
+        new_correction_arr.append((REPLACE, ind1, elem2[2]))
       # Replacement followed by deletion of same index means we don't do anything
-      elif op1 == 'r' and op2 == 'd' and ind1 == ind2:
-        new_correction_arr.append(['d', f'{ind1}'])
+      elif op1 == REPLACE and op2 == DELETE and ind1 == ind2:
+        new_correction_arr.append((DELETE, ind1, None))
       else:
         new_correction_arr.append(elem1)
-    
-    if len(correction_arr) and len(correction_arr[-1]) > 0:
+
+    if len(correction_arr) and correction_arr[-1] is not None:
       new_correction_arr.append(correction_arr[-1])
 
-    return new_correction_arr
-  
+    return tuple(new_correction_arr)
+
+  def is_normalised_order(self, correction):
+    for i in range(len(correction)-1):
+      if self.compare_more_than(correction[i], correction[i+1]):
+        return False
+    return True
+
+  # Same result as normalise(p1 + p2) for corrections p1 and p2 that are each in normalised order.
+  # Each operation of p1, from the last, only moves past the operations of p2 that the bubble sort in normalise
+  # would swap it with, so the work is linear in the corrections plus the number of swaps, instead of quadratic
+  def merge(self, p1, p2):
+    # Merging adjacent operations can leave a correction out of order, which only normalise handles
+    if not self.is_normalised_order(p1) or not self.is_normalised_order(p2):
+      return self.normalise(p1 + p2)
+
+    merged = list(p2)
+    for elem in reversed(p1):
+      pos = 0
+      while pos < len(merged) and self.compare_more_than(elem, merged[pos]):
+        left, right = self.swap_elem(elem, merged[pos])
+        # Operations removed by a swap are left as None in normalise, where they stop its bubble sort
+        # from fully sorting, so the result depends on the order of swaps and only normalise gives it
+        if left is None or right is None:
+          return self.normalise(p1 + p2)
+        merged[pos] = left
+        elem = right
+        pos += 1
+
+      merged.insert(pos, elem)
+
+    return self.merge_adjacent(merged)
+
+  # True if a composition of corrections with length operations in total, num_deletions of them deletions and
+  # num_insertions insertions, kept every operation, so applying it applies each composed correction in turn.
+  # Merging adjacent operations changes the number of deletions or insertions, or leaves a deletion followed by
+  # a replacement, which a normalised correction never has
+  def is_exact_composition(self, correction, length, num_deletions, num_insertions):
+    if len(correction) != length:
+      return False
+
+    prev_op = None
+    for op, ind, terminal in correction:
+      if op == DELETE:
+        num_deletions -= 1
+      elif op == INSERT:
+        num_insertions -= 1
+      elif prev_op == DELETE:
+        return False
+      prev_op = op
+
+    return num_deletions == 0 and num_insertions == 0
+
   # Composition of 2 normalised corrections to get a normalised correction
   def compose(self, p1, p2):
     num_insertions_1 = self.get_num_insertions(p1)
@@ -125,39 +212,37 @@ class Correction:
     shift = num_insertions_1 - num_deletions_1
     p2_new = self.offset_indices(p2, shift)
 
-    final = self.normalise(p1+p2_new)
+    final = self.merge(p1, p2_new)
 
     return final
-  
+
   def compose_for_insertion_forward(self, p, sigma, j):
     shift = j + self.get_num_insertions(p) - self.get_num_deletions(p)
     sigma_prime = self.offset_indices(sigma, shift)
 
-    return self.normalise(p + sigma_prime)
-  
+    return self.merge(p, sigma_prime)
+
   def compose_for_insertion_backward(self, p, sigma, j):
     shift = len(sigma)
     p_prime = self.offset_indices(p, shift)
 
-    return self.normalise(sigma + p_prime)
-  
+    return self.merge(sigma, p_prime)
+
   # Offset all indices in correction by a fixed amount
   def offset_indices(self, p, shift):
-    p_new = []
-    for correction in p:
-      p_new.append(self.offset_single_correction(correction, shift))
-    
-    return p_new
-  
+    if shift == 0:
+      return p
+    return tuple((op, ind + shift, terminal) for op, ind, terminal in p)
+
   # Offset index of single operation
   def offset_single_correction(self, correction, shift):
-    if len(correction) == 2:
-      return [correction[0], str(int(correction[1]) + shift)]
-    else:
-      return [correction[0], str(int(correction[1]) + shift), correction[2]]
+    return (correction[0], correction[1] + shift, correction[2])
 
   def get_num_insertions(self, p):
-    return len(list(filter(lambda x: x[0]=='i', p)))
-  
+    return sum(1 for op in p if op[0] == INSERT)
+
   def get_num_deletions(self, p):
-    return len(list(filter(lambda x: x[0]=='d', p)))
\ No newline at end of file
+    return sum(1 for op in p if op[0] == DELETE)
+
+  def get_num_insertions_and_deletions(self, p):
+    return sum(1 for op in p if op[0] != REPLACE)
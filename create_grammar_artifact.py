@@ -0,0 +1,11 @@
+import sys
+from cyk_parser import CYK_Parser
+
+# Builds the binary grammar artifact that CYK_Parser loads instead of parsing the source files
+grammar_file = sys.argv[1] if len(sys.argv) >= 2 else './additional_files/grammar_probabilities.json'
+grammar_mode = sys.argv[2] if len(sys.argv) >= 3 else 'from_data'
+
+parser = CYK_Parser(grammar_file, grammar_mode=grammar_mode)
+artifact_file = parser.save_grammar_artifact()
+
+print(f"Successfully created {artifact_file}")
@@ -1,27 +1,125 @@
 import json
+import math
 from utils import load_grammar_from_file, split_into_blocks, reconstruct_blocks
 from collections import defaultdict
-from correction import Correction
+from correction import Correction, Token_Id_Allocator, REPLACE, DELETE, INSERT
+from compiled_grammar import Compiled_Grammar, NONE
+from parser_metrics import BLOCK_COUNTERS
+from earley_recogniser import Earley_Recogniser
+from agenda_corrector import Agenda_Corrector
+from k_best_corrections import K_Best_Corrections
+from grammar_artifact import get_artifact_file, get_source_checksum, load_artifact, save_artifact, INSERTION_MAP_FILE, BIGRAM_FILE
+from debug_log import capture_debug_log, is_capturing, add_captured_lines, is_debug_enabled, log_debug
+from block_cache import get_code_checksum
 import heapq
-from concurrent.futures import ProcessPoolExecutor
+import logging
+from array import array
+import time
+from contextlib import nullcontext
 from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+NEG_INF = float('-inf')
+
+# Probability of a bigram missing from the bigram model
+BIGRAM_SMOOTH = 1e-10
+
+# Log probability of correcting a single token
+LOG_TOKEN_CORRECTION_PROB = math.log(1e-2)
+
+# Tokens on either side of the first error in the first window of correction_mode 'window'
+WINDOW_TOKENS = 4
+# Factor of the beam over a window, whose chart is small, and where the units only combine with heads the beam
+# at the block width tends to prune
+WINDOW_BEAM_FACTOR = 4
+
+# Items correction_mode 'agenda' pops before giving up on a block and correcting it as in correction_mode 'block'
+AGENDA_MAX_POPS = 200000
+
+# Derivations get_block_corrections looks at for each correction asked for, as many derivations of the beam's
+# hypergraph differ only in how they reach the same correction
+K_BEST_DERIVATIONS = 50
+
+# Parser attributes derived from the source files, which the grammar artifact stores
+TABLE_NAMES = ('grammar', 'insertion_map', 'bigram_probabilities', 'bigram_log_probabilities', 'nullable', 'rev_grammar', 'compiled_grammar')
+
+# Block methods whose result only depends on the token types of the block, which the block cache can store
+CACHEABLE_METHODS = ('is_parse_successful', 'get_block_correction')
+
+logger = logging.getLogger(__name__)
 
 class CYK_Parser():
   # grammar_mode either 'from_data' or 'approx_from_grammar'
-  def __init__(self, grammar_file, fast_mode=True, beam_search_n=50, threads=0, grammar_mode='approx_from_grammar'):
+  # recogniser_mode either 'beam' (parse_beam chart), 'bitset' (exact recogniser with bitset cells)
+  # or 'early_exit' (bitset recogniser with corner pruning that stops once the result is known)
+  # or 'earley' (Earley recogniser with Leo's optimisation, near linear on long blocks, which also builds parse trees)
+  # correction_mode either 'block' (error correcting beam over the whole block) or 'window' (over a window
+  # around the error, with the rest of the block collapsed by the Earley recognisers, widened until it corrects)
+  # or 'agenda' (best first search for the fewest edits, see Agenda_Corrector)
+  # pool is an optional long lived Parser_Pool used for block level work instead of a new pool per call
+  # block_cache is an optional Block_Cache of block validity and corrections
+  # metrics is an optional Parser_Metrics collecting phase timings and block counters
+  def __init__(self, grammar_file, fast_mode=True, beam_search_n=50, threads=0, grammar_mode='approx_from_grammar', recogniser_mode='beam', correction_mode='block', pool=None, block_cache=None, metrics=None):
     self.fast_mode = fast_mode
     self.beam_search_n = beam_search_n
     self.threads = threads
+    self.pool = pool
+    self.block_cache = block_cache
+    self.code_checksum = get_code_checksum() if block_cache is not None else None
+    self.metrics = metrics
+    # Counters of the block being run by run_block with metrics, None otherwise
+    self.block_counters = None
+    self.recogniser_mode = recogniser_mode
+    self.correction_mode = correction_mode
+
+    self.grammar_file = grammar_file
+    self.correction_service = Correction()
 
+    # Use the grammar artifact if one was built from the current source files
+    self.grammar_checksum = get_source_checksum(grammar_file, grammar_mode)
+    tables = load_artifact(get_artifact_file(grammar_file), self.grammar_checksum)
+    if tables is not None:
+      for name in TABLE_NAMES:
+        setattr(self, name, tables[name])
+    else:
+      self.build_tables(grammar_file, grammar_mode)
+
+    self.build_correction_scores()
+    self.build_insertion_rules()
+
+    if recogniser_mode == 'earley' or correction_mode == 'window':
+      self.earley_recogniser = Earley_Recogniser(self.compiled_grammar)
+    # The end of a block is collapsed by parsing it backwards
+    if correction_mode == 'window':
+      self.reverse_earley_recogniser = Earley_Recogniser(self.compiled_grammar.get_reversed())
+    if correction_mode == 'agenda':
+      self.agenda_corrector = Agenda_Corrector(self.compiled_grammar, [NEG_INF if sigma is None else self.correction_to_log_prob(sigma) for sigma in self.compiled_grammar.insertions])
+
+
+  # Worker processes get the parser without the pool, cache and metrics, which stay in the parent process
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['pool'] = None
+    state['block_cache'] = None
+    state['metrics'] = None
+    return state
+
+  # Shallow copies (one per server request) keep sharing the pool and cache
+  def __copy__(self):
+    parser = CYK_Parser.__new__(CYK_Parser)
+    parser.__dict__.update(self.__dict__)
+    return parser
+
+  def build_tables(self, grammar_file, grammar_mode):
     if grammar_mode == 'approx_from_grammar':
       self.grammar = load_grammar_from_file(grammar_file)
     elif grammar_mode == 'from_data':
       with open(grammar_file) as f:
         self.grammar = json.load(f)
 
-    self.insertion_map = self.load_map('additional_files/I.json')
-    self.bigram_probabilities = self.load_map('additional_files/bigram_probabilities.json')
-    self.correction_service = Correction()
+    self.insertion_map = self.load_map(INSERTION_MAP_FILE)
+    self.bigram_probabilities = self.load_map(BIGRAM_FILE)
+    self.bigram_log_probabilities = {bigram: math.log(prob) for bigram, prob in self.bigram_probabilities.items() if prob > 0}
     
     # Nullable
     self.nullable = self.get_nullable(self.insertion_map)
@@ -29,6 +127,60 @@ class CYK_Parser():
     # Mapping from productions to heads
     self.rev_grammar = self.get_reverse_grammar()
 
+    # Integer indexed grammar consumed by the chart loops
+    packed_insertion_map = {non_terminal: self.correction_service.pack(insertion) for non_terminal, insertion in self.insertion_map.items()}
+    self.compiled_grammar = Compiled_Grammar(self.grammar, self.nullable, packed_insertion_map)
+
+  # Integer bigram scores and the summaries of insertion corrections, which compare_corrections uses.
+  # Log probabilities are scaled to integers by a power of two, so sums are exact and equal sequences always tie
+  def build_correction_scores(self):
+    log_probs = list(self.bigram_log_probabilities.values()) + [math.log(BIGRAM_SMOOTH)]
+    self.bigram_score_scale = max(log_prob.as_integer_ratio()[1] for log_prob in log_probs)
+    self.smooth_bigram_score = self.to_bigram_score(math.log(BIGRAM_SMOOTH))
+    self.bigram_scores = {}
+
+    self.insertion_summaries = []
+    for sigma in self.compiled_grammar.insertions:
+      if sigma is None:
+        self.insertion_summaries.append(None)
+      else:
+        tokens = [token for token, token_id, code_pos in self.correction_service.apply_correction(sigma, [])]
+        self.insertion_summaries.append(self.get_sequence_summary(sigma, tokens))
+
+  # Rules of the insertion cases of parse_with_err_correction_beam by their child that isn't inserted
+  def build_insertion_rules(self):
+    grammar = self.compiled_grammar
+    self.insertion_rules_by_left = [self.get_insertion_rules(rules) for rules in grammar.rules_by_left]
+    self.insertion_rules_by_right = [self.get_insertion_rules(rules) for rules in grammar.rules_by_right]
+
+  # The (child, head, rule id) rules whose child can be inserted: it has an insertion, and in fast_mode one of at most
+  # 3 tokens, which a child whose minimal yield is longer never has
+  def get_insertion_rules(self, rules):
+    insertions = self.compiled_grammar.insertions
+    return [(X, A, rule_id) for X, A, rule_id in rules if insertions[X] is not None and not (self.fast_mode and len(insertions[X]) > 3)]
+
+  def to_bigram_score(self, log_prob):
+    numerator, denominator = log_prob.as_integer_ratio()
+    return numerator * (self.bigram_score_scale // denominator)
+
+  def get_bigram_score(self, token_1, token_2):
+    scores = self.bigram_scores.get(token_1)
+    if scores is None:
+      scores = self.bigram_scores[token_1] = {}
+
+    score = scores.get(token_2)
+    if score is None:
+      log_prob = self.bigram_log_probabilities.get(f"{token_1}-{token_2}")
+      score = scores[token_2] = self.smooth_bigram_score if log_prob is None else self.to_bigram_score(log_prob)
+
+    return score
+
+  # Saves the tables derived from the source files, so later parsers can skip building them
+  def save_grammar_artifact(self):
+    artifact_file = get_artifact_file(self.grammar_file)
+    save_artifact(artifact_file, self.grammar_checksum, {name: getattr(self, name) for name in TABLE_NAMES})
+
+    return artifact_file
 
   def get_nullable(self, insertion_map):
     nullable = set()
@@ -68,57 +220,83 @@ class CYK_Parser():
     with open(filename) as f:
       return json.load(f)
 
-  def calc_probability_of_sequence(self, sequence, bigram_prob, smooth = 1e-10):
-    total_prob = 1
+  # Log probability of a token sequence under the bigram model, so long sequences don't underflow
+  def calc_log_probability_of_sequence(self, sequence, bigram_log_prob, smooth = BIGRAM_SMOOTH):
+    log_smooth = math.log(smooth)
+    total_log_prob = 0.0
     for i in range(len(sequence)-1):
       bigram = f"{sequence[i][0]}-{sequence[i+1][0]}"
-      if bigram in bigram_prob:
-        total_prob *= bigram_prob[bigram]
-      else:
-        total_prob *= smooth
+      total_log_prob += bigram_log_prob.get(bigram, log_smooth)
 
-    return total_prob
+    return total_log_prob
 
   # Parsing algorithm referencing Wikipedia
   def parse(self, to_parse):
     len_input = len(to_parse)
+    grammar = self.compiled_grammar
+    rules_by_left = grammar.rules_by_left
 
-    T = [[set() for _ in range(len_input+1)] for _ in range(len_input)]
-    back = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
-    
-    for i, (token, value) in enumerate(to_parse):
+    # Chart of non terminal ids, converted to names once filled
+    chart = [[set() for _ in range(len_input+1)] for _ in range(len_input)]
+    chart_back = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
+
+    for i in range(len_input):
+      token = to_parse[i][0]
       # If token is stub-block, we take it as a block
       if token == 'STUB-BLOCK':
-        T[i][1]['statements'] = 1
-        T[i][1]['statements'] = ([], None)
+        chart[i][1].add(grammar.get_id('statements'))
         continue
 
-      for lhs in self.rev_grammar.get((token,), []):
-        T[i][1].add(lhs)
+      for lhs in grammar.terminal_heads.get(token, []):
+        chart[i][1].add(lhs)
 
     for l in range(2, len_input+1): # Length of span
       for s in range(len_input - l + 1): # Start of span
-        for p in range(1,l+1): # Partition
-          for A, productions in self.grammar.items():
-            for production in productions:
-              production_arr = production.split(' ')
-              if len(production_arr) == 2:
-                B, C = production_arr
+        cell, cell_back = chart[s][l], chart_back[s][l]
+        for p in range(1,l): # Partition
+          right = chart[s+p][l-p]
+          if not right:
+            continue
 
-                if B in T[s][p] and C in T[s+p][l-p]:
-                  T[s][l].add(A)
-                  back[s][l][A].append((p,B,C))
+          for B in chart[s][p]:
+            for C, A, rule_id in rules_by_left[B]:
+              if C in right:
+                cell.add(A)
+                cell_back[A].append((p, rule_id))
+
+    T = [[set() for _ in range(len_input+1)] for _ in range(len_input)]
+    back = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
+    for s in range(len_input):
+      for l in range(1, len_input-s+1):
+        T[s][l] = set(grammar.symbols[A] for A in chart[s][l])
+        # Backpointers are kept in partition then production order
+        for A, backpointers in chart_back[s][l].items():
+          back[s][l][grammar.symbols[A]] = [(p, grammar.symbols[grammar.binary_rules[rule_id][1]], grammar.symbols[grammar.binary_rules[rule_id][2]]) for p, rule_id in sorted(backpointers)]
 
     return T, back
 
-  # Parsing with beam search
-  def parse_beam(self, to_parse):
+  # Parsing with beam search.
+  # Each cell only takes the heads get_span_masks allows at its ends that can derive as many tokens as it spans,
+  # and cells allowing none are skipped. With a non_terminal, only spans that can be part of parsing the whole
+  # input as it are kept, so only T[0][len(to_parse)][non_terminal] is the same as without it
+  def parse_beam(self, to_parse, non_terminal=None):
+    span_starts, span_ends = self.get_span_masks(to_parse, non_terminal)
+    # A STUB-BLOCK stands for a whole block, so spans over one can have heads deriving more tokens than they span
+    use_lengths = not any(token == 'STUB-BLOCK' for token, token_id, code_pos in to_parse)
+
     len_input = len(to_parse)
+    grammar = self.compiled_grammar
+    rule_log_probs = grammar.rule_log_probs
+    rules_by_left = grammar.rules_by_left
 
-    T = [[defaultdict(float) for _ in range(len_input+1)] for _ in range(len_input)]
-    back = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
+    # Chart of non terminal ids to log probabilities, converted to names once filled
+    chart = [[{} for _ in range(len_input+1)] for _ in range(len_input)]
+    chart_back = [[{} for _ in range(len_input+1)] for _ in range(len_input)]
+    # Candidates kept by the beam and left out of it, and cells and rules left out by the span masks, for the block metrics
+    num_kept = num_pruned = num_cells_skipped = num_rules_skipped = 0
 
     def update_tables_with_beam(candidates, s, l):
+      nonlocal num_kept
       beam_candidates = []
       for _ in range(self.beam_search_n):
         if candidates:
@@ -129,180 +307,490 @@ class CYK_Parser():
           while candidates and candidates[0][0] == top_val:
             beam_candidates.append(heapq.heappop(candidates))
 
+      num_kept += len(beam_candidates)
       if beam_candidates:          
-        for neg_prob, (lhs, backpointer) in beam_candidates:
-          if lhs not in T[s][l]:
-            T[s][l][lhs] = -neg_prob
-            back[s][l][lhs] = backpointer
+        for neg_log_prob, (lhs, backpointer) in beam_candidates:
+          if lhs not in chart[s][l]:
+            chart[s][l][lhs] = -neg_log_prob
+            chart_back[s][l][lhs] = backpointer
     
     for i, (token, value, code_pos) in enumerate(to_parse):
+      allowed = span_starts[i] & span_ends[i+1]
       if token == 'STUB-BLOCK':
-        T[i][1]['statements'] = 1
+        chart[i][1][grammar.get_id('statements')] = 0.0
       else:
-        for lhs in self.rev_grammar.get((token,), []):
-          T[i][1][lhs] = 1
+        for lhs in grammar.terminal_heads.get(token, []):
+          if allowed >> lhs & 1:
+            chart[i][1][lhs] = 0.0
 
     for l in range(1, len_input+1): # Length of span
+      # -1 has every bit set
+      length_mask = grammar.get_length_mask(l) if use_lengths else -1
       for s in range(len_input-l+1): # Start of span
+        allowed = span_starts[s] & span_ends[s+l] & length_mask
+        if not allowed:
+          num_cells_skipped += 1
+          continue
+
         candidates = []
+        cell = chart[s][l]
 
-        for A, productions in self.grammar.items():
-          for p in range(1,l): # Partition
-            for production, rule_prob in productions.items():
-              production_arr = production.split(' ')
-              if len(production_arr) == 2:
-                B, C = production_arr
-                if B in T[s][p] and C in T[s+p][l-p] and rule_prob > 0:
-                  total_prob = T[s][p][B] * T[s+p][l-p][C] * rule_prob
-                  heapq.heappush(candidates, (-total_prob, (A, (p, B, C))))
+        for p in range(1,l): # Partition
+          right = chart[s+p][l-p]
+          if not right:
+            continue
 
+          for B, log_prob_B in chart[s][p].items():
+            for C, A, rule_id in rules_by_left[B]:
+              if C in right and rule_log_probs[rule_id] > NEG_INF:
+                if not allowed >> A & 1:
+                  num_rules_skipped += 1
+                  continue
+                total_log_prob = log_prob_B + right[C] + rule_log_probs[rule_id]
+                candidates.append((-total_log_prob, (A, (p, B, C))))
+
+        heapq.heapify(candidates)
         update_tables_with_beam(candidates, s, l)
-      
-        for A, productions in self.grammar.items():
-          for production, rule_prob in productions.items():
-            production_arr = production.split(' ')
-            if len(production_arr) == 2:
-              B, C = production_arr
-
-              if B in T[s][l] and C in self.nullable:
-                total_prob = T[s][l][B] * rule_prob
-                heapq.heappush(candidates, (-total_prob, (A, (-1, B, 'NONE'))))
-              
-              elif C in T[s][l] and B in self.nullable:
-                total_prob = T[s][l][C] * rule_prob
-                heapq.heappush(candidates, (-total_prob, (A, (-1, 'NONE', C))))
+
+        # Candidates left out of the beam compete again with the nullable ones
+        for B, log_prob_B in cell.items():
+          for A, rule_id in grammar.nullable_right_rules_by_left[B]:
+            if not allowed >> A & 1:
+              num_rules_skipped += 1
+              continue
+            total_log_prob = log_prob_B + rule_log_probs[rule_id]
+            heapq.heappush(candidates, (-total_log_prob, (A, (NONE, B, NONE))))
+
+        for C, log_prob_C in cell.items():
+          for A, rule_id in grammar.nullable_left_rules_by_right[C]:
+            B = grammar.binary_rules[rule_id][1]
+            # Already pushed with the right child skipped
+            if B in cell and C in grammar.nullable_ids:
+              continue
+            if not allowed >> A & 1:
+              num_rules_skipped += 1
+              continue
+            total_log_prob = log_prob_C + rule_log_probs[rule_id]
+            heapq.heappush(candidates, (-total_log_prob, (A, (NONE, NONE, C))))
 
         update_tables_with_beam(candidates, s, l)
+        num_pruned += len(candidates)
+
+    if self.block_counters is not None:
+      self.add_block_counts(cells_filled=sum(1 for row in chart for cell in row if cell), candidates_pushed=num_kept+num_pruned, candidates_pruned=num_pruned, cells_skipped=num_cells_skipped, rules_skipped=num_rules_skipped)
+
+    T = [[{} for _ in range(len_input+1)] for _ in range(len_input)]
+    back = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
+    for s in range(len_input):
+      for l in range(1, len_input-s+1):
+        T[s][l] = grammar.to_names(chart[s][l])
+        for A, backpointer in chart_back[s][l].items():
+          back[s][l][grammar.symbols[A]] = grammar.backpointer_to_names(backpointer)
 
     return T, back
   
+  # Recogniser without beam, where each cell is a bitset of non terminal ids
+  def recognise(self, to_parse):
+    len_input = len(to_parse)
+    grammar = self.compiled_grammar
+    right_partner_masks = grammar.right_partner_masks
+    pair_head_masks = grammar.pair_head_masks
+
+    T = [[0] * (len_input+1) for _ in range(len_input)]
+
+    for i in range(len_input):
+      T[i][1] = self.get_token_mask(to_parse[i][0])
+
+    for l in range(2, len_input+1): # Length of span
+      for s in range(len_input-l+1): # Start of span
+        cell = 0
+
+        for p in range(1,l): # Partition
+          left, right = T[s][p], T[s+p][l-p]
+          if not left or not right:
+            continue
+
+          while left:
+            low_bit = left & -left
+            left ^= low_bit
+            B = low_bit.bit_length() - 1
+
+            # Right children present in the right cell that B pairs with
+            matches = right & right_partner_masks[B]
+            while matches:
+              match_bit = matches & -matches
+              matches ^= match_bit
+              cell |= pair_head_masks[B][match_bit.bit_length() - 1]
+
+        T[s][l] = grammar.close_mask(cell)
+
+    return T
+
+  # Heads a span starting and one ending at each position can have. A span starting at i can have the heads whose
+  # FIRST set has token i that can directly follow token i-1, and one ending at i those whose LAST set has token i-1
+  # that can directly precede token i. At the edges of the input they are the heads non_terminal can begin and end
+  # with, or any head without a non_terminal
+  def get_span_masks(self, to_parse, non_terminal=None):
+    grammar = self.compiled_grammar
+    all_heads = (1 << grammar.num_symbols) - 1
+    goal = grammar.get_id(non_terminal) if non_terminal is not None else NONE
+
+    token_masks = [self.get_token_mask(token) for token, token_id, code_pos in to_parse]
+    span_starts = [grammar.left_corner_masks[goal] if goal != NONE else all_heads] + [grammar.union_masks(mask, grammar.follow_masks) for mask in token_masks[:-1]]
+    span_ends = [grammar.union_masks(mask, grammar.precede_masks) for mask in token_masks[1:]] + [grammar.right_corner_masks[goal] if goal != NONE else all_heads]
+    span_ends.insert(0, 0)
+    # Tokens without FIRST and LAST sets, as STUB-BLOCK which parses as statements, leave the heads unlimited
+    for i, (token, token_id, code_pos) in enumerate(to_parse):
+      span_starts[i] &= grammar.first_masks.get(token, all_heads)
+      span_ends[i+1] &= grammar.last_masks.get(token, all_heads)
+
+    return span_starts, span_ends
+
+  # Bitset of the non terminals deriving a single token
+  def get_token_mask(self, token):
+    grammar = self.compiled_grammar
+    if token == 'STUB-BLOCK':
+      return grammar.close_mask(1 << grammar.get_id('statements'))
+    return grammar.close_mask(grammar.terminal_masks.get(token, 0))
+
+  # Validity check with the bitset recogniser that gives up or stops as early as it can.
+  # Heads of a span are pruned to those that can directly follow the token before it and precede the token after it
+  # (or begin and end non_terminal at the edges of the input), and the top cell stops at the first partition deriving non_terminal
+  def recognise_early_exit(self, to_parse, non_terminal = 'statements'):
+    len_input = len(to_parse)
+    grammar = self.compiled_grammar
+    right_partner_masks = grammar.right_partner_masks
+    pair_head_masks = grammar.pair_head_masks
+    goal = grammar.get_id(non_terminal)
+    goal_bit = 1 << goal
+
+    if len_input == 0:
+      return goal in grammar.nullable_ids
+
+    token_masks = [self.get_token_mask(token) for token, token_id, code_pos in to_parse]
+    # A token no non terminal derives can't be part of any parse
+    if not all(token_masks):
+      return False
+
+    # Heads that a span starting or ending at each position can have
+    span_starts = [grammar.left_corner_masks[goal]] + [grammar.union_masks(mask, grammar.follow_masks) for mask in token_masks[:-1]]
+    span_ends = [grammar.union_masks(mask, grammar.precede_masks) for mask in token_masks[1:]] + [grammar.right_corner_masks[goal]]
+
+    T = [[0] * (len_input+1) for _ in range(len_input)]
+    for i in range(len_input):
+      T[i][1] = token_masks[i] & span_starts[i] & span_ends[i]
+      if not T[i][1]:
+        return False
+
+    for l in range(2, len_input+1): # Length of span
+      for s in range(len_input-l+1): # Start of span
+        allowed = span_starts[s] & span_ends[s+l-1]
+        if not allowed:
+          continue
+        cell = 0
+
+        for p in range(1,l): # Partition
+          left, right = T[s][p], T[s+p][l-p]
+          if not left or not right:
+            continue
+
+          while left:
+            low_bit = left & -left
+            left ^= low_bit
+            B = low_bit.bit_length() - 1
+
+            matches = right & right_partner_masks[B]
+            while matches:
+              match_bit = matches & -matches
+              matches ^= match_bit
+              cell |= pair_head_masks[B][match_bit.bit_length() - 1]
+
+          if l == len_input and grammar.close_mask(cell) & goal_bit:
+            return True
+
+        T[s][l] = grammar.close_mask(cell) & allowed
+
+    return bool(T[0][len_input] & goal_bit)
+
   # Returns whether we can parse some code as a given non_terminal
   def is_parse_successful(self, to_parse, non_terminal = 'statements'):
-    T, back = self.parse_beam(to_parse)
+    if self.recogniser_mode == 'earley':
+      is_successful = self.earley_recogniser.recognise(to_parse, non_terminal)
+      if self.block_counters is not None:
+        self.add_block_counts(cells_filled=self.earley_recogniser.num_cells)
+      return is_successful
+
+    if self.recogniser_mode == 'early_exit':
+      return self.recognise_early_exit(to_parse, non_terminal)
+
+    if self.recogniser_mode == 'bitset':
+      T = self.recognise(to_parse)
+      return bool(T[0][len(to_parse)] >> self.compiled_grammar.get_id(non_terminal) & 1)
+
+    T, back = self.parse_beam(to_parse, non_terminal)
     # print('dict', T[10][11]['dict'])
 
-    return T[0][len(to_parse)][non_terminal] > 0
+    return non_terminal in T[0][len(to_parse)]
   
-  # Parses block collection based on number of threads
-  def parse_block_collection(self, blocks):
-    if self.threads <= 1:
-      for block in blocks:
-        return self.is_parse_successful(block)
+  # Runs a parser method over every block, in the order of blocks.
+  # With a block cache, cached results are reused and each distinct uncached block is only run once.
+  # With metrics, each result comes as (result, block metrics) as from run_block
+  def map_blocks(self, method_name, blocks, with_metrics=False):
+    if self.block_cache is None or method_name not in CACHEABLE_METHODS:
+      return self.run_blocks(method_name, blocks, with_metrics)
+
+    settings = (self.beam_search_n, self.fast_mode, self.recogniser_mode, self.correction_mode, self.grammar_checksum, self.code_checksum)
+    keys = [self.block_cache.get_key(method_name, block, settings) for block in blocks]
+
+    results = [None] * len(blocks)
+    # Blocks to run, by key
+    to_run = {}
+    for block_i, key in enumerate(keys):
+      found, result = self.block_cache.get(key)
+      if found:
+        results[block_i] = (result, self.get_cached_block_metrics(method_name, blocks[block_i])) if with_metrics else result
+      elif key not in to_run:
+        to_run[key] = blocks[block_i]
+
+    run_results = dict(zip(to_run.keys(), self.run_blocks(method_name, list(to_run.values()), with_metrics)))
+    for key, result in run_results.items():
+      self.block_cache.put(key, result[0] if with_metrics else result)
+
+    for block_i, key in enumerate(keys):
+      if key in run_results:
+        results[block_i] = run_results[key]
+        # A block run once for several places only counts its work in the first
+        if with_metrics:
+          run_results[key] = (run_results[key][0], self.get_cached_block_metrics(method_name, blocks[block_i]))
+
+    return results
+
+  # Runs a parser method over every block on the pool or processes available, longest (most expensive) block first.
+  # Results come back in the order of blocks. Diagnostic output being captured comes back from the other processes
+  # with each result, and is added to the capture in the order the blocks ran in, as when they run in this process
+  def run_blocks(self, method_name, blocks, with_metrics=False):
+    order = sorted(range(len(blocks)), key=lambda i: len(blocks[i]), reverse=True)
+    ordered_blocks = [blocks[i] for i in order]
+    in_other_processes = self.pool is not None or self.threads > 1
+    capture = in_other_processes and is_capturing()
+
+    if self.pool is not None:
+      ordered_results = self.pool.map(method_name, ordered_blocks, self.beam_search_n, with_metrics, capture)
+    elif self.threads <= 1:
+      ordered_results = [self.run_block(method_name, with_metrics, block) for block in ordered_blocks]
     else:
-      with ProcessPoolExecutor(self.threads) as executor2:
-        func = partial(self.is_parse_successful)
-        is_block_successful = list(executor2.map(func, blocks))
+      run_block = self.run_block_capturing_debug_log if capture else self.run_block
+      with ProcessPoolExecutor(self.threads) as executor:
+        ordered_results = list(executor.map(partial(run_block, method_name, with_metrics), ordered_blocks))
+
+    results = [None] * len(blocks)
+    for block_i, result in zip(order, ordered_results):
+      if capture:
+        result, debug_lines = result
+        add_captured_lines(debug_lines)
+      results[block_i] = result
+
+    return results
+
+  # Calls a parser method on a block. With metrics returns (result, block metrics), the block metrics being
+  # the method, number of tokens, seconds taken and the counters of BLOCK_COUNTERS
+  def run_block(self, method_name, with_metrics, block):
+    if not with_metrics:
+      return getattr(self, method_name)(block)
+
+    self.block_counters = dict.fromkeys(BLOCK_COUNTERS, 0)
+    start = time.perf_counter()
+    try:
+      result = getattr(self, method_name)(block)
+    finally:
+      block_metrics = dict(method=method_name, tokens=len(block), seconds=time.perf_counter() - start, **self.block_counters)
+      self.block_counters = None
+    return result, block_metrics
+
+  # Calls run_block capturing its diagnostic output, for a block run in another process. Returns (result, debug lines)
+  def run_block_capturing_debug_log(self, method_name, with_metrics, block):
+    with capture_debug_log() as debug_lines:
+      result = self.run_block(method_name, with_metrics, block)
+    return result, debug_lines
+
+  # Metrics of a block whose result came from the block cache, or from running the same tokens elsewhere
+  def get_cached_block_metrics(self, method_name, block):
+    return dict(method=method_name, tokens=len(block), seconds=0, cached=True, **dict.fromkeys(BLOCK_COUNTERS, 0))
+
+  # Adds counts to the counters of the block being run
+  def add_block_counts(self, **counts):
+    for name, count in counts.items():
+      self.block_counters[name] += count
+
+  # Context adding the time spent in it to a phase of the metrics, if metrics are collected
+  def time_phase(self, phase_name):
+    if self.metrics is None:
+      return nullcontext()
+    return self.metrics.phase(phase_name)
+
+  # Runs a parser method over the blocks of every indent level as one flat batch, keeping the (indent, index) layout
+  def map_blocks_collection(self, method_name, blocks_collection):
+    flat_blocks = [block for blocks in blocks_collection for block in blocks]
+    flat_results = self.map_blocks(method_name, flat_blocks)
+
+    results = []
+    block_i = 0
+    for blocks in blocks_collection:
+      results.append(flat_results[block_i:block_i+len(blocks)])
+      block_i += len(blocks)
+
+    return results
 
-        return is_block_successful
+  # Parses block collection based on number of threads
+  def parse_block_collection(self, blocks):
+    return self.map_blocks('is_parse_successful', blocks)
 
   # Parse with beam search and block parsing, keep track of grammar rules used
   def is_parse_successful_parse_beam_block(self, to_parse): 
-    with ProcessPoolExecutor(self.threads) as executor:
-      # Collection of blocks for each indentation level
-      blocks_collection = split_into_blocks(to_parse)
-      if self.threads <= 1:
-        parsed_block_coll = []
-        for indent in range(len(blocks_collection)):
-          block_collection = blocks_collection[indent]
-          # print('block collection', block_collection)
-          parsed_block_coll.append(self.parse_block_collection(block_collection))
+    # Collection of blocks for each indentation level
+    blocks_collection = split_into_blocks(to_parse)
+    result = self.map_blocks_collection('is_parse_successful', blocks_collection)
+    is_valid = all(b_result for indent_b in result for b_result in indent_b)
+
+    return is_valid, result
+
+  # Length one corrections of every head with a terminal production, for a single token
+  def get_token_corrections(self, token, i):
+    grammar = self.compiled_grammar
+    corrections = {}
+
+    exact_heads = grammar.terminal_heads.get(token)
+    if not exact_heads:
+      return corrections
+
+    for A in grammar.heads_with_terminal_rules:
+      if A in exact_heads:
+        corrections[A] = ()
       else:
-          func = partial(self.parse_block_collection)
-          result = list(executor.map(func, blocks_collection))
+        production = grammar.terminal_rules[A][0]
+        if production == "''":
+          corrections[A] = ((DELETE, i, None),)
+        else:
+          corrections[A] = ((REPLACE, i, production),)
 
-          for indent_b in result:
-            for b_result in indent_b:
-              if b_result == False:
-                return False, result
-      
-          return True, result
+    return corrections
 
   # Parsing algorithm adapted for error correction referencing MartinLange
   def parse_with_err_correction(self, to_parse):
     len_input = len(to_parse)
+    grammar = self.compiled_grammar
+    rules_by_left = grammar.rules_by_left
+    rules_by_right = grammar.rules_by_right
 
-    T = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input+1)]
+    # Chart of non terminal ids to corrections, backpointers and correction summaries, converted to names once filled
+    chart = [[{} for _ in range(len_input+1)] for _ in range(len_input+1)]
     
-    for i, (token, token_id) in enumerate(to_parse):
+    for i in range(len_input):
+      token = to_parse[i][0]
       # If token is stub-block, we take it as a block
       if token == 'STUB-BLOCK':
-        T[i][1]['statements'] = ([], None)
+        chart[i][1][grammar.get_id('statements')] = ((), None, self.get_token_summary(token, ()))
         continue
-      for head, productions in self.grammar.items():
-        for production in productions.keys():
-          if len(production.split(' ')) == 1:
-            for lhs in self.rev_grammar.get((token,), []):
-              if head != lhs and head not in T[i][1]:
-                T[i][1][head] = ([['r', str(i), {production}]], None)
-              elif head == lhs:
-                T[i][1][head] = ([], None)
+      for A, correction in self.get_token_corrections(token, i).items():
+        chart[i][1][A] = (correction, None, self.get_token_summary(token, correction))
 
     for l in range(2, len_input+1): # Length of span
       for s in range(len_input - l + 1): # Start of span
-        for A, productions in self.grammar.items():
-          if self.fast_mode and A in T[s][l] and len(T[s][l][A][0])==0:
+        cell = chart[s][l]
+
+        for p in range(1,l): # Partition
+          right = chart[s+p][l-p]
+          if not right:
             continue
-          
-          for p in range(1,l+1): # Partition
-            for production in productions.keys():
-              production_arr = production.split(' ')
-              if len(production_arr) == 2:
-                B, C = production_arr
-
-                # Composed correction
-                if B in T[s][p] and C in T[s+p][l-p]:
-                  p1, p2 = T[s][p][B][0], T[s+p][l-p][C][0]
-                  
-                  if self.fast_mode and (len(p1)>3 or len(p2)>3):
-                    pass
-                  else:
-                    correction = self.correction_service.compose(p1,p2)
-
-                    # if A not in T[s][l] or len(correction) < len(T[s][l][A][0]):
-                    if A not in T[s][l] or self.compare_corrections(correction, T[s][l][A][0], to_parse):
-                      T[s][l][A] = (correction, (p,B,C))
-
-                # Insertion correction case 1
-                if B in T[s][l] and C in self.insertion_map:
-                  p_list = T[s][l][B][0]
-                  sigma = self.insertion_map[C]
-
-                  if self.fast_mode and (len(p_list)>3 or len(sigma)>3):
-                    pass
-                  else:
-                    correction = self.correction_service.compose_for_insertion_forward(p_list, sigma, s+l)
-                    # if A not in T[s][l] or len(correction) < len(T[s][l][A][0]):
-                    if A not in T[s][l] or self.compare_corrections(correction, T[s][l][A][0], to_parse):
-                      T[s][l][A] = (correction, (None, B, None))
-                
-                # Insertion correction case 2
-                if C in T[s][l] and B in self.insertion_map:
-                  p_list = T[s][l][C][0]
-                    
-                  sigma = self.insertion_map[B]
-                  sigma = self.correction_service.offset_indices(sigma, s)
-
-                  if self.fast_mode and (len(p_list)>3 or len(sigma)>3):
-                    pass
-                  else:
-                    correction = self.correction_service.compose_for_insertion_backward(p_list, sigma, s)
-                    # if A not in T[s][l] or len(correction) < len(T[s][l][A][0]):
-                    if A not in T[s][l] or self.compare_corrections(correction, T[s][l][A][0], to_parse):
-                      T[s][l][A] = (correction, (None, None, C))
+
+          for B, (p1, _, summary_B) in chart[s][p].items():
+            for C, A, rule_id in rules_by_left[B]:
+              if self.fast_mode and A in cell and len(cell[A][0])==0:
+                continue
+
+              # Composed correction
+              if C in right:
+                p2, _, summary_C = right[C]
+
+                if self.fast_mode and (len(p1)>3 or len(p2)>3):
+                  continue
+                correction = self.correction_service.compose(p1,p2)
+
+                if A not in cell or self.compare_corrections(correction, (summary_B, summary_C), cell[A][0], cell[A][2], s, l, to_parse):
+                  cell[A] = (correction, (p,B,C), self.concat_summaries(correction, summary_B, summary_C, s, l, to_parse))
+
+        # Insertion correction case 1
+        for B, (p_list, _, summary_B) in list(cell.items()):
+          for C, A, rule_id in rules_by_left[B]:
+            sigma = grammar.insertions[C]
+            if sigma is None or (self.fast_mode and A in cell and len(cell[A][0])==0):
+              continue
+
+            if self.fast_mode and (len(p_list)>3 or len(sigma)>3):
+              continue
+            correction = self.correction_service.compose_for_insertion_forward(p_list, sigma, s+l)
+            parts = (summary_B, self.insertion_summaries[C])
+            if A not in cell or self.compare_corrections(correction, parts, cell[A][0], cell[A][2], s, l, to_parse):
+              cell[A] = (correction, (None, B, None), self.concat_summaries(correction, *parts, s, l, to_parse))
+            
+        # Insertion correction case 2
+        for C, (p_list, _, summary_C) in list(cell.items()):
+          for B, A, rule_id in rules_by_right[C]:
+            sigma = grammar.insertions[B]
+            if sigma is None or (self.fast_mode and A in cell and len(cell[A][0])==0):
+              continue
+
+            sigma = self.correction_service.offset_indices(sigma, s)
+            if self.fast_mode and (len(p_list)>3 or len(sigma)>3):
+              continue
+            correction = self.correction_service.compose_for_insertion_backward(p_list, sigma, s)
+            parts = (self.insertion_summaries[B], summary_C)
+            if A not in cell or self.compare_corrections(correction, parts, cell[A][0], cell[A][2], s, l, to_parse):
+              cell[A] = (correction, (None, None, C), self.concat_summaries(correction, *parts, s, l, to_parse))
+
+    T = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input+1)]
+    for s in range(len_input):
+      for l in range(1, len_input-s+1):
+        for A, (correction, backpointer, summary) in chart[s][l].items():
+          T[s][l][grammar.symbols[A]] = (correction, grammar.backpointer_to_names(backpointer))
 
     return T
   
-  # Beam with error correction
-  def parse_with_err_correction_beam(self, to_parse):
+  # Beam with error correction.
+  # units optionally maps spans (s, l) of to_parse standing for tokens left out of the correction, as from
+  # get_window_units, to (cell, prefix pairs, suffix pairs, first token, last token). Positions under a unit have
+  # no corrections; a unit parses as the non terminals of its cell, and as a symbol of its own with a rule
+  # A -> (unit) C for each prefix pair (A, C) and A -> B (unit) for each suffix pair (A, B). With units the beam is
+  # WINDOW_BEAM_FACTOR times as wide.
+  # hyperedges is an optional dict of lists the candidates built for each (A, s, l) are added to, kept or not, as
+  # the edges K_Best_Corrections enumerates corrections from
+  def parse_with_err_correction_beam(self, to_parse, units=None, hyperedges=None):
     len_input = len(to_parse)
-
-    T = [[defaultdict(float) for _ in range(len_input+1)] for _ in range(len_input+1)]
-    table_w_corrections = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
+    grammar = self.compiled_grammar
+    rule_log_probs = grammar.rule_log_probs
+    rules_by_left = grammar.rules_by_left
+    insertion_rules_by_left = self.insertion_rules_by_left
+    insertion_rules_by_right = self.insertion_rules_by_right
+    symbols = grammar.symbols
+    beam_search_n = self.beam_search_n
+    if units:
+      rule_log_probs, rules_by_left, insertion_rules_by_left, insertion_rules_by_right, symbols, unit_symbols = self.add_unit_rules(units)
+      beam_search_n *= WINDOW_BEAM_FACTOR
+
+    # Charts of non terminal ids to log probabilities and to corrections, converted to names once filled,
+    # and summaries of the corrections. Candidates carry the summaries their correction is composed of,
+    # which are only concatenated once a candidate is kept
+    chart = [[{} for _ in range(len_input+1)] for _ in range(len_input+1)]
+    chart_w_corrections = [[{} for _ in range(len_input+1)] for _ in range(len_input)]
+    summaries = [[{} for _ in range(len_input+1)] for _ in range(len_input)]
+    # Counts for the block metrics
+    num_kept = num_pruned = num_composed = num_compared = num_rules_skipped = 0
 
     # Update T and table_w_corrections based on candidates
     def update_tables_with_beam(candidates, s, l):
+      nonlocal num_kept, num_pruned
       beam_candidates = []
-      for _ in range(self.beam_search_n):
+      for _ in range(beam_search_n):
         if candidates:
           curr = heapq.heappop(candidates)
           top_val = curr[0]
@@ -311,275 +799,557 @@ class CYK_Parser():
           while candidates and candidates[0][0] == top_val:
             beam_candidates.append(heapq.heappop(candidates))
 
+      # Next to a unit, the heads its cell or rules combine with are kept past the beam, since the unit can't be
+      # corrected to fit any other
+      if units and candidates and (s in needed_after or s+l in needed_before):
+        needed = needed_after.get(s, 0) | needed_before.get(s+l, 0)
+        beam_candidates += [candidate for candidate in candidates if needed >> candidate[1][0] & 1]
+        candidates = [candidate for candidate in candidates if not needed >> candidate[1][0] & 1]
+
+      num_kept += len(beam_candidates)
+      num_pruned += len(candidates)
       if beam_candidates:          
-        for neg_prob, (lhs, correction, backpointer) in beam_candidates:
+        cell, cell_w_corrections = chart[s][l], chart_w_corrections[s][l]
+        for neg_log_prob, (lhs, correction, backpointer, parts) in beam_candidates:
           # Only update T if candidates probability is higher and correction length is equal or shorter
-          if len(table_w_corrections[s][l][lhs])==0 or (len(correction) < len(table_w_corrections[s][l][lhs][0])) or (len(correction) == len(table_w_corrections[s][l][lhs][0]) and -neg_prob > T[s][l][lhs]):
-            T[s][l][lhs] = -neg_prob
-            table_w_corrections[s][l][lhs] = (correction, backpointer)
+          if lhs not in cell_w_corrections or (len(correction) < len(cell_w_corrections[lhs][0])) or (len(correction) == len(cell_w_corrections[lhs][0]) and -neg_log_prob > cell[lhs]):
+            cell[lhs] = -neg_log_prob
+            cell_w_corrections[lhs] = (correction, backpointer)
+            summaries[s][l][lhs] = self.concat_summaries(correction, *parts, s, l, to_parse)
     
+    # Units parse as their cell and their own symbol, uncorrected
+    unit_positions = set()
+    needed_after, needed_before = {}, {}
+    if units:
+      for (s, l), (cell, prefix_pairs, suffix_pairs, first_token, last_token) in units.items():
+        unit_positions.update(range(s, s+l))
+        if prefix_pairs:
+          needed = grammar.union_masks(cell, grammar.right_partner_masks)
+          for A, C in prefix_pairs:
+            needed |= 1 << C
+          needed_after[s+l] = needed_after.get(s+l, 0) | needed
+        if suffix_pairs:
+          needed = grammar.union_masks(cell, self.earley_recogniser.left_partner_masks)
+          for A, B in suffix_pairs:
+            needed |= 1 << B
+          needed_before[s] = needed_before.get(s, 0) | needed
+        for A in grammar.mask_to_ids(cell) + [unit_symbols[s, l]]:
+          chart[s][l][A] = 0.0
+          chart_w_corrections[s][l][A] = ((), None)
+          summaries[s][l][A] = (0, 0, 0, 0, first_token, last_token)
+
     # Update length 1
     for i, (token, token_id, code_pos) in enumerate(to_parse):
+      if i in unit_positions:
+        continue
+
       # If token is stub-block, we take it as a block
       if token == 'STUB-BLOCK':
-        T[i][1]['statements'] = 1
-        table_w_corrections[i][1]['statements'] = ([], None)
+        statements = grammar.get_id('statements')
+        chart[i][1][statements] = 0.0
+        chart_w_corrections[i][1][statements] = ((), None)
+        summaries[i][1][statements] = self.get_token_summary(token, ())
+        if hyperedges is not None:
+          hyperedges[statements, i, 1].append((0, 0.0, None, ()))
         continue
 
-      for head, productions in self.grammar.items():
-        for production in productions.keys():
-          if len(production.split(' ')) == 1:
-            for lhs in self.rev_grammar.get((token,), []):
-              if head != lhs and head not in T[i][1]:
-                if production == "''":
-                  table_w_corrections[i][1][head] = ([['d', str(i)]], None)
-                else:
-                  table_w_corrections[i][1][head] = ([['r', str(i), production]], None)
-                
-                # TODO: update the probability of each based on prior distribution?
-                T[i][1][head] = 1e-2
-              elif head == lhs:
-                table_w_corrections[i][1][head] = ([], None)
-                T[i][1][head] = 1
+      for A, correction in self.get_token_corrections(token, i).items():
+        chart_w_corrections[i][1][A] = (correction, None)
+        summaries[i][1][A] = self.get_token_summary(token, correction)
+        # TODO: update the probability of each based on prior distribution?
+        chart[i][1][A] = LOG_TOKEN_CORRECTION_PROB if correction else 0.0
+        if hyperedges is not None:
+          hyperedges[A, i, 1].append((len(correction), -chart[i][1][A], None, correction))
 
     for l in range(1, len_input+1): # Length of span
       for s in range(len_input-l+1): # Start of span
         candidates = []
+        cell, cell_w_corrections, cell_summaries = chart[s][l], chart_w_corrections[s][l], summaries[s][l]
 
         for p in range(1,l): # Partition
-          for A, productions in self.grammar.items():
-            for production, rule_prob in productions.items():
-              production_arr = production.split(' ')
-              if len(production_arr) == 2:
-                B, C = production_arr
-              
-                # Composed correction
-                if T[s][p][B] > 0 and T[s+p][l-p][C] > 0:
-                  p1, p2 = table_w_corrections[s][p][B][0], table_w_corrections[s+p][l-p][C][0]
-                  
-                  if self.fast_mode and (len(p1)>3 or len(p2)>3):
-                    pass
-                  else:
-                    correction = self.correction_service.compose(p1,p2)
-
-                    # If current correction for non terminal is better than the previously saved one, we consider it
-                    if T[s][l][A] == 0 or (T[s][l][A] > 0 and self.compare_corrections(correction, table_w_corrections[s][l][A][0], to_parse)):
-                      total_prob = T[s][p][B] * T[s+p][l-p][C] * rule_prob
-                      heapq.heappush(candidates, (-total_prob, (A, correction, (p, B, C))))
+          right, right_w_corrections, right_summaries = chart[s+p][l-p], chart_w_corrections[s+p][l-p], summaries[s+p][l-p]
+          if not right:
+            continue
 
+          left_w_corrections, left_summaries = chart_w_corrections[s][p], summaries[s][p]
+          for B, log_prob_B in chart[s][p].items():
+            p1 = left_w_corrections[B][0]
+            if self.fast_mode and len(p1)>3:
+              continue
+
+            for C, A, rule_id in rules_by_left[B]:
+              # Composed correction
+              if C in right:
+                p2 = right_w_corrections[C][0]
+
+                if self.fast_mode and len(p2)>3:
+                  continue
+                correction = self.correction_service.compose(p1,p2)
+                num_composed += 1
+                parts = (left_summaries[B], right_summaries[C])
+                if hyperedges is not None and rule_log_probs[rule_id] > NEG_INF:
+                  hyperedges[A, s, l].append((0, -rule_log_probs[rule_id], (p, B, C), None))
+
+                # If current correction for non terminal is better than the previously saved one, we consider it
+                if A in cell:
+                  num_compared += 1
+                  if not self.compare_corrections(correction, parts, cell_w_corrections[A][0], cell_summaries[A], s, l, to_parse):
+                    continue
+                total_log_prob = log_prob_B + right[C] + rule_log_probs[rule_id]
+                if total_log_prob > NEG_INF:
+                  candidates.append((-total_log_prob, (A, correction, (p, B, C), parts)))
+
+        heapq.heapify(candidates)
         update_tables_with_beam(candidates, s, l)
         candidates = []
 
         # Update insertions
-        for A, productions in self.grammar.items():
-          for production, rule_prob in productions.items():
-            production_arr = production.split(' ')
-            if len(production_arr) == 2:
-              B, C = production_arr
-
-              # Insertion correction case 1
-              if T[s][l][B] > 0 and C in self.insertion_map:
-                p_list = table_w_corrections[s][l][B][0]
-                sigma = self.insertion_map[C]
-
-                if self.fast_mode and (len(p_list)>3 or len(sigma)>3):
-                  pass
-                else:
-                  correction = self.correction_service.compose_for_insertion_forward(p_list, sigma, s+l)
-
-                  if T[s][l][A] == 0 or (T[s][l][A] > 0 and self.compare_corrections(correction, table_w_corrections[s][l][A][0], to_parse)):
-                    # Total prob is probability of B, probability of there being such an insertion for C, and probability of A->BC
-                    total_prob = T[s][l][B] * self.correction_to_prob(sigma) * rule_prob
-                    heapq.heappush(candidates, (-total_prob, (A, correction, (-1, B, 'NONE'))))
+        # Insertion correction case 1
+        for B, log_prob_B in cell.items():
+          p_list = cell_w_corrections[B][0]
+          if self.fast_mode and len(p_list)>3:
+            num_rules_skipped += len(rules_by_left[B])
+            continue
+          num_rules_skipped += len(rules_by_left[B]) - len(insertion_rules_by_left[B])
+
+          for C, A, rule_id in insertion_rules_by_left[B]:
+            sigma = grammar.insertions[C]
+            correction = self.correction_service.compose_for_insertion_forward(p_list, sigma, s+l)
+            num_composed += 1
+            parts = (cell_summaries[B], self.insertion_summaries[C])
+            if hyperedges is not None:
+              hyperedges[A, s, l].append((len(sigma), -self.correction_to_log_prob(sigma) - rule_log_probs[rule_id], (l, B, C), None))
+
+            if A in cell:
+              num_compared += 1
+              if not self.compare_corrections(correction, parts, cell_w_corrections[A][0], cell_summaries[A], s, l, to_parse):
+                continue
+            # Total prob is probability of B, probability of there being such an insertion for C, and probability of A->BC
+            total_log_prob = log_prob_B + self.correction_to_log_prob(sigma) + rule_log_probs[rule_id]
+            if total_log_prob > NEG_INF:
+              candidates.append((-total_log_prob, (A, correction, (NONE, B, NONE), parts)))
               
-              # Insertion correction case 2
-              if T[s][l][C] > 0 and B in self.insertion_map:
-                p_list = table_w_corrections[s][l][C][0]
-                  
-                sigma = self.insertion_map[B]
-                sigma = self.correction_service.offset_indices(sigma, s)
-
-                if self.fast_mode and (len(p_list)>3 or len(sigma)>3):
-                  pass
-                else:
-                  correction = self.correction_service.compose_for_insertion_backward(p_list, sigma, s)
-                  
-                  if T[s][l][A] == 0 or (T[s][l][A] > 0 and self.compare_corrections(correction, table_w_corrections[s][l][A][0], to_parse)):
-                    # Total prob is probability of there being such an insertion for B, probability of C, and probability of A->BC
-                    total_prob = T[s][l][C] * self.correction_to_prob(sigma) * rule_prob
-                    heapq.heappush(candidates, (-total_prob, (A, correction, (-1, 'NONE', C))))      
-
+        # Insertion correction case 2
+        offset_insertions = {}
+        for C, log_prob_C in cell.items():
+          p_list = cell_w_corrections[C][0]
+          # Units are never a right child of the grammar's rules
+          num_grammar_rules = len(grammar.rules_by_right[C]) if C < grammar.num_symbols else 0
+          if self.fast_mode and len(p_list)>3:
+            num_rules_skipped += num_grammar_rules
+            continue
+          num_rules_skipped += num_grammar_rules - len(insertion_rules_by_right[C])
+
+          for B, A, rule_id in insertion_rules_by_right[C]:
+            if B not in offset_insertions:
+              offset_insertions[B] = self.correction_service.offset_indices(grammar.insertions[B], s)
+            sigma = offset_insertions[B]
+
+            correction = self.correction_service.compose_for_insertion_backward(p_list, sigma, s)
+            num_composed += 1
+            parts = (self.insertion_summaries[B], cell_summaries[C])
+            if hyperedges is not None:
+              hyperedges[A, s, l].append((len(sigma), -self.correction_to_log_prob(sigma) - rule_log_probs[rule_id], (0, B, C), None))
+            
+            if A in cell:
+              num_compared += 1
+              if not self.compare_corrections(correction, parts, cell_w_corrections[A][0], cell_summaries[A], s, l, to_parse):
+                continue
+            # Total prob is probability of there being such an insertion for B, probability of C, and probability of A->BC
+            total_log_prob = log_prob_C + self.correction_to_log_prob(sigma) + rule_log_probs[rule_id]
+            if total_log_prob > NEG_INF:
+              candidates.append((-total_log_prob, (A, correction, (NONE, NONE, C), parts)))
+
+        heapq.heapify(candidates)
         update_tables_with_beam(candidates, s, l)
+
+    if self.block_counters is not None:
+      self.add_block_counts(cells_filled=sum(1 for row in chart_w_corrections for cell in row if cell), candidates_pushed=num_kept+num_pruned, candidates_pruned=num_pruned, corrections_composed=num_composed, compare_corrections_calls=num_compared, rules_skipped=num_rules_skipped)
+
+    T = [[{} for _ in range(len_input+1)] for _ in range(len_input+1)]
+    table_w_corrections = [[defaultdict(list) for _ in range(len_input+1)] for _ in range(len_input)]
+    for s in range(len_input):
+      for l in range(1, len_input-s+1):
+        T[s][l] = {symbols[A]: log_prob for A, log_prob in chart[s][l].items()}
+        for A, (correction, backpointer) in chart_w_corrections[s][l].items():
+          if backpointer is not None:
+            p, B, C = backpointer
+            backpointer = (p, 'NONE' if B == NONE else symbols[B], 'NONE' if C == NONE else symbols[C])
+          table_w_corrections[s][l][symbols[A]] = (correction, backpointer)
         
     return table_w_corrections, T
+
+  # Tables of parse_with_err_correction_beam extended with a symbol for each unit and its rules, which have
+  # log probability 0 as the units do. Returns them with the symbol of each unit by position
+  def add_unit_rules(self, units):
+    grammar = self.compiled_grammar
+    rule_log_probs = array('d', grammar.rule_log_probs)
+    rules_by_left = list(grammar.rules_by_left)
+    insertion_rules_by_left = list(self.insertion_rules_by_left)
+    unit_symbols = {}
+    for span, (cell, prefix_pairs, suffix_pairs, first_token, last_token) in units.items():
+      U = unit_symbols[span] = len(rules_by_left)
+      rules_by_left.append([])
+      for A, C in prefix_pairs:
+        rules_by_left[U].append((C, A, len(rule_log_probs)))
+        rule_log_probs.append(0.0)
+      for A, B in suffix_pairs:
+        rules_by_left[B] = rules_by_left[B] + [(U, A, len(rule_log_probs))]
+        rule_log_probs.append(0.0)
+      insertion_rules_by_left.append(self.get_insertion_rules(rules_by_left[U]))
+
+    # Units are never inserted, so they have no insertion rules by right child
+    insertion_rules_by_right = self.insertion_rules_by_right + [[] for _ in units]
+    symbols = grammar.symbols + [f'UNIT-{s}-{l}' for s, l in units]
+    return rule_log_probs, rules_by_left, insertion_rules_by_left, insertion_rules_by_right, symbols, unit_symbols
   
-  def correct_single_block(self, block):
+  # Normalised correction parsing a block as statements. It only refers to token indices, so it applies to any block with the same token types
+  def get_block_correction(self, block):
     if len(block) > 0:
+      if self.correction_mode == 'window':
+        correction = self.get_window_correction(block)
+        if correction is not None:
+          return correction
+      if self.correction_mode == 'agenda':
+        correction = self.get_agenda_correction(block)
+        if correction is not None:
+          return correction
+
       T_with_corr, T_prob = self.parse_with_err_correction_beam(block)
-      return self.get_corrected_block(block, T_with_corr)
-    return []
-  
-  def correct_block_collection(self, blocks):
-    with ProcessPoolExecutor(self.threads) as executor2:
-      func = partial(self.correct_single_block)
-      result = list(executor2.map(func, blocks))
+      return self.get_block_statements_correction(block, T_with_corr)
+    return ()
+
+  # Correction of a block with the fewest edits from the Agenda_Corrector, scoring tokens as
+  # parse_with_err_correction_beam does. Returns None once it pops AGENDA_MAX_POPS items
+  def get_agenda_correction(self, block):
+    grammar = self.compiled_grammar
+    token_corrections = []
+    for i, (token, token_id, code_pos) in enumerate(block):
+      if token == 'STUB-BLOCK':
+        token_corrections.append({grammar.get_id('statements'): ((), 0.0)})
+      else:
+        token_corrections.append({A: (correction, LOG_TOKEN_CORRECTION_PROB if correction else 0.0) for A, correction in self.get_token_corrections(token, i).items()})
+
+    correction, counts = self.agenda_corrector.get_correction(token_corrections, grammar.get_id('statements'), AGENDA_MAX_POPS)
+    if self.block_counters is not None:
+      self.add_block_counts(**counts)
+    return correction
+
+  # Correction of a block from the error correcting beam over a window of its tokens, with the tokens before and
+  # after the window collapsed into the units of get_window_units. The window starts WINDOW_TOKENS either side of
+  # the error the recognisers find and doubles until its correction makes the block parse.
+  # Returns None once the window would be the whole block
+  def get_window_correction(self, block):
+    statements = self.compiled_grammar.get_id('statements')
+    prefix_trace, suffix_trace = {}, {}
+    columns = self.earley_recogniser.get_columns(block, statements, trace=prefix_trace)
+    if columns is not None and columns[-1].get(0, 0) >> statements & 1:
+      return ()
+    self.reverse_earley_recogniser.get_columns(block[::-1], statements, trace=suffix_trace)
+
+    # The tokens before error_start can begin a block and those from error_end can end one,
+    # so every window from at most error_start to at least error_end leaves them out
+    error_start = len(prefix_trace['columns']) - 1
+    error_end = len(block) - (len(suffix_trace['columns']) - 1)
+
+    window = WINDOW_TOKENS
+    while True:
+      start, end = max(0, error_start - window), min(len(block), max(error_start + 1, error_end) + window)
+      if start == 0 and end == len(block):
+        return None
+      window *= 2
+
+      code, units, positions = self.get_window_units(block, start, end, prefix_trace, suffix_trace)
+      if len(code) >= len(block):
+        continue
+      log_debug(logger, 'correcting tokens %d to %d of %d as %d', start, end, len(block), len(code))
+      T_with_corr, T_prob = self.parse_with_err_correction_beam(code, units)
+      if 'statements' not in T_with_corr[0][len(code)]:
+        continue
+
+      correction = self.window_to_block_correction(T_with_corr[0][len(code)]['statements'][0], positions)
+      if self.earley_recogniser.recognise(self.correction_service.apply_correction(correction, block)):
+        return correction
+
+  # The tokens of the block from start to end, with the spans of get_stack_units of the tokens before start, and
+  # of those from end found parsing them backwards, as units. Spans of different stacks overlap, so the code has a
+  # position for each part of the block between their ends, which stands in the code as its token next to the
+  # window, the one corrections next to it are scored against.
+  # Returns the code, its units by span and the position in the block of each position of the code and its end
+  def get_window_units(self, block, start, end, prefix_trace, suffix_trace):
+    n = len(block)
+    prefix = self.earley_recogniser.get_stack_units(prefix_trace, start)
+    # Spans of the reversed block, whose pairs are rules with the unit as right child
+    suffix = [(n - unit_end, n - unit_start, cell, pairs) for unit_start, unit_end, cell, pairs in self.reverse_earley_recogniser.get_stack_units(suffix_trace, n - end)]
+
+    positions = sorted(set([0, n] + list(range(start, end)) + [unit[0] for unit in prefix + suffix] + [unit[1] for unit in prefix + suffix]))
+    code_positions = {position: i for i, position in enumerate(positions)}
+    code = [block[positions[i+1]-1] if positions[i] < start else block[positions[i]] for i in range(len(positions)-1)]
+
+    units = {}
+    for unit_start, unit_end, cell, pairs in prefix:
+      s = code_positions[unit_start]
+      units[s, code_positions[unit_end] - s] = (cell, pairs, (), block[unit_start][0], block[unit_end-1][0])
+    for unit_start, unit_end, cell, pairs in suffix:
+      s = code_positions[unit_start]
+      units[s, code_positions[unit_end] - s] = (cell, (), pairs, block[unit_start][0], block[unit_end-1][0])
+
+    return code, units, positions
+
+  # Correction of the code of get_window_units as a correction of the block. Insertions index the code once the
+  # deletions are made, which are all of window tokens, so they move by as many as the code positions do
+  def window_to_block_correction(self, correction, positions):
+    deletions = sorted(ind for op, ind, terminal in correction if op == DELETE)
+    block_correction = []
+    for op, ind, terminal in correction:
+      if op != INSERT:
+        block_correction.append((op, positions[ind], terminal))
+        continue
 
-      return result
+      code_ind = ind
+      for deletion in deletions:
+        if deletion <= code_ind:
+          code_ind += 1
+      block_correction.append((op, positions[code_ind] - (code_ind - ind), terminal))
+
+    return tuple(block_correction)
+
+  # Up to k corrections of a block giving different tokens. The first is the one get_block_correction gives, and
+  # the others those of the derivations of the beam's candidates in order of fewest edits and then highest log
+  # probability, found lazily by K_Best_Corrections, so asking for fewer builds fewer. Those that don't make the
+  # block parse, where corrections at the same index compose into something else, are left out.
+  # A block that parses only has ()
+  def get_block_corrections(self, block, k):
+    if k <= 1 or len(block) == 0:
+      return [self.get_block_correction(block)]
+    if self.is_parse_successful(block):
+      return [()]
+
+    first = self.get_block_correction(block) if self.correction_mode != 'block' else None
+    grammar = self.compiled_grammar
+    hyperedges = defaultdict(list)
+    T_with_corr, T_prob = self.parse_with_err_correction_beam(block, hyperedges=hyperedges)
+    if first is None:
+      first = self.get_block_statements_correction(block, T_with_corr)
+
+    k_best = K_Best_Corrections(hyperedges, grammar.insertions, self.correction_service)
+    goal = (grammar.get_id('statements'), 0, len(block), True)
+    corrections = [first]
+    seen_tokens = {tuple(token for token, token_id, code_pos in self.correction_service.apply_correction(first, block))}
+    for correction in k_best.iter_corrections(goal, k * K_BEST_DERIVATIONS, seen=(first,)):
+      corrected_block = self.correction_service.apply_correction(correction, block)
+      tokens = tuple(token for token, token_id, code_pos in corrected_block)
+      if tokens not in seen_tokens and self.is_parse_successful(corrected_block):
+        seen_tokens.add(tokens)
+        corrections.append(correction)
+        if len(corrections) == k:
+          break
+    return corrections
+
+  # The block corrected, or with k given, a list of it corrected by each of get_block_corrections
+  def correct_single_block(self, block, id_allocator=None, k=None):
+    if k is None:
+      return self.correction_service.apply_correction(self.get_block_correction(block), block, id_allocator)
+    return [self.correction_service.apply_correction(correction, block, id_allocator) for correction in self.get_block_corrections(block, k)]
+  
+  # Corrects every block, with the corrections applied to the caller's blocks so their token ids are kept.
+  # Inserted and replaced tokens get ids from id_allocator, or from a new allocator for these blocks
+  def correct_block_collection(self, blocks, id_allocator=None):
+    if id_allocator is None:
+      id_allocator = Token_Id_Allocator()
+
+    corrections = self.map_blocks('get_block_correction', blocks)
+    return [self.correction_service.apply_correction(correction, block, id_allocator) for correction, block in zip(corrections, blocks)]
   
   # Run the correction algorithm on each block
   def correct_code_with_err_correction_beam_block(self, to_parse):          
-    with ProcessPoolExecutor(self.threads) as executor1:
-      # Collection of blocks for each indentation level
-      blocks_collection = split_into_blocks(to_parse)
-      
-      if self.threads:
-        func = partial(self.correct_block_collection)
-        corrected_blocks = list(executor1.map(func, blocks_collection))
-      else:
-        # Correcting the blocks
-        corrected_blocks = []
-        for indent_level in range(len(blocks_collection)):
-          corrected_blocks.append([])
-
-        for indent_level in range(len(blocks_collection)-1, -1, -1):
-          blocks = blocks_collection[indent_level]
-        for block in blocks:
-          T_with_corr, T_prob = self.parse_with_err_correction_beam(block)
-          if T_with_corr:
-            corrected_blocks[indent_level].append(self.get_corrected_block(block, T_with_corr))
-
-      # print('CORRECTED BLOCKS --- ')
-      # for i in range(len(corrected_blocks)):
-      #   print (i)
-      #   for block in corrected_blocks[i]:
-      #     print(block)
-      #   print()
-
-      # Transforming transformed blocks so consecutive statements are combined
-      updated_corrected_blocks = []
-      for blocks in corrected_blocks:
-        updated_blocks = []
-        curr_block_i = 0
-        while curr_block_i < len(blocks):
-          updated_block = blocks[curr_block_i]
-
-          # Keep coalescing adjacent blocks together
-          while curr_block_i < len(blocks)-1:
-            if type(blocks[curr_block_i][-1][-1])==int and blocks[curr_block_i][-1][-1]+1 == blocks[curr_block_i+1][0][-1]:
-              updated_block += blocks[curr_block_i+1]
-              curr_block_i += 1
-            else:
-              break
-
-          updated_blocks.append(updated_block)
-          curr_block_i += 1
-        
-        updated_corrected_blocks.append(updated_blocks)
-        
-      print('UPDATED BLOCKS --- ')
-      for i in range(len(updated_corrected_blocks)):
-        print (i)
-        for block in updated_corrected_blocks[i]:
-          print(block)
-        print()
-
-      print()
-
-      corrected_code = reconstruct_blocks(updated_corrected_blocks)
+    # Collection of blocks for each indentation level
+    blocks_collection = split_into_blocks(to_parse)
+    corrections = self.map_blocks_collection('get_block_correction', blocks_collection)
+    id_allocator = Token_Id_Allocator()
+    corrected_blocks = [[self.correction_service.apply_correction(correction, block, id_allocator) for correction, block in zip(indent_corrections, blocks)] for indent_corrections, blocks in zip(corrections, blocks_collection)]
 
-      print()
-      print('CORRECTED LEXED CODE --')
-      print(corrected_code + [('ENDMARKER', -1, ())])
-      return corrected_code + [('ENDMARKER', -1, ())]
+    # Transforming transformed blocks so consecutive statements are combined
+    updated_corrected_blocks = self.coalesce_blocks(corrected_blocks, blocks_collection)
+      
+    self.log_updated_blocks(updated_corrected_blocks)
+    corrected_code = reconstruct_blocks(updated_corrected_blocks) + [('ENDMARKER', -1, ())]
+    log_debug(logger, 'CORRECTED LEXED CODE --\n%s', corrected_code)
+    return corrected_code
   
   # Optimise block correction by only correcting blocks that are not right
   def correct_code_with_err_correction_beam_block_optimised(self, to_parse):
-    is_valid, blocks_valid = self.is_parse_successful_parse_beam_block(to_parse)
-    
-    # If all blocks are valid, no need to do error correction
-    if is_valid:
-      return to_parse
+    corrected_code, num_invalid_blocks, block_seconds = self.correct_codes_with_err_correction_beam_block_optimised([to_parse])[0]
+    return corrected_code
 
-    blocks_collection = split_into_blocks(to_parse)
-    to_correct = []
-    for indent_index, indent_blocks_valid in enumerate(blocks_valid):
-      to_correct.append([])
-      for block_index, is_block_valid in enumerate(indent_blocks_valid):
-        if not is_block_valid:
-          to_correct[indent_index].append(blocks_collection[indent_index][block_index])
-        else:
-          # If the block is valid, we put a placeholder [] to make it easier when combining corrected and original blocks
-          to_correct[indent_index].append([])
-    
-    print(is_valid, blocks_valid)
-    print(to_correct)
+  # Corrects several lexed codes, checking and correcting the blocks of all of them as single batches so the
+  # work of every code is balanced over the workers together. For each code returns its corrected code (the code
+  # itself if it was valid), the number of blocks that needed correcting and the seconds spent on its blocks
+  def correct_codes_with_err_correction_beam_block_optimised(self, to_parse_collection):
+    # Collection of blocks for each indentation level, of each code
+    with self.time_phase('split_into_blocks'):
+      blocks_collections = [split_into_blocks(to_parse) for to_parse in to_parse_collection]
+    # (code, indent, index) of every block of every code
+    block_places = [(code_index, indent_index, block_index) for code_index, blocks_collection in enumerate(blocks_collections) for indent_index, blocks in enumerate(blocks_collection) for block_index in range(len(blocks))]
+    block_seconds = [0] * len(to_parse_collection)
+
+    with self.time_phase('validity'):
+      blocks_valid = self.map_blocks('is_parse_successful', [blocks_collections[c][i][b] for c, i, b in block_places], with_metrics=True)
+    self.add_block_metrics('validity', block_places, blocks_valid, block_seconds)
+
+    # Every invalid block, from every indent level of every code, is scheduled as its own task
+    to_correct = [place for place, (is_block_valid, block_metrics) in zip(block_places, blocks_valid) if not is_block_valid]
+    log_debug(logger, 'blocks to correct %s', to_correct)
+
+    with self.time_phase('correction'):
+      corrections = self.map_blocks('get_block_correction', [blocks_collections[c][i][b] for c, i, b in to_correct], with_metrics=True)
+    self.add_block_metrics('correction', to_correct, corrections, block_seconds)
+
+    corrections_by_code = [[] for _ in to_parse_collection]
+    for (code_index, indent_index, block_index), (correction, block_metrics) in zip(to_correct, corrections):
+      corrections_by_code[code_index].append(((indent_index, block_index), correction))
+
+    results = []
+    for to_parse, blocks_collection, code_corrections, seconds in zip(to_parse_collection, blocks_collections, corrections_by_code, block_seconds):
+      # If all blocks are valid, no need to do error correction
+      if not code_corrections:
+        results.append((to_parse, 0, seconds))
+        continue
 
-    with ProcessPoolExecutor(self.threads) as executor1:
-      if self.threads:
-        func = partial(self.correct_block_collection)
-        corrected_blocks = list(executor1.map(func, to_correct))
-      else:
-        # Correcting the blocks
-        corrected_blocks = []
-        for indent_level in range(len(to_correct)):
-          corrected_blocks.append([])
-
-        for indent_level in range(len(to_correct)-1, -1, -1):
-          blocks = to_correct[indent_level]
-        for block in blocks:
-          T_with_corr, T_prob = self.parse_with_err_correction_beam(block)
-          if T_with_corr:
-            print(f'correction: {T_with_corr[0][-1]["statements"][0]}')
-            corrected_blocks[indent_level].append(self.get_corrected_block(block, T_with_corr))
-
-      # Combining corrected blocks with original
-      for indent_index in range(len(blocks_collection)):
-        for block_index in range(len(blocks_collection[indent_index])):
-          # If there's a correction
-          if len(corrected_blocks[indent_index][block_index]) > 0:
-            blocks_collection[indent_index][block_index] = corrected_blocks[indent_index][block_index]
-
-      # Transforming transformed blocks so consecutive statements are combined
-      updated_corrected_blocks = []
-      for blocks in blocks_collection:
-        updated_blocks = []
-        curr_block_i = 0
-        while curr_block_i < len(blocks):
-          updated_block = blocks[curr_block_i]
-
-          # Keep coalescing adjacent blocks together
-          while curr_block_i < len(blocks)-1:
-            if type(blocks[curr_block_i][-1][-1])==int and blocks[curr_block_i][-1][-1]+1 == blocks[curr_block_i+1][0][-1]:
-              updated_block += blocks[curr_block_i+1]
-              curr_block_i += 1
-            else:
-              break
+      with self.time_phase('reconstruction'):
+        corrected_code = self.reconstruct_corrected_code(blocks_collection, code_corrections)
+      results.append((corrected_code, len(code_corrections), seconds))
+
+    return results
+
+  # Adds the time of each block to the seconds of its code, and the block metrics to the metrics if collected
+  def add_block_metrics(self, phase_name, block_places, block_results, code_seconds):
+    for (code_index, indent_index, block_index), (result, block_metrics) in zip(block_places, block_results):
+      code_seconds[code_index] += block_metrics['seconds']
+      if self.metrics is not None:
+        self.metrics.add_block(dict(block_metrics, phase=phase_name, code=code_index, indent=indent_index, index=block_index))
+
+  # Applies the corrections, by (indent, index), to the blocks of a code and joins the blocks back into its code
+  def reconstruct_corrected_code(self, blocks_collection, code_corrections):
+    # Combining corrected blocks with original. The ids of inserted and replaced tokens are unique in each code
+    id_allocator = Token_Id_Allocator()
+    corrected_blocks = [list(blocks) for blocks in blocks_collection]
+    for (indent_index, block_index), correction in code_corrections:
+      corrected_block = self.correction_service.apply_correction(correction, blocks_collection[indent_index][block_index], id_allocator)
+      # If there's a correction
+      if len(corrected_block) > 0:
+        corrected_blocks[indent_index][block_index] = corrected_block
+
+    # Transforming transformed blocks so consecutive statements are combined
+    updated_corrected_blocks = self.coalesce_blocks(corrected_blocks, blocks_collection)
+
+    self.log_updated_blocks(updated_corrected_blocks)
+    corrected_code = reconstruct_blocks(updated_corrected_blocks) + [('ENDMARKER', -1, ())]
+    log_debug(logger, 'CORRECTED LEXED CODE --\n%s', corrected_code)
+    return corrected_code
 
-          updated_blocks.append(updated_block)
-          curr_block_i += 1
-        
-        updated_corrected_blocks.append(updated_blocks)
-        
-      print('UPDATED BLOCKS --- ')
-      for i in range(len(updated_corrected_blocks)):
-        print (i)
-        for block in updated_corrected_blocks[i]:
-          print(block)
-        print()
-
-      corrected_code = reconstruct_blocks(updated_corrected_blocks)
-
-      print()
-      print('CORRECTED LEXED CODE --')
-      print(corrected_code + [('ENDMARKER', -1, ())])
-      return corrected_code + [('ENDMARKER', -1, ())]
-
-  # Given a correction, figure out the probability
-  def correction_to_prob(self, correction):
-    return 1/pow(10, len(correction))
-
-  # How to prioritise corrections 
-  def compare_corrections(self, corr1, corr2, code):
+  def log_updated_blocks(self, updated_corrected_blocks):
+    if not is_debug_enabled(logger):
+      return
+    log_debug(logger, 'UPDATED BLOCKS --- ')
+    for i, blocks in enumerate(updated_corrected_blocks):
+      log_debug(logger, '%s', i)
+      for block in blocks:
+        log_debug(logger, '%s', block)
+
+  # Combines consecutive statements of each indent level into one block.
+  # Adjacency is decided on the uncorrected blocks, whose token ids are still consecutive
+  def coalesce_blocks(self, blocks_collection, original_blocks_collection):
+    updated_corrected_blocks = []
+    for blocks, original_blocks in zip(blocks_collection, original_blocks_collection):
+      updated_blocks = []
+      curr_block_i = 0
+      while curr_block_i < len(blocks):
+        updated_block = blocks[curr_block_i]
+
+        # Keep coalescing adjacent blocks together
+        while curr_block_i < len(blocks)-1:
+          last_id, next_id = original_blocks[curr_block_i][-1][1], original_blocks[curr_block_i+1][0][1]
+          if type(last_id)==int and last_id+1 == next_id:
+            updated_block = updated_block + blocks[curr_block_i+1]
+            curr_block_i += 1
+          else:
+            break
+
+        updated_blocks.append(updated_block)
+        curr_block_i += 1
+      
+      updated_corrected_blocks.append(updated_blocks)
+
+    return updated_corrected_blocks
+
+  # Given a correction, figure out the log probability
+  def correction_to_log_prob(self, correction):
+    return -len(correction) * math.log(10)
+
+  # Summary of a correction of a span, so corrections of the same span compare without applying them:
+  # (number of insertions, number of deletions, number of operations, bigram score inside the corrected span,
+  # first and last corrected tokens). The tokens are None if the corrected span is empty
+  def get_sequence_summary(self, correction, tokens):
+    num_insertions = self.correction_service.get_num_insertions(correction)
+    num_deletions = self.correction_service.get_num_deletions(correction)
+    if not tokens:
+      return (num_insertions, num_deletions, len(correction), 0, None, None)
+
+    score = 0
+    for i in range(len(tokens)-1):
+      score += self.get_bigram_score(tokens[i], tokens[i+1])
+    return (num_insertions, num_deletions, len(correction), score, tokens[0], tokens[-1])
+
+  # Summary of a length one correction from get_token_corrections
+  def get_token_summary(self, token, correction):
+    if not correction:
+      return (0, 0, 0, 0, token, token)
+
+    op, ind, terminal = correction[0]
+    if op == DELETE:
+      return (0, 1, 1, 0, None, None)
+    return (0, 0, 1, 0, terminal, terminal)
+
+  # Summary of a correction of the span [s, s+l) composed of the corrections summarised by summary_1 and summary_2,
+  # whose corrected spans are next to each other
+  def concat_summaries(self, correction, summary_1, summary_2, s, l, code):
+    num_insertions, num_deletions = summary_1[0] + summary_2[0], summary_1[1] + summary_2[1]
+
+    # Merged operations don't keep the composed tokens, so those rare corrections are applied instead
+    if not self.correction_service.is_exact_composition(correction, summary_1[2] + summary_2[2], num_deletions, num_insertions):
+      corrected_code = self.correction_service.apply_correction(correction, code)
+      tokens = [token for token, token_id, code_pos in corrected_code[s:len(corrected_code)-len(code)+s+l]]
+      return self.get_sequence_summary(correction, tokens)
+
+    if summary_1[4] is None:
+      return (num_insertions, num_deletions, len(correction), summary_2[3], summary_2[4], summary_2[5])
+    elif summary_2[4] is None:
+      return (num_insertions, num_deletions, len(correction), summary_1[3], summary_1[4], summary_1[5])
+
+    score = summary_1[3] + summary_2[3] + self.get_bigram_score(summary_1[5], summary_2[4])
+    return (num_insertions, num_deletions, len(correction), score, summary_1[4], summary_2[5])
+
+  # Bigram score of the code with span [s, s+l) corrected, less the bigrams outside the span which every correction of it shares
+  def get_span_score(self, summary, s, l, code):
+    score, first, last = summary[3], summary[4], summary[5]
+    before = code[s-1][0] if s > 0 else None
+    after = code[s+l][0] if s+l < len(code) else None
+
+    if first is None:
+      if before is not None and after is not None:
+        score += self.get_bigram_score(before, after)
+      return score
+
+    if before is not None:
+      score += self.get_bigram_score(before, first)
+    if after is not None:
+      score += self.get_bigram_score(last, after)
+    return score
+
+  # How to prioritise corrections of the span [s, s+l) of code. corr1 is a new correction composed of the
+  # corrections summarised by parts1, and corr2 the kept correction summarised by summary2
+  def compare_corrections(self, corr1, parts1, corr2, summary2, s, l, code):
     # We always pick the shortest correction
     if len(corr1) < len(corr2):
       return True
@@ -587,27 +1357,42 @@ class CYK_Parser():
       return False
     
     # If more insertions and deletions it's preferred over replacements
-    num_one_operation_corr_1 = self.correction_service.get_num_deletions(corr1)+self.correction_service.get_num_insertions(corr1)
-    num_one_operation_corr_2 = self.correction_service.get_num_deletions(corr2)+self.correction_service.get_num_insertions(corr2)
+    num_one_operation_corr_1 = self.correction_service.get_num_insertions_and_deletions(corr1)
+    num_one_operation_corr_2 = summary2[0] + summary2[1]
     if num_one_operation_corr_1 > num_one_operation_corr_2:
       return True
     elif num_one_operation_corr_1 < num_one_operation_corr_2:
       return False
 
-    # print(corr1, corr2, code)
-    # If the corrections are the same length, we calculate the probabilities
-    code_corr_1 = self.correction_service.apply_correction(corr1, code)
-    code_corr_2 = self.correction_service.apply_correction(corr2, code)
-
-    prob_1 = self.calc_probability_of_sequence(code_corr_1, self.bigram_probabilities)
-    prob_2 = self.calc_probability_of_sequence(code_corr_2, self.bigram_probabilities)
-
-    # corr_1 > corr_2 if the probability of code from 1 is higher
-    return prob_1 > prob_2
+    # If the corrections are the same length, corr_1 > corr_2 if the bigram probability of code from 1 is higher
+    summary1 = self.concat_summaries(corr1, *parts1, s, l, code)
+    return self.get_span_score(summary1, s, l, code) > self.get_span_score(summary2, s, l, code)
 
   def get_parse_tree(self, input_string, back):
     return self.get_parse_tree_aux(0, len(input_string), 'start', back, input_string)
 
+  # Parse tree of the tokens as a non terminal, None if they can't be parsed as it. With recogniser_mode 'earley'
+  # it is the most probable tree, built from the Earley columns, otherwise the one parse_beam kept
+  def build_parse_tree(self, to_parse, non_terminal = 'start'):
+    if self.recogniser_mode == 'earley':
+      return self.earley_recogniser.parse_tree(to_parse, non_terminal)
+
+    T, back = self.parse_beam(to_parse, non_terminal)
+    if non_terminal not in T[0][len(to_parse)]:
+      return None
+    return self.get_beam_parse_tree(0, len(to_parse), non_terminal, back, to_parse)
+
+  # Tree from the single backpointer parse_beam keeps for each head, in the node format of build_parse_tree
+  def get_beam_parse_tree(self, s, l, non_terminal, back, to_parse):
+    backpointer = back[s][l].get(non_terminal)
+    if backpointer is None:
+      return (non_terminal, to_parse[s])
+
+    p, B, C = backpointer
+    if p == NONE:
+      return (non_terminal, [self.get_beam_parse_tree(s, l, B if B != 'NONE' else C, back, to_parse)])
+    return (non_terminal, [self.get_beam_parse_tree(s, p, B, back, to_parse), self.get_beam_parse_tree(s+p, l-p, C, back, to_parse)])
+
   def get_parse_tree_aux(self, s, l, non_terminal, back, input_string):
     if l == 1 and not back[s][l][non_terminal]:
       return (non_terminal, input_string[s])
@@ -626,11 +1411,11 @@ class CYK_Parser():
     return corrected_code
   
   def get_corrected_block(self, code, T):
+    return self.correction_service.apply_correction(self.get_block_statements_correction(code, T), code)
+
+  def get_block_statements_correction(self, code, T):
     try: 
-      corrected_code = self.correction_service.apply_correction(T[0][-1]['statements'][0], code)
-      # print(f'code: {code}\ncorrection: {T[0][-1]['statements'][0]}')
+      return T[0][-1]['statements'][0]
     except:
       raise Exception(f'FAILED TO PARSE AS STATEMENT. Try raising the number of beams. \ncode failed: {code}')
 
-    return corrected_code
-
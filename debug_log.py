@@ -0,0 +1,40 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Diagnostic output (preprocessed source, blocks, corrected tokens) goes to each module's logger at DEBUG level,
+# so it is only formatted when that level is enabled. A request can also ask for it on its own with
+# capture_debug_log, which collects the lines of the current thread without changing any logger's level
+captured_lines = ContextVar('captured_lines', default=None)
+
+# True if diagnostic output is being captured, so work run in other processes must send its lines back
+def is_capturing():
+  return captured_lines.get() is not None
+
+# Adds lines captured in another process to the current capture
+def add_captured_lines(lines):
+  captured = captured_lines.get()
+  if captured is not None:
+    captured.extend(lines)
+
+# True if diagnostic output for the logger would go anywhere, for guarding loops that build it
+def is_debug_enabled(logger):
+  return captured_lines.get() is not None or logger.isEnabledFor(logging.DEBUG)
+
+# Logs msg % args at DEBUG level, formatting it only if the logger or a capture wants it
+def log_debug(logger, msg, *args):
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug(msg, *args)
+  lines = captured_lines.get()
+  if lines is not None:
+    lines.append(msg % args if args else msg)
+
+# Collects the diagnostic output logged in the body of the with statement into the list it yields
+@contextmanager
+def capture_debug_log():
+  lines = []
+  token = captured_lines.set(lines)
+  try:
+    yield lines
+  finally:
+    captured_lines.reset(token)
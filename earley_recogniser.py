@@ -0,0 +1,504 @@
+import heapq
+from compiled_grammar import NONE
+
+NEG_INF = float('-inf')
+
+# Entries kept in each of the memo tables shared by every parse, which are emptied when they grow past it
+MAX_MEMO_ENTRIES = 100000
+
+# Earley recogniser over the compiled CNF grammar, using the bitset tables of the CYK recogniser.
+# Column k maps each origin i to the bitset of non terminals deriving tokens [i, k) that were predicted at i,
+# i.e. that can begin something a parse still needs at i. Spans nothing is waiting for are never built, so on
+# mostly deterministic code a column only holds the origins of the statements and brackets still open, rather
+# than every start as in the CYK chart.
+#
+# Right recursive rules (argument lists, chains of binary operators) would still complete at every origin of
+# the chain in every column. With Leo's optimisation, a non terminal C at position j with only one item waiting
+# for it, A -> B . C from origin i, completes A straight away, and A in turn whatever is waiting on it at i
+# if that is unique too. Only the topmost completion is added, which keeps such chains linear.
+class Earley_Recogniser():
+  def __init__(self, compiled_grammar):
+    self.grammar = compiled_grammar
+    self.statements = compiled_grammar.get_id('statements')
+
+    # For a right child C, the bitset of left children it pairs with
+    self.left_partner_masks = [0] * compiled_grammar.num_symbols
+    # For a non terminal C, the bitset of heads of the rules it can be the first child of, where predicting the
+    # head at a position leaves an item waiting for C there
+    self.first_child_heads = [0] * compiled_grammar.num_symbols
+    for A, B, C in compiled_grammar.binary_rules:
+      self.left_partner_masks[C] |= 1 << B
+      self.first_child_heads[B] |= 1 << A
+      if B in compiled_grammar.nullable_ids:
+        self.first_child_heads[C] |= 1 << A
+
+    # For parse trees, the binary rules of each head as (B, C, rule id), and its rules with a nullable child as
+    # (the other child, log probability, backpointer)
+    self.rules_by_head = [[] for _ in range(compiled_grammar.num_symbols)]
+    self.unit_rules_by_head = [[] for _ in range(compiled_grammar.num_symbols)]
+    for rule_id, (A, B, C) in enumerate(compiled_grammar.binary_rules):
+      self.rules_by_head[A].append((B, C, rule_id))
+    for child in range(compiled_grammar.num_symbols):
+      for A, rule_id in compiled_grammar.nullable_right_rules_by_left[child]:
+        self.unit_rules_by_head[A].append((child, compiled_grammar.rule_log_probs[rule_id], (NONE, child, NONE)))
+      for A, rule_id in compiled_grammar.nullable_left_rules_by_right[child]:
+        self.unit_rules_by_head[A].append((child, compiled_grammar.rule_log_probs[rule_id], (NONE, NONE, child)))
+
+    # Predicted sets repeat across positions and inputs (much as LR states do), so what is derived from them
+    # is kept between parses: waiting items by (left child, predicted heads of its origin), the predicted heads
+    # by the right children needed, and the left children pairing with a right cell by the cell
+    self.waiting_memo = {}
+    self.predicted_memo = {}
+    self.left_filter_memo = {}
+    # Non terminals some predicted head can begin with, by the predicted heads
+    self.first_children_memo = {}
+
+    # Number of cells of the last columns filled, for the block metrics
+    self.num_cells = 0
+
+  # The memo tables stay behind when the parser is sent to worker processes, which fill their own
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    for name in ('waiting_memo', 'predicted_memo', 'left_filter_memo', 'first_children_memo'):
+      state[name] = {}
+    return state
+
+  # Bitset of the non terminals deriving a single token
+  def get_token_mask(self, token):
+    return self.grammar.close_mask(self.get_token_heads(token))
+
+  # Bitset of the non terminals with a terminal rule for the token, a stub block standing for statements
+  def get_token_heads(self, token):
+    if token == 'STUB-BLOCK':
+      return 1 << self.statements
+    return self.grammar.terminal_masks.get(token, 0)
+
+  # Fills the columns, stopping at the first token nothing predicted can begin with.
+  # Returns the columns, or None if the input can't be a prefix of goal. Leo completions leave out the cells
+  # of a chain below its top. A trace dict gets the columns, predicted sets and Leo tables as they are filled,
+  # so it holds those of the longest viable prefix even when None is returned. With back true it also gets,
+  # for each column, the origins j of the cells whose combining added to each origin i, as {i: [j, ...]}, and
+  # the Leo non terminals completed from each origin, as {i: bitset}, which parse trees are built from
+  def get_columns(self, to_parse, goal, trace=None, back=False):
+    grammar = self.grammar
+    right_partner_masks = grammar.right_partner_masks
+    pair_head_masks = grammar.pair_head_masks
+    left_partner_masks = self.left_partner_masks
+    close_mask = grammar.close_mask
+
+    predicted = [grammar.left_corner_masks[goal]]
+    columns = [{}]
+    # Bitset of the Leo non terminals of each position, the items waiting at it as (origin, waiting) to find the
+    # item waiting for each, and the topmost (origin, non terminal) each completes, found when first needed
+    leo_masks = [0]
+    leo_waiting = [[]]
+    leo_tops = [{}]
+    if trace is not None:
+      trace.update(columns=columns, predicted=predicted, leo_masks=leo_masks, leo_waiting=leo_waiting, leo_tops=leo_tops)
+    splits = [{}]
+    leo_completed = [{}]
+    if back:
+      trace.update(splits=splits, leo_completed=leo_completed)
+    waiting_memo = self.waiting_memo
+    left_filter_memo = self.left_filter_memo
+    for memo in (waiting_memo, self.predicted_memo, left_filter_memo, self.first_children_memo):
+      if len(memo) > MAX_MEMO_ENTRIES:
+        memo.clear()
+    self.num_cells = 0
+
+    # Adds heads to the cell of origin i of the column being filled, sending the Leo ones to the top of their chain
+    def add(i, heads):
+      leo_heads = heads & leo_masks[i]
+      heads ^= leo_heads
+      if back and leo_heads:
+        column_leo_completed[i] = column_leo_completed.get(i, 0) | leo_heads
+      while leo_heads:
+        low_bit = leo_heads & -leo_heads
+        leo_heads ^= low_bit
+        top_origin, top = self.get_leo_top(leo_masks, leo_waiting, leo_tops, i, low_bit.bit_length() - 1)
+        add(top_origin, close_mask(1 << top) & predicted[top_origin])
+
+      if not heads:
+        return
+      if i in column:
+        column[i] |= heads
+      else:
+        column[i] = heads
+        heapq.heappush(to_combine, -i)
+
+    for k, (token, token_id, code_pos) in enumerate(to_parse):
+      scanned = self.get_token_mask(token) & predicted[k]
+      if not scanned:
+        return None
+
+      column = {}
+      column_splits = {}
+      column_leo_completed = {}
+      # Origins of the column still to be combined with the cells ending at them, latest origin first.
+      # Combining span [i, j) with [j, k+1) only adds to an earlier origin i, so each cell is complete when popped
+      to_combine = []
+      add(k, scanned)
+      while to_combine:
+        j = -heapq.heappop(to_combine)
+        right = column[j]
+        # Left children that pair with some non terminal of the right cell
+        left_filter = left_filter_memo.get(right)
+        if left_filter is None:
+          left_filter = left_filter_memo[right] = grammar.union_masks(right, left_partner_masks)
+
+        for i, left in columns[j].items():
+          left &= left_filter
+          heads = 0
+          while left:
+            low_bit = left & -left
+            left ^= low_bit
+            B = low_bit.bit_length() - 1
+
+            matches = right & right_partner_masks[B]
+            while matches:
+              match_bit = matches & -matches
+              matches ^= match_bit
+              heads |= pair_head_masks[B][match_bit.bit_length() - 1]
+
+          heads &= predicted[i]
+          if heads:
+            if back:
+              column_splits.setdefault(i, []).append(j)
+            # Heads of rules with a nullable child only matter if predicted too, as do the heads they were closed from
+            add(i, close_mask(heads) & predicted[i])
+
+      columns.append(column)
+      splits.append(column_splits)
+      leo_completed.append(column_leo_completed)
+      self.num_cells += len(column)
+
+      # Predict what can begin at k+1: the left corners of every right child a span ending here is waiting for
+      needed = multiple = 0
+      cell_waiting = []
+      for i, cell in column.items():
+        predicted_i = predicted[i]
+        while cell:
+          low_bit = cell & -cell
+          cell ^= low_bit
+          key = (low_bit.bit_length() - 1, predicted_i)
+          waiting = waiting_memo.get(key)
+          if waiting is None:
+            waiting = waiting_memo[key] = self.get_waiting(*key)
+          multiple |= waiting[1] | (needed & waiting[0])
+          needed |= waiting[0]
+          cell_waiting.append((i, waiting))
+
+      predicted_k = self.get_predicted(needed)
+      predicted.append(predicted_k)
+
+      # Right children with a single item waiting for them and no predicted rule starting with them
+      leo_masks.append(needed & ~multiple & ~self.get_first_children(predicted_k))
+      leo_waiting.append(cell_waiting)
+      leo_tops.append({})
+
+    return columns
+
+  # Heads that can begin a span at a position where the right children are needed: their left corners
+  def get_predicted(self, needed):
+    predicted = self.predicted_memo.get(needed)
+    if predicted is None:
+      predicted = self.predicted_memo[needed] = self.grammar.union_masks(needed, self.grammar.left_corner_masks)
+    return predicted
+
+  # Topmost (origin, non terminal) completed by the Leo non terminal C of position j, following the chain of
+  # single waiting items down to the first origin where the non terminal completed isn't a Leo one
+  def get_leo_top(self, leo_masks, leo_waiting, leo_tops, j, C):
+    chain = []
+    while C not in leo_tops[j]:
+      chain.append((j, C))
+      j, C = self.get_leo_parent(leo_waiting, j, C)
+      if not leo_masks[j] >> C & 1:
+        top = (j, C)
+        break
+    else:
+      top = leo_tops[j][C]
+
+    for j, C in chain:
+      leo_tops[j][C] = top
+    return top
+
+  # (origin, head) of the single item waiting for the Leo non terminal C at position j, which C completes
+  def get_leo_parent(self, leo_waiting, j, C):
+    for i, (needed_B, multiple_B, heads_B) in leo_waiting[j]:
+      if needed_B >> C & 1:
+        return i, heads_B[C]
+
+  def get_first_children(self, predicted):
+    first_children = self.first_children_memo.get(predicted)
+    if first_children is None:
+      first_children = 0
+      for C in range(self.grammar.num_symbols):
+        if self.first_child_heads[C] & predicted:
+          first_children |= 1 << C
+      self.first_children_memo[predicted] = first_children
+    return first_children
+
+  # Right children waiting after a left child B from an origin with the given predicted heads, as
+  # (bitset of right children, bitset of those waited for by more than one head, {right child: head} of the rest)
+  def get_waiting(self, B, predicted_i):
+    needed = multiple = 0
+    heads_by_right = {}
+    for C, heads in self.grammar.pair_head_masks[B].items():
+      heads &= predicted_i
+      if not heads:
+        continue
+      needed |= 1 << C
+      if heads & (heads - 1):
+        multiple |= 1 << C
+      else:
+        heads_by_right[C] = heads.bit_length() - 1
+    return needed, multiple, heads_by_right
+
+  # Returns whether the tokens can be parsed as the non terminal
+  def recognise(self, to_parse, non_terminal='statements'):
+    grammar = self.grammar
+    goal = grammar.get_id(non_terminal)
+    if not to_parse:
+      return goal in grammar.nullable_ids
+
+    columns = self.get_columns(to_parse, goal)
+    return columns is not None and bool(columns[-1].get(0, 0) >> goal & 1)
+
+  # The tokens before end, from a trace of get_columns that got past them, as the spans a parse of their
+  # continuation can be built on, so a correction after them can be searched for without their tokens. Returns a
+  # list of (start, end, cell, pairs), where cell is the bitset of non terminals deriving the span and pairs the
+  # set of (A, C) for which A derives the span followed by any span that C derives.
+  #
+  # The spans are those of the stacks of items waiting at end. A right recursive chain of items (an argument list,
+  # a sum) is a single span, the one from the top of its Leo chain, which makes A -> (span) C a rule in its own
+  # right. Which stack a parse continues is only known from the tokens after end, so the spans of every origin
+  # are kept, each followed down to the items waiting for something it can begin
+  def get_stack_units(self, trace, end):
+    grammar = self.grammar
+    pair_head_masks = grammar.pair_head_masks
+    left_corner_masks = grammar.left_corner_masks
+    columns, predicted = trace['columns'], trace['predicted']
+    leo_masks, leo_waiting, leo_tops = trace['leo_masks'], trace['leo_waiting'], trace['leo_tops']
+
+    # Topmost (origin, non terminal) completed by A completing from origin i
+    def get_top(i, A):
+      if leo_masks[i] >> A & 1:
+        return self.get_leo_top(leo_masks, leo_waiting, leo_tops, i, A)
+      return i, A
+
+    units = []
+    # Non terminals the spans starting at each position can begin with, any at end
+    wanted = {end: -1}
+    for k in range(end, 0, -1):
+      if k not in wanted:
+        continue
+
+      pairs_by_origin = {}
+      for i, cell in columns[k].items():
+        predicted_i = predicted[i]
+        for B in grammar.mask_to_ids(cell):
+          for C, heads in pair_head_masks[B].items():
+            heads &= predicted_i
+            if not heads or not left_corner_masks[C] & wanted[k]:
+              continue
+            tops = [get_top(k, C)] if leo_masks[k] >> C & 1 else [get_top(i, A) for A in grammar.mask_to_ids(heads)]
+            for origin, A in tops:
+              pairs_by_origin.setdefault(origin, set()).add((A, C))
+
+      for origin, pairs in pairs_by_origin.items():
+        cell = columns[k].get(origin, 0)
+        units.append((origin, k, cell, pairs))
+        for A, C in pairs:
+          cell |= 1 << A
+        wanted[origin] = wanted.get(origin, 0) | cell
+
+    return units
+
+  # Most probable parse tree of the tokens as the non terminal, None if they can't be parsed as it.
+  # The tree is the best over every parse in the Earley columns rather than over those a beam kept. Nodes are
+  # (non terminal, token) for a token, (non terminal, [left, right]) for a binary rule and (non terminal, [child])
+  # where a nullable child was skipped
+  def parse_tree(self, to_parse, non_terminal='statements'):
+    goal = self.grammar.get_id(non_terminal)
+    if not to_parse:
+      return None
+
+    trace = {}
+    columns = self.get_columns(to_parse, goal, trace=trace, back=True)
+    if columns is None or not columns[-1].get(0, 0) >> goal & 1:
+      return None
+
+    forest = Earley_Forest(self, to_parse, trace)
+    return forest.get_tree((goal, 0, len(to_parse)))
+
+# The parse forest left by get_columns, scored from the goal down, so only the items on a derivation of the goal
+# are scored. Items are (non terminal, start, end). Each item's derivations are built from the cells its column
+# recorded as combined into it, the items of Leo chains completed from it, its token, and the rules with a
+# nullable child from other items of its span.
+#
+# The items of a Leo chain below its top are in no column. They are found again by following each chain up from
+# the Leo non terminals its column completed, only as far down as the origins asked about, so a long right
+# recursive chain is followed once in the column of its goal, rather than once in every column as without Leo
+class Earley_Forest():
+  def __init__(self, recogniser, to_parse, trace):
+    self.recogniser = recogniser
+    self.grammar = recogniser.grammar
+    self.to_parse = to_parse
+    self.columns = trace['columns']
+    self.splits = trace['splits']
+    self.leo_completed = trace['leo_completed']
+    self.leo_masks = trace['leo_masks']
+    self.leo_waiting = trace['leo_waiting']
+
+    # For each column followed, the Leo items as (origin, non terminal) whose parent isn't found yet, every Leo
+    # item found, and the Leo items completing each item by (origin, non terminal)
+    self.leo_frontiers = {}
+    self.leo_items = {}
+    self.leo_children = {}
+
+    # Best (log probability, backpointer) of each item scored
+    self.scores = {}
+
+  # Follows the Leo chains of column k up to origin start, so every Leo item of it with an origin from start on
+  # is found, along with the Leo items completing each item with an origin from start on
+  def add_leo_items(self, k, start):
+    if k not in self.leo_frontiers:
+      self.leo_frontiers[k] = [(i, X) for i, mask in self.leo_completed[k].items() for X in self.grammar.mask_to_ids(mask)]
+      self.leo_items[k] = set(self.leo_frontiers[k])
+      self.leo_children[k] = {}
+
+    items = self.leo_items[k]
+    children = self.leo_children[k]
+    frontier = []
+    for item in self.leo_frontiers[k]:
+      while item is not None and item[0] > start:
+        parent = self.recogniser.get_leo_parent(self.leo_waiting, *item)
+        children.setdefault(parent, []).append(item)
+        i, A = parent
+        # The top of the chain is in the column, and a parent found before is followed from there
+        if not self.leo_masks[i] >> A & 1 or parent in items:
+          item = None
+        else:
+          items.add(parent)
+          item = parent
+      if item is not None:
+        frontier.append(item)
+    self.leo_frontiers[k] = frontier
+
+  def is_completed(self, A, i, k):
+    return bool(self.columns[k].get(i, 0) >> A & 1) or (i, A) in self.leo_items[k]
+
+  # Derivations of A over [i, k) other than through a nullable child, as (log probability of the rule,
+  # backpointer, the items it is built from)
+  def get_derivations(self, A, i, k):
+    recogniser = self.recogniser
+    rule_log_probs = self.grammar.rule_log_probs
+    columns = self.columns
+    derivations = []
+    if k == i + 1 and recogniser.get_token_heads(self.to_parse[i][0]) >> A & 1:
+      derivations.append((0.0, None, ()))
+
+    for j in self.splits[k].get(i, ()):
+      left, right = columns[j].get(i, 0), columns[k].get(j, 0)
+      for B, C, rule_id in recogniser.rules_by_head[A]:
+        if left >> B & 1 and right >> C & 1 and rule_log_probs[rule_id] > NEG_INF:
+          derivations.append((rule_log_probs[rule_id], (j, B, C), ((B, i, j), (C, j, k))))
+
+    for j, X in self.leo_children[k].get((i, A), ()):
+      left = columns[j].get(i, 0)
+      for B, C, rule_id in recogniser.rules_by_head[A]:
+        if C == X and left >> B & 1 and rule_log_probs[rule_id] > NEG_INF:
+          derivations.append((rule_log_probs[rule_id], (j, B, C), ((B, i, j), (C, j, k))))
+    return derivations
+
+  # The items of the span of an item that it derives from through rules with a nullable child, itself included
+  # and those already scored left out, each with its derivations and its (child, log probability, backpointer)
+  # rules with a nullable child
+  def get_unit_group(self, A, i, k):
+    self.add_leo_items(k, i)
+    group = {}
+    to_visit = [A]
+    while to_visit:
+      head = to_visit.pop()
+      if head in group or (head, i, k) in self.scores:
+        continue
+      units = [(child, log_prob, backpointer) for child, log_prob, backpointer in self.recogniser.unit_rules_by_head[head] if self.is_completed(child, i, k)]
+      group[head] = (self.get_derivations(head, i, k), units)
+      to_visit += [child for child, _, _ in units]
+    return group
+
+  # Scores the item and every item it derives from, children before their parents from a stack, since the
+  # derivations of a long block are as deep as it is long
+  def score(self, item):
+    scores = self.scores
+    groups = {}
+    stack = [item]
+    while stack:
+      item = stack[-1]
+      if item in scores:
+        stack.pop()
+        continue
+
+      if item not in groups:
+        groups[item] = self.get_unit_group(*item)
+      group = groups[item]
+      missing = [child for derivations, _ in group.values() for _, _, children in derivations for child in children if child not in scores]
+      if missing:
+        stack += missing
+        continue
+
+      stack.pop()
+      del groups[item]
+      self.score_group(item[1], item[2], group)
+
+  # Scores the items of a unit group: the best binary or token derivation of each, then the rules with a
+  # nullable child relaxed until no score improves. Their log probabilities are at most 0, so going round a
+  # cycle of them never improves a score and this stops
+  def score_group(self, i, k, group):
+    scores = self.scores
+    group_scores = {}
+    for head, (derivations, _) in group.items():
+      best = (NEG_INF, None)
+      for log_prob, backpointer, children in derivations:
+        for child in children:
+          log_prob += scores[child][0]
+        if log_prob > best[0]:
+          best = (log_prob, backpointer)
+      group_scores[head] = best
+
+    changed = True
+    while changed:
+      changed = False
+      for head, (_, units) in group.items():
+        for child, log_prob, backpointer in units:
+          log_prob += group_scores[child][0] if child in group_scores else scores[child, i, k][0]
+          if log_prob > group_scores[head][0]:
+            group_scores[head] = (log_prob, backpointer)
+            changed = True
+
+    for head, best in group_scores.items():
+      scores[head, i, k] = best
+
+  # Tree of the best derivation of an item, built from a stack
+  def get_tree(self, item):
+    self.score(item)
+    symbols = self.grammar.symbols
+    root = []
+    stack = [(item, root)]
+    while stack:
+      (A, i, k), siblings = stack.pop()
+      _, backpointer = self.scores[A, i, k]
+      if backpointer is None:
+        siblings.append((symbols[A], self.to_parse[i]))
+        continue
+
+      children = []
+      siblings.append((symbols[A], children))
+      j, B, C = backpointer
+      if j == NONE:
+        stack.append(((B if B != NONE else C, i, k), children))
+      else:
+        # The left child is popped first, so it comes first in children
+        stack.append(((C, j, k), children))
+        stack.append(((B, i, j), children))
+    return root[0]
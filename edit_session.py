@@ -0,0 +1,29 @@
+import threading
+from lexer import Lexer
+
+# Source of a file being edited, with the tokens of its logical lines kept between edits
+# so only changed lines are tokenised again
+class Edit_Session():
+  def __init__(self, code):
+    self.code = code
+    self.chunk_tokens = {}
+    self.lock = threading.Lock()
+
+  # Each change replaces the physical lines [start_line, end_line) with its lines
+  def apply_changes(self, changes):
+    lines = self.code.split('\n')
+    for change in changes:
+      start_line, end_line = int(change['start_line']), int(change['end_line'])
+      if start_line < 0 or end_line < start_line or end_line > len(lines):
+        raise Exception(f'INVALID CHANGE of lines {start_line} to {end_line} in a file of {len(lines)} lines')
+      lines[start_line:end_line] = change['lines']
+
+    self.code = '\n'.join(lines)
+
+  # Lexer that has tokenised the current code
+  def tokenise(self):
+    lexer = Lexer(self.code)
+    lexer.tokenise(self.chunk_tokens)
+    self.chunk_tokens = lexer.chunk_tokens
+
+    return lexer
@@ -0,0 +1,50 @@
+import hashlib
+import os
+import pickle
+
+ARTIFACT_MAGIC = b'CYKGRAM\0'
+ARTIFACT_VERSION = 1
+
+# Files the parser tables are derived from, besides the grammar itself
+INSERTION_MAP_FILE = 'additional_files/I.json'
+BIGRAM_FILE = 'additional_files/bigram_probabilities.json'
+
+# The compiled tables are pickled objects holding packed corrections, and the nullable set, reverse grammar and
+# bigram log probabilities are built by CYK_Parser, so an artifact is also stale once the code defining them changes
+TABLE_CODE_FILES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename) for filename in ('compiled_grammar.py', 'correction.py', 'cyk_parser.py'))
+
+def get_artifact_file(grammar_file):
+  return os.path.splitext(grammar_file)[0] + '.bin'
+
+# Checksum of every source file of the tables, so a stale artifact is never loaded
+def get_source_checksum(grammar_file, grammar_mode):
+  digest = hashlib.sha256(grammar_mode.encode())
+  for filename in (grammar_file, INSERTION_MAP_FILE, BIGRAM_FILE) + TABLE_CODE_FILES:
+    with open(filename, 'rb') as f:
+      digest.update(f.read())
+
+  return digest.digest()
+
+# Artifact layout: magic, little endian version, source checksum, then the pickled tables.
+# The numeric tables are array objects, so they are stored as raw bytes
+def save_artifact(filename, checksum, tables):
+  with open(filename, 'wb') as f:
+    f.write(ARTIFACT_MAGIC)
+    f.write(ARTIFACT_VERSION.to_bytes(4, 'little'))
+    f.write(checksum)
+    pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Returns the saved tables, or None if the artifact is missing, from another version or stale
+def load_artifact(filename, checksum):
+  if not os.path.exists(filename):
+    return None
+
+  with open(filename, 'rb') as f:
+    if f.read(len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+      return None
+    if int.from_bytes(f.read(4), 'little') != ARTIFACT_VERSION:
+      return None
+    if f.read(len(checksum)) != checksum:
+      return None
+
+    return pickle.load(f)
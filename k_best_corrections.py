@@ -0,0 +1,161 @@
+import heapq
+
+# Corrections of the derivations of the hypergraph parse_with_err_correction_beam records with hyperedges, in
+# order of their edits and then of their log probability, found lazily as in algorithm 3 of Huang and Chiang,
+# Better k-best parsing (2005). Only the derivations asked for, and the next candidates of their tails, are built.
+#
+# hyperedges maps each (A, s, l) to the candidates the beam built for it, whether kept or not, as (edits, negative
+# log probability, backpointer, correction). Leaves have backpointer None and their token correction, the others
+# a backpointer (p, B, C) as those of Agenda_Corrector, where p == l means C was inserted after B and p == 0 that
+# B was inserted before C. Their edits and log probability are those of the edge alone.
+# A node (A, s, l, with_insertions) stands for the head either with all its edges, or only with its leaves and
+# binary edges, which is what the insertions of the same cell are built from, so the hypergraph has no cycles
+class K_Best_Corrections():
+  def __init__(self, hyperedges, insertions, correction_service):
+    self.hyperedges = hyperedges
+    self.insertions = insertions
+    self.correction_service = correction_service
+
+    # Edges of each node with their tails, derivations found of each node in order as (edits, negative log
+    # probability, edge index, ranks of the tails), and for each node the heap of candidates for the next, the
+    # set of (edge index, ranks) pushed, those still to build once the derivations they need are found, and how
+    # many derivations have had their next candidates added. Nodes whose derivations have all been found are
+    # exhausted. The correction of each derivation is kept by (node, rank)
+    self.edges = {}
+    self.derivations = {}
+    self.candidates = {}
+    self.num_expanded = {}
+    self.exhausted = set()
+    self.corrections = {}
+
+  # Edges of a node as (edits, negative log probability, backpointer, correction, tails)
+  def get_edges(self, node):
+    if node not in self.edges:
+      A, s, l, with_insertions = node
+      edges = []
+      for edits, neg_log_prob, backpointer, correction in self.hyperedges.get((A, s, l), ()):
+        if backpointer is None:
+          edges.append((edits, neg_log_prob, backpointer, correction, ()))
+          continue
+
+        p, B, C = backpointer
+        if 0 < p < l:
+          edges.append((edits, neg_log_prob, backpointer, correction, ((B, s, p, True), (C, s+p, l-p, True))))
+        elif with_insertions:
+          edges.append((edits, neg_log_prob, backpointer, correction, ((B, s, l, False) if p == l else (C, s, l, False),)))
+      self.edges[node] = edges
+    return self.edges[node]
+
+  # Whether the derivation of a node of a rank is found, or known not to exist
+  def is_known(self, node, rank):
+    return node in self.exhausted or (node in self.derivations and rank < len(self.derivations[node]))
+
+  # Derivation of an edge with the derivations of the given ranks of its tails, None if a tail has fewer
+  def get_candidate(self, node, i, ranks):
+    edits, neg_log_prob, _, _, tails = self.get_edges(node)[i]
+    for tail, rank in zip(tails, ranks):
+      derivations = self.derivations[tail]
+      if rank >= len(derivations):
+        return None
+      edits += derivations[rank][0]
+      neg_log_prob += derivations[rank][1]
+    return (edits, neg_log_prob, i, ranks)
+
+  # Finds the derivations of a node up to rank k, as far as those already found of its tails allow. Returns the
+  # (tail, rank) to find first, or None once the node has a derivation of rank k or is exhausted
+  def add_derivations(self, node, k):
+    if node not in self.derivations:
+      self.derivations[node] = []
+      pending = [(i, (0,) * len(edge[4])) for i, edge in enumerate(self.get_edges(node))]
+      self.candidates[node] = ([], set(pending), pending)
+      self.num_expanded[node] = 0
+
+    derivations = self.derivations[node]
+    candidates, pushed, pending = self.candidates[node]
+    while True:
+      while pending:
+        i, ranks = pending[-1]
+        for tail, rank in zip(self.get_edges(node)[i][4], ranks):
+          if not self.is_known(tail, rank):
+            return (tail, rank)
+        pending.pop()
+        candidate = self.get_candidate(node, i, ranks)
+        if candidate is not None:
+          heapq.heappush(candidates, candidate)
+
+      if len(derivations) > k:
+        return None
+      # The next candidates of the last derivation only get built once one past it is asked for
+      if self.num_expanded[node] < len(derivations):
+        _, _, i, ranks = derivations[-1]
+        for j in range(len(ranks)):
+          next_ranks = ranks[:j] + (ranks[j] + 1,) + ranks[j+1:]
+          if (i, next_ranks) not in pushed:
+            pushed.add((i, next_ranks))
+            pending.append((i, next_ranks))
+        self.num_expanded[node] = len(derivations)
+        continue
+
+      if not candidates:
+        self.exhausted.add(node)
+        return None
+      derivations.append(heapq.heappop(candidates))
+
+  # The derivation of a node of rank k, the best being rank 0, or None if it has no more than k. The tails it
+  # needs are found from a stack rather than by recursion, since derivations are as deep as the block is long
+  def get_derivation(self, node, k):
+    stack = [(node, k)]
+    while stack:
+      needed = self.add_derivations(*stack[-1])
+      if needed is None:
+        stack.pop()
+      else:
+        stack.append(needed)
+
+    derivations = self.derivations[node]
+    return derivations[k] if k < len(derivations) else None
+
+  # Correction of the derivation of a node of rank k, composed from its tails the way the beam composes it,
+  # the tails first from a stack
+  def get_correction(self, node, k):
+    stack = [(node, k)]
+    while stack:
+      if stack[-1] in self.corrections:
+        stack.pop()
+        continue
+
+      tail_node, tail_k = stack[-1]
+      _, _, i, ranks = self.derivations[tail_node][tail_k]
+      _, _, backpointer, correction, tails = self.get_edges(tail_node)[i]
+      missing = [(tail, rank) for tail, rank in zip(tails, ranks) if (tail, rank) not in self.corrections]
+      if missing:
+        stack += missing
+        continue
+
+      stack.pop()
+      if backpointer is not None:
+        A, s, l, _ = tail_node
+        p, B, C = backpointer
+        correction_service = self.correction_service
+        tail_corrections = [self.corrections[tail, rank] for tail, rank in zip(tails, ranks)]
+        if p == l:
+          correction = correction_service.compose_for_insertion_forward(tail_corrections[0], self.insertions[C], s+l)
+        elif p == 0:
+          correction = correction_service.compose_for_insertion_backward(tail_corrections[0], correction_service.offset_indices(self.insertions[B], s), s)
+        else:
+          correction = correction_service.compose(*tail_corrections)
+      self.corrections[tail_node, tail_k] = correction
+
+    return self.corrections[node, k]
+
+  # Different corrections of the derivations of a node in order, skipping those in seen, and stopping after
+  # max_derivations derivations, since many derivations tend to give the same correction
+  def iter_corrections(self, node, max_derivations, seen=()):
+    seen = set(seen)
+    for k in range(max_derivations):
+      if self.get_derivation(node, k) is None:
+        return
+      correction = self.get_correction(node, k)
+      if correction not in seen:
+        seen.add(correction)
+        yield correction
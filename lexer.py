@@ -1,5 +1,11 @@
+import io
+import logging
+import re
 from terminals import *
 from collections import defaultdict
+from debug_log import is_debug_enabled, log_debug
+
+logger = logging.getLogger(__name__)
 
 operator_map = {
   '=': 'ASSIGN',
@@ -18,10 +24,26 @@ operator_map = {
   '...': 'ELLIPSIS',
 }
 
+KEYWORD_SET = frozenset(KEYWORDS)
+
+# One pattern for every token of the scanner, each after any whitespace, tried in order. Operators only extend to
+# 2 characters, as in Lexer.operator, and QUOTE matches an opening quote with no closing quote after it
+TOKEN_REGEX = re.compile('[' + re.escape(''.join(sorted(WHITESPACE))) + ']*(?:' + '|'.join([
+  '(?P<STRING>\'[^\']*\'|"[^"]*")',
+  '(?P<QUOTE>[\'"])',
+  '(?P<NUMBER>[' + DIGITS + ']+)',
+  '(?P<NAME>[' + LETTERS + '_][' + LETTERS + DIGITS + '_]*)',
+  '(?P<OPERATOR>' + '|'.join(re.escape(op) for op in OPERATORS if len(op) == 2) + '|[' + re.escape(''.join(op for op in OPERATORS if len(op) == 1)) + '])',
+  '(?P<DELIMITER>[' + re.escape(''.join(DELIMITERS)) + '])',
+  '(?P<OTHER>.)',
+]) + ')', re.DOTALL)
+
 # TODO: fix the bug for block parsing with dedents not working
+# scan_mode either 'regex' (one compiled pattern for all tokens) or 'step' (character by character)
 class Lexer:
-  def __init__(self, source_code, tab_spaces=2):
+  def __init__(self, source_code, tab_spaces=2, scan_mode='regex'):
     self.source = source_code
+    self.scan_mode = scan_mode
     self.logical_line_to_physical_line_map = [] # Keeps track of mapping between logical and physical lines
     self.preprocess()
     self.tokens = []
@@ -40,7 +62,115 @@ class Lexer:
     self.current_char = self.source[self.position] if self.position < len(self.source) else None
     self.x_position += 1
 
-  def tokenise(self):
+  # chunk_tokens optionally maps the source of logical lines lexed before to their tokens, see tokenise_chunks
+  def tokenise(self, chunk_tokens=None):
+    if chunk_tokens is None:
+      self.scan()
+    else:
+      self.tokenise_chunks(chunk_tokens)
+
+    # self.tokens.append(('NEWLINE', 'NEWLINE'))
+    self.tokens.append(('ENDMARKER', 'ENDMARKER', (self.x_position, self.logical_line_to_physical_line_map[self.current_logical_line])))
+    return self.tokens, self.values_appeared
+
+  # Tokenises the source one logical line (chunk) at a time, reusing the tokens of chunks seen in chunk_tokens.
+  # Every chunk but the first starts with its NEWLINE, which resets the position, so its tokens only depend on its text
+  # and physical line. Afterwards self.chunk_tokens holds the tokens of every chunk of this source, to pass to the next lexer
+  def tokenise_chunks(self, chunk_tokens):
+    self.chunk_tokens = {}
+    full_source = self.source
+
+    for chunk_i, chunk in enumerate(self.source_chunks):
+      # The last chunk holds the NEWLINE and DEDENT tokens closing the source, over several logical lines
+      is_last_chunk = chunk_i == len(self.source_chunks)-1
+
+      if not is_last_chunk and (chunk in self.chunk_tokens or chunk in chunk_tokens):
+        line_tokens, line_values = self.chunk_tokens.get(chunk) or chunk_tokens[chunk]
+        physical_line = self.logical_line_to_physical_line_map[chunk_i]
+        self.tokens += [(token, value, (x_position, physical_line)) for token, value, x_position in line_tokens]
+        for value_type, values in line_values:
+          self.values_appeared[value_type] += values
+        self.current_logical_line = chunk_i
+      else:
+        num_tokens = len(self.tokens)
+        num_values = {value_type: len(values) for value_type, values in self.values_appeared.items()}
+
+        self.source = chunk
+        self.position = -1
+        self.x_position = -1
+        self.step()
+        self.scan()
+
+        line_tokens = [(token, value, code_pos[0]) for token, value, code_pos in self.tokens[num_tokens:]]
+        line_values = [(value_type, values[num_values.get(value_type, 0):]) for value_type, values in self.values_appeared.items()]
+
+      if not is_last_chunk:
+        self.chunk_tokens[chunk] = (line_tokens, line_values)
+
+    self.source = full_source
+
+  # Tokenises the rest of the source
+  def scan(self):
+    if self.scan_mode == 'step':
+      return self.scan_by_step()
+
+    source = self.source
+    line_map = self.logical_line_to_physical_line_map
+    tokens = self.tokens
+    # x positions are relative to the start of the logical line, which the NEWLINE, INDENT and DEDENT markers move
+    line_start = self.position - self.x_position
+    physical_line = line_map[self.current_logical_line]
+
+    for match in TOKEN_REGEX.finditer(source, self.position):
+      kind = match.lastgroup
+      if kind == 'OTHER':
+        continue
+
+      start, end = match.span(kind)
+      if kind == 'NAME':
+        id_str = source[start:end]
+        self.prev_f = id_str[0] == 'f' or id_str[0] == 'F'
+        if id_str in KEYWORD_SET:
+          tokens.append((id_str, id_str, (end-1-line_start, physical_line)))
+        elif id_str in PREPROCESS_TOKENS:
+          if id_str == 'NEWLINE':
+            line_start = end+1
+            self.current_logical_line += 1
+            physical_line = line_map[self.current_logical_line]
+          else:
+            line_start += len(' INDENT ')
+          tokens.append((id_str, id_str, (end-line_start, physical_line)))
+        else:
+          tokens.append(('NAME', id_str, (end-1-line_start, physical_line)))
+          self.values_appeared['NAME'].append(id_str)
+
+      elif kind == 'STRING':
+        if self.prev_f:
+          tokens.pop()
+          tokens.append(('FSTRING_START', 'FSTRING_START', (start-line_start, physical_line)))
+          tokens.append(('FSTRING_MIDDLE', source[start+1:end-1], (end-1-line_start, physical_line)))
+          tokens.append(('FSTRING_END', 'FSTRING_END', (end-line_start, physical_line)))
+        else:
+          tokens.append(('STRING', source[start+1:end-1], (end-1-line_start, physical_line)))
+
+      elif kind == 'QUOTE':
+        raise Exception(f"UNCLOSED {source[start]}")
+
+      elif kind == 'NUMBER':
+        num = source[start:end]
+        tokens.append(('NUMBER', num, (end-1-line_start, physical_line)))
+        self.values_appeared['NUMBER'].append(num)
+
+      else:
+        op = source[start:end]
+        tokens.append((op, op, (end-1-line_start, physical_line)))
+
+    self.position = len(source)
+    self.current_char = None
+    self.x_position = self.position - line_start
+
+  # Tokenises the rest of the source one character at a time
+  def scan_by_step(self):
     while self.current_char is not None:
       if self.current_char in WHITESPACE:
         self.step()
@@ -92,10 +222,6 @@ class Lexer:
       else:
         self.step()
         # raise ValueError(f"Unexpected character: {self.current_char}")
-
-    # self.tokens.append(('NEWLINE', 'NEWLINE'))
-    self.tokens.append(('ENDMARKER', 'ENDMARKER', (self.x_position, self.logical_line_to_physical_line_map[self.current_logical_line])))
-    return self.tokens, self.values_appeared
   
   def get_id_mapped_tokens(self):
     tokens_with_id = []
@@ -237,19 +363,24 @@ class Lexer:
       i += 1
 
     # TODO: update the self.logical to physical line mapping to take care of NEWLINE 
-    source = " NEWLINE ".join(new_logical_lines)
+    # The source split into one chunk per logical line, with each line after the first starting at its NEWLINE
+    self.source_chunks = [logical_line if i == 0 else ' NEWLINE ' + logical_line for i, logical_line in enumerate(new_logical_lines)]
 
     # Dedent all the indents that were previously made
+    last_chunk = ''
     if len(indent_stack) > 1:
       for _ in range(len(indent_stack)-1):
-        source = source + ' NEWLINE DEDENT '
+        last_chunk = last_chunk + ' NEWLINE DEDENT '
         self.logical_line_to_physical_line_map.append(-1)
     elif indent_stack[-1] == 0:
-      source = source + ' NEWLINE '
+      last_chunk = last_chunk + ' NEWLINE '
       self.logical_line_to_physical_line_map.append(-1)
+    self.source_chunks.append(last_chunk)
+
+    source = ''.join(self.source_chunks)
 
-    print('added dedent ', source)
-    print(self.logical_line_to_physical_line_map)
+    log_debug(logger, 'added dedent %s', source)
+    log_debug(logger, '%s', self.logical_line_to_physical_line_map)
     self.source = source
 
   def reverse_lex(self, lexed_code, value_map, values_appeared, tab_spaces=2):
@@ -258,6 +389,8 @@ class Lexer:
     curr_indent = 0
     logical_line_num = 0
     curr_x_pos = 0
+    # Checked once, as the output is two lines for every token
+    debug_enabled = is_debug_enabled(logger)
     for (token, _id, code_pos) in lexed_code:
       final_line_code = []
       added_chars = 0
@@ -278,12 +411,12 @@ class Lexer:
           else:
             to_append = token2
 
-          if code_pos:
-            print(logical_line_num, code_pos[-1], to_append)
-            print(f'codepos: {code_pos[0]-len(to_append)+added_chars} | len_to_append: {len(to_append)} | added chars: {added_chars} | curr x pos: {curr_x_pos} | toappend: {to_append}')
+          if code_pos and debug_enabled:
+            log_debug(logger, '%s %s %s', logical_line_num, code_pos[-1], to_append)
+            log_debug(logger, 'codepos: %s | len_to_append: %s | added chars: %s | curr x pos: %s | toappend: %s', code_pos[0]-len(to_append)+added_chars, len(to_append), added_chars, curr_x_pos, to_append)
 
           # Pad start if its a new line
-          if code_pos[-1] >= logical_line_num:
+          if len(code_pos) and code_pos[-1] >= logical_line_num:
             while len(code_pos) and code_pos[0]-len(to_append)+added_chars > curr_x_pos:
               final_line_code.append(' ')
               curr_x_pos += 1
@@ -313,4 +446,120 @@ class Lexer:
       else:
         curr_line.append((token, _id, code_pos))
 
-    return '\n'.join(final_code)
\ No newline at end of file
+    return '\n'.join(final_code)
+
+# Lexes a source one logical line at a time, yielding the (token, id, code_pos) tuples of Lexer.get_id_mapped_tokens
+# without building the preprocessed source, so memory is bounded by the longest logical line. A string can't run on
+# over the lines after it as it can in the preprocessed source, so such a string is rejected as unclosed.
+# The source is a string, a text or binary file, or a memory-mapped file
+class Streaming_Lexer:
+  def __init__(self, source, tab_spaces=2, encoding='utf-8'):
+    self.source = io.StringIO(source) if isinstance(source, str) else source
+    self.tab_spaces = tab_spaces
+    self.encoding = encoding
+    self.value_map = {}
+    self.values_appeared = defaultdict(list) # Values of all NAME and NUMBER that appear in code
+
+  # Physical lines of the source, without their line break
+  def get_physical_lines(self):
+    while True:
+      physical_line = self.source.readline()
+      if not physical_line:
+        break
+      if isinstance(physical_line, bytes):
+        physical_line = physical_line.decode(self.encoding)
+      yield physical_line[:-1] if physical_line.endswith('\n') else physical_line
+
+  # Logical lines with the number of their last physical line, skipping comments and empty lines as in Lexer.preprocess
+  def get_logical_lines(self):
+    logical_line = ''
+    for physical_line_num, physical_line in enumerate(self.get_physical_lines()):
+      stripped_line = physical_line.strip()
+      if stripped_line.endswith('\\'):
+        logical_line += physical_line.replace('\\', '')
+      elif stripped_line and not stripped_line.startswith('#'):
+        yield logical_line + physical_line.split('#')[0], physical_line_num
+        logical_line = ''
+
+  def get_indent(self, logical_line):
+    current_line_indent = 0
+    for space_char in logical_line[:len(logical_line) - len(logical_line.lstrip())]:
+      if space_char == '\t':
+        current_line_indent += self.tab_spaces
+      elif space_char == ' ':
+        current_line_indent += 1
+
+    return current_line_indent
+
+  # Generator of the tokens, with the NEWLINE, INDENT and DEDENT tokens the markers of Lexer.preprocess would give
+  def tokenise(self):
+    token_id = 0
+    indent_stack = [0]
+
+    for logical_line_num, (logical_line, physical_line_num) in enumerate(self.get_logical_lines()):
+      # Each line after the first starts with the NEWLINE ending the line before
+      line_tokens = [('NEWLINE', 'NEWLINE', -1)] if logical_line_num > 0 else []
+
+      current_line_indent = self.get_indent(logical_line)
+      if current_line_indent > indent_stack[-1]:
+        line_tokens.append(('INDENT', 'INDENT', -1))
+        indent_stack.append(current_line_indent)
+      while current_line_indent < indent_stack[-1]:
+        line_tokens.append(('DEDENT', 'DEDENT', -1))
+        indent_stack.pop()
+
+      self.scan_line(logical_line, line_tokens)
+
+      for token, value, x_position in line_tokens:
+        self.value_map[token_id] = value
+        yield token, token_id, (x_position, physical_line_num)
+        token_id += 1
+
+    # Dedent all the indents that were previously made, at the x positions scanning ' NEWLINE DEDENT ' gives
+    end_tokens = [('NEWLINE', -1), ('DEDENT', -2)] * (len(indent_stack)-1) or [('NEWLINE', -1)]
+    end_tokens.append(('ENDMARKER', -1 if len(indent_stack) > 1 else 0))
+    for token, x_position in end_tokens:
+      self.value_map[token_id] = token
+      yield token, token_id, (x_position, -1)
+      token_id += 1
+
+  # Appends the (token, value, x position) of each token of a logical line to tokens,
+  # with the x position of the last character of the token as in Lexer.scan
+  def scan_line(self, line, tokens):
+    prev_f = False # To tokenize f-strings
+    for match in TOKEN_REGEX.finditer(line):
+      kind = match.lastgroup
+      if kind == 'OTHER':
+        continue
+
+      start, end = match.span(kind)
+      if kind == 'NAME':
+        id_str = line[start:end]
+        prev_f = id_str[0] == 'f' or id_str[0] == 'F'
+        if id_str in KEYWORD_SET:
+          tokens.append((id_str, id_str, end-1))
+        else:
+          tokens.append(('NAME', id_str, end-1))
+          self.values_appeared['NAME'].append(id_str)
+
+      elif kind == 'STRING':
+        if prev_f:
+          tokens.pop()
+          tokens.append(('FSTRING_START', 'FSTRING_START', start))
+          tokens.append(('FSTRING_MIDDLE', line[start+1:end-1], end-1))
+          tokens.append(('FSTRING_END', 'FSTRING_END', end))
+        else:
+          tokens.append(('STRING', line[start+1:end-1], end-1))
+
+      # Strings do not continue over lines
+      elif kind == 'QUOTE':
+        raise Exception(f"UNCLOSED {line[start]}")
+
+      elif kind == 'NUMBER':
+        num = line[start:end]
+        tokens.append(('NUMBER', num, end-1))
+        self.values_appeared['NUMBER'].append(num)
+
+      else:
+        op = line[start:end]
+        tokens.append((op, op, end-1))
@@ -0,0 +1,35 @@
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Counters the parsers keep for each block they run
+BLOCK_COUNTERS = ('cells_filled', 'candidates_pushed', 'candidates_pruned', 'corrections_composed', 'compare_corrections_calls', 'cells_skipped', 'rules_skipped', 'agenda_pops')
+
+# Timings of the phases of a request and counters of every block it ran, for finding where the time of a slow
+# request went. Set as CYK_Parser.metrics to collect them; without it the parser keeps none
+class Parser_Metrics():
+  def __init__(self):
+    self.phase_seconds = defaultdict(float)
+    self.blocks = []
+
+  # Adds the time spent in the body of the with statement to the phase
+  @contextmanager
+  def phase(self, phase_name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phase_seconds[phase_name] += time.perf_counter() - start
+
+  # Metrics of one block run (or found in the block cache), as returned by CYK_Parser.run_block
+  def add_block(self, block_metrics):
+    self.blocks.append(block_metrics)
+
+  def get_totals(self):
+    totals = {'blocks': len(self.blocks), 'cached_blocks': sum(1 for block in self.blocks if block.get('cached'))}
+    for name in ('tokens', 'seconds') + BLOCK_COUNTERS:
+      totals[name] = sum(block.get(name, 0) for block in self.blocks)
+    return totals
+
+  def to_dict(self):
+    return {'phases': dict(self.phase_seconds), 'totals': self.get_totals(), 'blocks': self.blocks}
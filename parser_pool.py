@@ -0,0 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import multiprocessing
+import os
+import threading
+from cyk_parser import CYK_Parser
+
+# Parser held by each worker process, built once when the worker starts
+worker_parser = None
+# Barrier the workers of a pool wait at together while warming up
+warm_up_barrier = None
+
+def init_worker(parser_args, parser_kwargs, barrier):
+  global worker_parser, warm_up_barrier
+  worker_parser = CYK_Parser(*parser_args, **parser_kwargs)
+  warm_up_barrier = barrier
+
+def run_on_worker_parser(method_name, beam_search_n, with_metrics, capture_debug_log, block):
+  worker_parser.beam_search_n = beam_search_n
+  if capture_debug_log:
+    return worker_parser.run_block_capturing_debug_log(method_name, with_metrics, block)
+  return worker_parser.run_block(method_name, with_metrics, block)
+
+# Waits until every worker of the pool holds a task, so each task answers from a different worker, and gives its pid
+def get_ready_worker_pid():
+  warm_up_barrier.wait()
+  return os.getpid()
+
+# Long lived pool of worker processes that each hold a parser, so requests only ship token blocks
+class Parser_Pool():
+  def __init__(self, threads, parser_args, parser_kwargs):
+    self.threads = threads
+    self.parser_args = parser_args
+    # Workers never start pools of their own
+    self.parser_kwargs = dict(parser_kwargs, threads=0)
+    # Pids of the workers, once warm_up has started them
+    self.worker_pids = set()
+    self.lock = threading.Lock()
+    self.start()
+
+  def start(self):
+    barrier = multiprocessing.Barrier(self.threads)
+    self.executor = ProcessPoolExecutor(self.threads, initializer=init_worker, initargs=(self.parser_args, self.parser_kwargs, barrier))
+    self.worker_pids = set()
+
+  # Starts every worker now so the first request doesn't pay for loading the grammar.
+  # Each of the threads tasks waits for the others, so it only returns once every worker has answered with its pid
+  def warm_up(self):
+    futures = [self.executor.submit(get_ready_worker_pid) for _ in range(self.threads)]
+    self.worker_pids = {future.result() for future in futures}
+    if len(self.worker_pids) != self.threads:
+      raise Exception(f'WARM UP REACHED {len(self.worker_pids)} OF {self.threads} WORKERS')
+
+  # Replaces the workers with new ones if one of them died (was killed or ran out of memory), which breaks the pool
+  # for every request using it. Requests that saw the same broken pool only rebuild it once
+  def restart_if_broken(self):
+    with self.lock:
+      try:
+        self.executor.submit(os.getpid).result()
+      except BrokenProcessPool:
+        self.executor.shutdown(wait=False)
+        self.start()
+        self.warm_up()
+
+  # Calls a CYK_Parser method on every block, in the worker processes, giving (result, block metrics) pairs with metrics.
+  # With capture_debug_log each result comes as (result, diagnostic output of the block) as from run_block_capturing_debug_log
+  def map(self, method_name, blocks, beam_search_n, with_metrics=False, capture_debug_log=False):
+    func = partial(run_on_worker_parser, method_name, beam_search_n, with_metrics, capture_debug_log)
+    return list(self.executor.map(func, blocks))
+
+  def shutdown(self):
+    self.executor.shutdown()
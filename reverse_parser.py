@@ -37,11 +37,8 @@ class Reverse_Parser():
 
       return node
     else:
-      left, right = tree[1]
-      left_node_code = self.get_raw_code(left, value_mapping, values)
-      right_node_code = self.get_raw_code(right, value_mapping, values)
-
-      return left_node_code + ' ' + right_node_code
+      # Two children, or one where a nullable child was left out of the tree
+      return ' '.join(self.get_raw_code(child, value_mapping, values) for child in tree[1])
 
   # Gets a random value already in the value list 
   def get_value_for_node(self, node_type, values):
@@ -0,0 +1,51 @@
+from batch_correction import Batch_Corrector, get_filenames
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+# Corrects many files in one process and writes one JSON line per file.
+# Usage: python run_batch_correction.py [path ...] [-o results.jsonl], where paths are files, directories or glob
+# patterns. With no paths (or '-'), newline delimited paths are read from stdin
+PARSER_ARGS = ('./additional_files/grammar_probabilities.json',)
+PARSER_KWARGS = {'fast_mode': True, 'grammar_mode': 'from_data', 'recogniser_mode': 'earley'}
+
+def get_paths(args_paths):
+  for path in args_paths or ['-']:
+    if path == '-':
+      yield from (line.strip() for line in sys.stdin if line.strip())
+    else:
+      yield path
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description='Correct many files, writing the results as JSON lines')
+  arg_parser.add_argument('paths', nargs='*', help="files, directories or glob patterns, '-' for paths on stdin")
+  arg_parser.add_argument('-o', '--output', help='file to write the JSON lines to, stdout by default')
+  arg_parser.add_argument('-b', '--beam-search-n', type=int, default=5)
+  arg_parser.add_argument('-t', '--threads', type=int, default=os.cpu_count())
+  arg_parser.add_argument('--batch-size', type=int, default=100, help='files whose blocks are scheduled together')
+  arg_parser.add_argument('--cache-file', help='sqlite file to keep block results in between runs')
+  arg_parser.add_argument('--debug', action='store_true', help='log the diagnostic output of the lexer and parser to stderr')
+  args = arg_parser.parse_args()
+  logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+  out = open(args.output, 'w') if args.output else sys.stdout
+  start = time.perf_counter()
+  num_files = num_errors = 0
+
+  batch_corrector = Batch_Corrector(PARSER_ARGS, PARSER_KWARGS, threads=args.threads, beam_search_n=args.beam_search_n, batch_size=args.batch_size, block_cache_file=args.cache_file)
+  try:
+    for result in batch_corrector.correct_files(get_filenames(get_paths(args.paths))):
+      out.write(json.dumps(result) + '\n')
+      out.flush()
+      num_files += 1
+      num_errors += 'error' in result
+  finally:
+    batch_corrector.shutdown()
+
+  elapsed = time.perf_counter() - start
+  print(f'Corrected {num_files} files ({num_errors} errors) in {elapsed:.1f}s, {num_files/max(elapsed, 1e-9):.1f} files/s', file=sys.stderr)
+  if args.output:
+    out.close()
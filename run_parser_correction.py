@@ -1,13 +1,15 @@
 from lexer import Lexer
 from cyk_parser import CYK_Parser
 from reverse_parser import Reverse_Parser
+import logging
 import sys
-from uuid import UUID
 
 filename = sys.argv[1]
 beam_search_n = int(sys.argv[2]) if len(sys.argv)>=3 else -1
 
 if __name__ == '__main__':
+  # Show the diagnostic output of the lexer and parser
+  logging.basicConfig(level=logging.DEBUG, format='%(message)s')
   with open(filename) as f:
     conts = f.read()
     lexer = Lexer(conts)
@@ -1,12 +1,104 @@
 from flask import Flask, request, jsonify
+import copy
+import logging
+import os
 import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from uuid import uuid4
 from flask_cors import CORS
 from lexer import Lexer
 from cyk_parser import CYK_Parser
+from parser_pool import Parser_Pool
+from block_cache import Block_Cache
+from edit_session import Edit_Session
+from parser_metrics import Parser_Metrics
+from debug_log import capture_debug_log, log_debug
 
 app = Flask(__name__)
 CORS(app)
 
+THREADS = 30
+PARSER_ARGS = ('./additional_files/grammar_probabilities.json',)
+PARSER_KWARGS = {'fast_mode': True, 'grammar_mode': 'from_data', 'recogniser_mode': 'earley'}
+# Block results cached across requests, also kept on disk if a file is given
+BLOCK_CACHE_ENTRIES = 10000
+BLOCK_CACHE_FILE = None
+# Most edit sessions kept for /run_incremental, the least recently used is dropped first
+MAX_SESSIONS = 100
+# WARNING keeps production quiet, DEBUG logs the diagnostic output of every request. A single request gets its
+# diagnostic output back in the response by sending "debug": true
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')
+# Error of requests with a beam width that corrects nothing
+BEAM_SEARCH_N_ERROR = 'beam_search_n must be at least 1'
+
+logger = logging.getLogger(__name__)
+
+# Parser and warm worker pool shared by every request
+parser = None
+parser_lock = threading.Lock()
+
+# Edit sessions by session id
+sessions = OrderedDict()
+sessions_lock = threading.Lock()
+
+def get_parser():
+  global parser
+  with parser_lock:
+    if parser is None:
+      pool = Parser_Pool(THREADS, PARSER_ARGS, PARSER_KWARGS)
+      pool.warm_up()
+      block_cache = Block_Cache(BLOCK_CACHE_ENTRIES, BLOCK_CACHE_FILE)
+      parser = CYK_Parser(*PARSER_ARGS, threads=THREADS, pool=pool, block_cache=block_cache, **PARSER_KWARGS)
+  return parser
+
+# Shallow copy so concurrent requests can use different beam widths with the same grammar, pool and cache.
+# Requests sending "metrics": true get a Parser_Metrics of their own, returned with the response
+def get_request_parser(beam_search_n, with_metrics=False):
+  request_parser = copy.copy(get_parser())
+  request_parser.beam_search_n = int(beam_search_n)
+  request_parser.metrics = Parser_Metrics() if with_metrics else None
+  return request_parser
+
+# Collects the diagnostic output of the request into a list if it sent "debug": true
+def capture_request_debug_log(data):
+  return capture_debug_log() if data.get("debug", False) else nullcontext()
+
+# JSON response, with the metrics and diagnostic output of the request if it collected them
+def get_response(parser, response, debug_lines=None):
+  if parser.metrics is not None:
+    response["metrics"] = parser.metrics.to_dict()
+  if debug_lines is not None:
+    response["debug"] = debug_lines
+  return jsonify(response)
+
+# Corrects the code a lexer has tokenised
+def correct_lexed_code(parser, lexer):
+  tokens_with_id, value_map = lexer.get_id_mapped_tokens()
+  tokens_with_id = tokens_with_id[:-1]
+
+  log_debug(logger, 'CODE TO CORRECT\n%s', tokens_with_id)
+  
+  # PARSE WITH ERR CORRECTION
+  logger.info('Parsing...')
+  corrected_code = parser.correct_code_with_err_correction_beam_block_optimised(tokens_with_id)
+  with parser.time_phase('reverse_lex'):
+    corrected_final_code = lexer.reverse_lex(corrected_code, value_map, lexer.values_appeared)
+
+  log_debug(logger, 'CORRECTED CODE\n%s', corrected_final_code)
+  return corrected_final_code
+
+# Corrects the code as correct_lexed_code, rebuilding the worker pool and trying once more if a worker died
+def correct_lexed_code_on_pool(parser, lexer):
+  try:
+    return correct_lexed_code(parser, lexer)
+  except BrokenProcessPool:
+    logger.error('WORKER POOL BROKEN, restarting it')
+    parser.pool.restart_if_broken()
+    return correct_lexed_code(parser, lexer)
+
 
 @app.route("/run", methods=["POST"])
 def run_code():
@@ -14,32 +106,72 @@ def run_code():
     code = data.get("code", "")
     beam_search_n = data.get("beam_search_n", 5)
     
-    parser = CYK_Parser('./additional_files/grammar_probabilities.json', fast_mode=True, beam_search_n=int(beam_search_n), threads=30, grammar_mode='from_data')
-    lexer = Lexer(code)
-
-    try:
-      print('Lexing...')
-      tokens_with_code_pos, values_appeared = lexer.tokenise()
-      tokens_with_id, value_map = lexer.get_id_mapped_tokens()
-      tokens_with_id = tokens_with_id[:-1]
+    parser = get_request_parser(beam_search_n, data.get("metrics", False))
+    with capture_request_debug_log(data) as debug_lines:
+      with parser.time_phase('lexing'):
+        lexer = Lexer(code)
 
-      print(f'CODE TO CORRECT\n{tokens_with_id}')
-      print()
+      try:
+        if int(beam_search_n) <= 0:
+          return get_response(parser, {"output": "", "error": BEAM_SEARCH_N_ERROR}, debug_lines)
+        logger.info('Lexing...')
+        with parser.time_phase('lexing'):
+          lexer.tokenise()
+        return get_response(parser, {"output": correct_lexed_code_on_pool(parser, lexer)}, debug_lines)
       
-      # PARSE WITH ERR CORRECTION
-      print('Parsing...')
-      T = []
-      if int(beam_search_n) > 0:
-        corrected_code = parser.correct_code_with_err_correction_beam_block_optimised(tokens_with_id)
-        corrected_final_code = lexer.reverse_lex(corrected_code, value_map, values_appeared)
-
-        print()
-        print(f'CORRECTED CODE\n{corrected_final_code}')
-        return jsonify({"output": corrected_final_code})
-    
-    except Exception as e:
-      print(f"ERROR: {str(e)}")
-      return jsonify({"output": "", "error": str(e)})
+      except Exception as e:
+        logger.error('ERROR: %s', e)
+        return get_response(parser, {"output": "", "error": str(e)}, debug_lines)
+
+# Corrects a file being edited. The first request sends the full "code" and gets a "session_id" back;
+# later requests send the session_id and the "changes" since the last request, each replacing the lines
+# [start_line, end_line) with "lines". Unchanged logical lines aren't tokenised again and unchanged blocks
+# are served from the block cache, so the work done follows the size of the edit
+@app.route("/run_incremental", methods=["POST"])
+def run_incremental():
+    data = request.json
+    session_id = data.get("session_id")
+    beam_search_n = data.get("beam_search_n", 5)
+
+    with sessions_lock:
+      session = sessions.get(session_id)
+      if session is None:
+        if "code" not in data:
+          return jsonify({"output": "", "error": "UNKNOWN SESSION, send the full code to start a new one"})
+        session_id = uuid4().hex
+        session = Edit_Session(data["code"])
+      sessions[session_id] = session
+      sessions.move_to_end(session_id)
+      while len(sessions) > MAX_SESSIONS:
+        sessions.popitem(last=False)
+
+    parser = get_request_parser(beam_search_n, data.get("metrics", False))
+
+    with capture_request_debug_log(data) as debug_lines:
+      try:
+        with session.lock:
+          if "code" in data:
+            session.code = data["code"]
+          session.apply_changes(data.get("changes", []))
+          logger.info('Lexing...')
+          with parser.time_phase('lexing'):
+            lexer = session.tokenise()
+
+        # The changes are kept even then, so the session stays in step with the editor
+        if int(beam_search_n) <= 0:
+          return get_response(parser, {"output": "", "error": BEAM_SEARCH_N_ERROR, "session_id": session_id}, debug_lines)
+        return get_response(parser, {"output": correct_lexed_code_on_pool(parser, lexer), "session_id": session_id}, debug_lines)
+
+      except Exception as e:
+        logger.error('ERROR: %s', e)
+        return get_response(parser, {"output": "", "error": str(e), "session_id": session_id}, debug_lines)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    debug = LOG_LEVEL == 'DEBUG'
+    # In debug mode the reloader runs the module again in a child process that serves, with WERKZEUG_RUN_MAIN set,
+    # so only that process builds the parser pool
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_parser()
+    # Flask's debug mode (reloader and debugger) only when debugging
+    app.run(host="0.0.0.0", port=5001, debug=debug)
@@ -0,0 +1,29 @@
+import cyk_parser
+
+# The agenda correction is a fewest edit correction, so it must make the block parse with no more edits than the
+# error correcting beam, and a search cut short by AGENDA_MAX_POPS must fall back to the beam
+
+def test_agenda_correction_has_fewest_edits(broken_blocks, beam_corrected_blocks, get_parser):
+  agenda = get_parser(correction_mode='agenda')
+  block = get_parser()
+  assert broken_blocks
+  for code in broken_blocks:
+    correction = agenda.get_agenda_correction(code)
+    assert correction is not None, code
+    assert agenda.is_parse_successful(agenda.correction_service.apply_correction(correction, code)), (code, correction)
+
+  for code in beam_corrected_blocks:
+    beam_correction = block.get_block_correction(code)
+    assert len(agenda.get_agenda_correction(code)) <= len(beam_correction), (code, beam_correction)
+
+def test_agenda_falls_back_to_beam(beam_corrected_blocks, get_parser):
+  agenda = get_parser(correction_mode='agenda')
+  block = get_parser()
+  code = max(beam_corrected_blocks, key=len)
+  max_pops = cyk_parser.AGENDA_MAX_POPS
+  cyk_parser.AGENDA_MAX_POPS = 1
+  try:
+    assert agenda.get_agenda_correction(code) is None
+    assert agenda.get_block_correction(code) == block.get_block_correction(code)
+  finally:
+    cyk_parser.AGENDA_MAX_POPS = max_pops
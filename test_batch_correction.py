@@ -0,0 +1,56 @@
+import os
+from batch_correction import Batch_Corrector, get_filenames
+from conftest import GRAMMAR_FILE, PARSER_KWARGS
+from lexer import Lexer
+
+# Correcting a directory with Batch_Corrector must give each file the output of correcting it on its own, whatever
+# the batch size, with files that don't lex failing alone
+NUM_SNIPPETS = 6
+# Batch_Corrector takes the beam width and threads on their own
+BATCH_PARSER_KWARGS = {name: value for name, value in PARSER_KWARGS.items() if name not in ('beam_search_n', 'threads')}
+
+# Output or error of correcting one source, as the server does
+def correct_source(parser, source):
+  try:
+    lexer = Lexer(source)
+    lexer.tokenise()
+    tokens_with_id, value_map = lexer.get_id_mapped_tokens()
+    corrected_code = parser.correct_code_with_err_correction_beam_block_optimised(tokens_with_id[:-1])
+    return {'output': lexer.reverse_lex(corrected_code, value_map, lexer.values_appeared)}
+  except Exception as e:
+    return {'output': '', 'error': str(e)}
+
+def test_batch_correction_of_directory(tmp_path, corpus, get_parser):
+  sources = {}
+  for i, snippet in enumerate(corpus[:NUM_SNIPPETS]):
+    sources[os.path.join(tmp_path, 'a' if i % 2 else 'b', f'snippet_{i}.py')] = snippet['source']
+  sources[os.path.join(tmp_path, 'a', 'unclosed.py')] = "s = 'unclosed\n"
+  for filename, source in sources.items():
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+      f.write(source)
+  with open(os.path.join(tmp_path, 'a', 'notes.txt'), 'w') as f:
+    f.write('not python\n')
+
+  filenames = list(get_filenames([str(tmp_path)]))
+  assert filenames == sorted(sources)
+
+  parser = get_parser()
+  expected = [correct_source(parser, sources[filename]) for filename in filenames]
+  assert any('error' in result for result in expected) and any('error' not in result for result in expected)
+
+  for batch_size in (1, 3, 100):
+    batch_corrector = Batch_Corrector((GRAMMAR_FILE,), BATCH_PARSER_KWARGS, threads=0, beam_search_n=PARSER_KWARGS['beam_search_n'], batch_size=batch_size)
+    try:
+      results = list(batch_corrector.correct_files(filenames))
+    finally:
+      batch_corrector.shutdown()
+
+    assert [result['file'] for result in results] == filenames
+    for result, expected_result in zip(results, expected):
+      assert result['output'] == expected_result['output'], result['file']
+      assert result.get('error') == expected_result.get('error'), result['file']
+      if 'error' not in result:
+        assert result['valid'] == (result['corrected_blocks'] == 0)
+        assert result['seconds'] >= result['lex_seconds']
+    assert {True, False} <= {result.get('valid') for result in results}
@@ -0,0 +1,79 @@
+import copy
+import block_cache
+from block_cache import Block_Cache, get_code_checksum
+from conftest import GRAMMAR_FILE, PARSER_KWARGS
+from cyk_parser import CYK_Parser
+
+# A result served from the block cache, from memory or from the sqlite file, must be the result of running the block
+# again, and a parser with another grammar or other parser code must not be served the results of this one
+
+def get_cached_parser(cache):
+  return CYK_Parser(GRAMMAR_FILE, block_cache=cache, **PARSER_KWARGS)
+
+def test_cache_hit_equals_fresh_run(tmp_path, corpus_blocks, beam_corrected_blocks, get_parser):
+  parser = get_parser()
+  blocks = corpus_blocks[:30]
+  valid = [parser.is_parse_successful(block) for block in blocks]
+  corrections = [parser.get_block_correction(block) for block in beam_corrected_blocks]
+
+  cache_file = str(tmp_path / 'block_cache.sqlite')
+  cache = Block_Cache(cache_file=cache_file)
+  cached_parser = get_cached_parser(cache)
+  assert cached_parser.map_blocks('is_parse_successful', blocks) == valid
+  assert cached_parser.map_blocks('get_block_correction', beam_corrected_blocks) == corrections
+  misses = cache.misses
+  assert cache.hits < len(blocks) and misses > 0
+
+  # From the LRU entries
+  assert cached_parser.map_blocks('is_parse_successful', blocks) == valid
+  assert cached_parser.map_blocks('get_block_correction', beam_corrected_blocks) == corrections
+  assert cache.misses == misses
+  cache.close()
+
+  # From the sqlite file, with nothing in memory
+  cache = Block_Cache(cache_file=cache_file)
+  cached_parser = get_cached_parser(cache)
+  assert cached_parser.map_blocks('is_parse_successful', blocks) == valid
+  assert cached_parser.map_blocks('get_block_correction', beam_corrected_blocks) == corrections
+  assert cache.misses == 0 and cache.hits == len(blocks) + len(beam_corrected_blocks)
+  cache.close()
+
+def test_lru_eviction_falls_back_to_file(tmp_path, corpus_blocks):
+  cache = Block_Cache(max_entries=2, cache_file=str(tmp_path / 'block_cache.sqlite'))
+  keys = list(dict.fromkeys(cache.get_key('is_parse_successful', block, ()) for block in corpus_blocks))[:3]
+  for i, key in enumerate(keys):
+    cache.put(key, i)
+  assert keys[0] not in cache.entries and list(cache.entries) == keys[1:]
+  assert cache.get(keys[0]) == (True, 0)
+  assert list(cache.entries) == [keys[2], keys[0]]
+  cache.close()
+
+  cache = Block_Cache(max_entries=2)
+  for i, key in enumerate(keys):
+    cache.put(key, i)
+  assert cache.get(keys[0]) == (False, None) and cache.get(keys[2]) == (True, 2)
+
+def test_key_changes_with_grammar_and_code(tmp_path, corpus_blocks, monkeypatch):
+  cache_file = str(tmp_path / 'block_cache.sqlite')
+  cache = Block_Cache(cache_file=cache_file)
+  cached_parser = get_cached_parser(cache)
+  blocks = corpus_blocks[:10]
+  cached_parser.map_blocks('is_parse_successful', blocks)
+
+  for name in ('grammar_checksum', 'code_checksum'):
+    other_parser = copy.copy(cached_parser)
+    setattr(other_parser, name, 'other')
+    # Neither tier has its results
+    other_parser.block_cache = Block_Cache(cache_file=cache_file)
+    other_parser.map_blocks('is_parse_successful', blocks)
+    assert other_parser.block_cache.hits == 0, name
+    other_parser.block_cache.close()
+  cache.close()
+
+  # The code checksum follows the parser code
+  code_file = tmp_path / 'parser_code.py'
+  monkeypatch.setattr(block_cache, 'PARSER_CODE_FILES', (str(code_file),))
+  code_file.write_text('x = 1\n')
+  checksum = get_code_checksum()
+  code_file.write_text('x = 2\n')
+  assert get_code_checksum() != checksum
@@ -0,0 +1,65 @@
+# compare_corrections scores ties from correction summaries, and must order corrections as applying them and
+# scoring the whole corrected block with calc_log_probability_of_sequence did. Every comparison the error
+# correcting beam makes on the corpus blocks is checked, and those of the chart without a beam on the shorter ones
+MAX_FULL_CHART_TOKENS = 12
+
+# Comparisons where the two corrected blocks have the same bigrams, as (block, start, length, new correction,
+# kept correction). The scaled integer scores tie, so the kept correction stays, while the float sums of the old
+# ordering differed in their last bits and picked a side
+ACCEPTED_TIES = [
+  ('for NAME in NAME ( [ ) : NEWLINE INDENT STUB-BLOCK DEDENT', 3, 3, [['r', '5', ')'], ['r', '3', '<']], [['r', '5', ')'], ['r', '3', 'in']]),
+  ('for NAME in NAME ( [ ) : NEWLINE INDENT STUB-BLOCK DEDENT', 3, 4, [['r', '5', ')'], ['r', '3', '<'], ['d', '6']], [['r', '5', ')'], ['r', '3', 'in'], ['d', '6']]),
+  ('for NAME in NAME ( [ ) : NEWLINE INDENT STUB-BLOCK DEDENT', 3, 6, [['r', '8', ')'], ['r', '7', ','], ['r', '5', '('], ['r', '3', '<']], [['r', '8', ')'], ['r', '7', ','], ['r', '5', '('], ['r', '3', 'in']]),
+  ('for NAME in NAME ( NUMBER ) NEWLINE INDENT STUB-BLOCK DEDENT', 0, 4, [['r', '0', 'NAME'], ['i', '4', 'NEWLINE'], ['i', '1', ':'], ['i', '0', '->']], [['r', '0', '->'], ['i', '4', 'NEWLINE'], ['i', '4', 'NAME'], ['i', '4', ':']]),
+  ('for NAME in NAME ( NUMBER ) NEWLINE INDENT STUB-BLOCK DEDENT', 3, 3, [['r', '5', ')'], ['r', '3', '<']], [['r', '5', ')'], ['r', '3', 'in']]),
+  ('for NAME in NAME ( NUMBER ) NEWLINE INDENT STUB-BLOCK DEDENT', 3, 4, [['r', '5', ')'], ['r', '3', '<'], ['d', '6']], [['r', '5', ')'], ['r', '3', 'in'], ['d', '6']]),
+  ('for NAME in NAME ( NUMBER ) NEWLINE INDENT STUB-BLOCK DEDENT', 3, 6, [['r', '8', ')'], ['r', '7', ','], ['r', '3', '<'], ['d', '6']], [['r', '8', ')'], ['r', '7', ','], ['r', '3', 'in'], ['d', '6']]),
+]
+
+# The ordering compare_corrections replaced, which applies both corrections to the whole block
+def get_old_ordering(parser, corr1, corr2, code):
+  correction_service = parser.correction_service
+  if len(corr1) != len(corr2):
+    return len(corr1) < len(corr2)
+
+  num_one_operation_corr_1 = correction_service.get_num_deletions(corr1) + correction_service.get_num_insertions(corr1)
+  num_one_operation_corr_2 = correction_service.get_num_deletions(corr2) + correction_service.get_num_insertions(corr2)
+  if num_one_operation_corr_1 != num_one_operation_corr_2:
+    return num_one_operation_corr_1 > num_one_operation_corr_2
+
+  prob_1 = parser.calc_log_probability_of_sequence(correction_service.apply_correction(corr1, code), parser.bigram_log_probabilities)
+  prob_2 = parser.calc_log_probability_of_sequence(correction_service.apply_correction(corr2, code), parser.bigram_log_probabilities)
+  return prob_1 > prob_2
+
+def test_compare_corrections_matches_old_ordering(broken_blocks, get_parser, monkeypatch):
+  parser = get_parser()
+  correction_service = parser.correction_service
+  compare_corrections = parser.compare_corrections
+  comparisons = []
+  def record_comparison(corr1, parts1, corr2, summary2, s, l, code):
+    result = compare_corrections(corr1, parts1, corr2, summary2, s, l, code)
+    comparisons.append((corr1, parts1, corr2, summary2, s, l, code, result))
+    return result
+  monkeypatch.setattr(parser, 'compare_corrections', record_comparison)
+
+  for block in broken_blocks:
+    parser.parse_with_err_correction_beam(block)
+    if len(block) <= MAX_FULL_CHART_TOKENS:
+      parser.parse_with_err_correction(block)
+
+  ties = set()
+  num_inexact = 0
+  for corr1, parts1, corr2, summary2, s, l, code, result in comparisons:
+    # Compositions reaching the bigram scores whose summary is taken from the applied correction
+    summary_1, summary_2 = parts1
+    num_insertions, num_deletions = summary_1[0] + summary_2[0], summary_1[1] + summary_2[1]
+    if len(corr1) == len(corr2) and num_insertions + num_deletions == summary2[0] + summary2[1] and not correction_service.is_exact_composition(corr1, summary_1[2] + summary_2[2], num_deletions, num_insertions):
+      num_inexact += 1
+
+    if result != get_old_ordering(parser, corr1, corr2, code):
+      summary1 = parser.concat_summaries(corr1, *parts1, s, l, code)
+      assert parser.get_span_score(summary1, s, l, code) == parser.get_span_score(summary2, s, l, code), (corr1, corr2, code)
+      ties.add((' '.join(token for token, token_id, code_pos in code), s, l, corr1, corr2))
+
+  assert num_inexact > 0
+  assert ties == {(block, s, l, correction_service.pack(corr1), correction_service.pack(corr2)) for block, s, l, corr1, corr2 in ACCEPTED_TIES}
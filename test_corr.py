@@ -1,4 +0,0 @@
-from correction import Correction
-
-c = Correction()
-c.compose(['r|0|or', 'r|1|[', 'r|2|]', 'i|0|NAME', 'i|4|NAME', 'i|4|and'], ['r|3|)'])
\ No newline at end of file
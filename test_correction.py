@@ -0,0 +1,76 @@
+import random
+from correction import Correction, Token_Id_Allocator, FIRST_SYNTHETIC_ID, REPLACE, DELETE, INSERT
+
+# Randomised property tests of the merge based composition against normalise, which is the reference
+SEED = 0
+CASES = 20000
+
+c = Correction()
+
+def get_random_correction(rng, low, high, max_ops):
+  correction = []
+  for _ in range(rng.randint(0, max_ops)):
+    op = rng.choice((REPLACE, DELETE, INSERT))
+    correction.append((op, rng.randint(low, high), None if op == DELETE else rng.choice(('NAME', 'NUMBER', ')'))))
+
+  return c.normalise(correction)
+
+# Pairs of normalised corrections, either over the same tokens or with p2 only editing tokens after p1, as in the parser
+def get_random_pairs(max_ops):
+  rng = random.Random(SEED)
+  for _ in range(CASES):
+    if rng.random() < 0.5:
+      yield get_random_correction(rng, 0, 6, max_ops), get_random_correction(rng, 0, 6, max_ops), rng.randint(0, 6)
+    else:
+      yield get_random_correction(rng, 0, 4, max_ops), get_random_correction(rng, 5, 9, max_ops), rng.randint(0, 6)
+
+def test_merge_matches_normalise():
+  for p1, p2, j in get_random_pairs(8):
+    assert c.merge(p1, p2) == c.normalise(p1 + p2), (p1, p2)
+
+def test_compose_matches_normalise():
+  for p1, p2, j in get_random_pairs(4):
+    shift = c.get_num_insertions(p1) - c.get_num_deletions(p1)
+    assert c.compose(p1, p2) == c.normalise(p1 + c.offset_indices(p2, shift)), (p1, p2)
+
+def test_compose_for_insertion_matches_normalise():
+  for p, sigma, j in get_random_pairs(4):
+    shift = j + c.get_num_insertions(p) - c.get_num_deletions(p)
+    assert c.compose_for_insertion_forward(p, sigma, j) == c.normalise(p + c.offset_indices(sigma, shift)), (p, sigma, j)
+    assert c.compose_for_insertion_backward(p, sigma, j) == c.normalise(sigma + c.offset_indices(p, len(sigma))), (p, sigma, j)
+
+def test_results_are_tuples():
+  for p1, p2, j in get_random_pairs(4):
+    assert type(c.merge(p1, p2)) is tuple
+    assert type(c.compose(p1, p2)) is tuple
+
+# The case test_corr.py composed, with the result the list based compose gave before corrections were packed
+def test_compose_example():
+  p1 = c.pack([['r', '0', 'or'], ['r', '1', '['], ['r', '2', ']'], ['i', '0', 'NAME'], ['i', '4', 'NAME'], ['i', '4', 'and']])
+  p2 = c.pack([['r', '3', ')']])
+  assert c.unpack(c.compose(p1, p2)) == [['r', '3', ')'], ['r', '2', ']'], ['r', '1', '['], ['r', '0', 'or'], ['i', '3', 'NAME'], ['i', '3', 'and'], ['i', '0', 'NAME']]
+
+if __name__ == '__main__':
+  test_merge_matches_normalise()
+  test_compose_matches_normalise()
+  test_compose_for_insertion_matches_normalise()
+  test_results_are_tuples()
+  test_compose_example()
+  print('OK')
+
+# Tokens corrections insert or replace get ids unique across all the blocks corrected together, below the lexer ids
+# (0 up) and the id of the ENDMARKER added after correction (-1), and the same on every run
+def test_token_id_allocator(beam_corrected_blocks, get_parser):
+  id_allocator = Token_Id_Allocator()
+  assert [id_allocator.get_id() for _ in range(3)] == [FIRST_SYNTHETIC_ID, FIRST_SYNTHETIC_ID-1, FIRST_SYNTHETIC_ID-2]
+  assert FIRST_SYNTHETIC_ID < -1
+
+  parser = get_parser()
+  corrected_blocks = parser.correct_block_collection(beam_corrected_blocks)
+  lexer_ids = {token_id for block in beam_corrected_blocks for token, token_id, code_pos in block}
+  ids = [token_id for block in corrected_blocks for token, token_id, code_pos in block]
+  synthetic_ids = [token_id for token_id in ids if token_id not in lexer_ids]
+  assert min(lexer_ids) >= 0
+  assert synthetic_ids and all(token_id < -1 for token_id in synthetic_ids)
+  assert len(set(synthetic_ids)) == len(synthetic_ids)
+  assert parser.correct_block_collection(beam_corrected_blocks) == corrected_blocks
@@ -0,0 +1,45 @@
+import random
+from corpus import generate_corpus
+from edit_session import Edit_Session
+from lexer import Lexer
+
+# Randomised test of the incremental tokenising of Edit_Session against lexing the edited code from scratch
+SEED = 0
+EDITS = 300
+
+# Lines of the benchmark corpus, with and without errors, and lines that continue or indent the ones around them
+corpus = generate_corpus(SEED, [5, 10], [0, 2], 3)
+LINES = [line for snippet in corpus for source in (snippet['source'], snippet['valid_source']) for line in source.split('\n')]
+LINES += ['if x:', '  y = (1,', '       2)', 'def f(a,', '      b):', '  return "a # b"', '# comment', '', '    ', 'x = [1, 2, \\', '     3]', '  else:', "s = f'{x}'"]
+
+def get_random_change(rng, num_lines):
+  start_line = rng.randint(0, num_lines)
+  end_line = rng.randint(start_line, min(num_lines, start_line + 3))
+  return {'start_line': start_line, 'end_line': end_line, 'lines': [rng.choice(LINES) for _ in range(rng.randint(0, 3))]}
+
+def lex(code):
+  lexer = Lexer(code)
+  try:
+    lexer.tokenise()
+  except Exception as e:
+    return 'error', str(e)
+  return lexer.tokens, lexer.values_appeared, lexer.get_id_mapped_tokens()
+
+def tokenise_session(session):
+  try:
+    lexer = session.tokenise()
+  except Exception as e:
+    return 'error', str(e)
+  return lexer.tokens, lexer.values_appeared, lexer.get_id_mapped_tokens()
+
+def test_incremental_tokens_match_full_lex():
+  rng = random.Random(SEED)
+  session = Edit_Session('\n'.join(rng.choice(LINES) for _ in range(20)))
+  for _ in range(EDITS):
+    change = get_random_change(rng, len(session.code.split('\n')))
+    session.apply_changes([change])
+    assert tokenise_session(session) == lex(session.code), (change, session.code)
+
+if __name__ == '__main__':
+  test_incremental_tokens_match_full_lex()
+  print('OK')
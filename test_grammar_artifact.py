@@ -0,0 +1,64 @@
+import shutil
+import pytest
+import grammar_artifact
+from conftest import GRAMMAR_FILE, PARSER_KWARGS
+from cyk_parser import CYK_Parser
+from grammar_artifact import ARTIFACT_MAGIC, ARTIFACT_VERSION, get_artifact_file, load_artifact, save_artifact
+
+# A parser loads the artifact built from its source files instead of building the tables, and rejects an artifact
+# with another magic, version or source checksum, building the tables again
+
+@pytest.fixture
+def grammar_file(tmp_path):
+  grammar_file = str(tmp_path / 'grammar_probabilities.json')
+  shutil.copy(GRAMMAR_FILE, grammar_file)
+  return grammar_file
+
+# Counts the calls of CYK_Parser.build_tables
+@pytest.fixture
+def build_calls(monkeypatch):
+  build_calls = []
+  build_tables = CYK_Parser.build_tables
+  def count_build_tables(self, *args):
+    build_calls.append(args)
+    return build_tables(self, *args)
+  monkeypatch.setattr(CYK_Parser, 'build_tables', count_build_tables)
+  return build_calls
+
+def check_parser(parser, blocks, get_parser):
+  reference = get_parser()
+  assert [parser.is_parse_successful(block) for block in blocks] == [reference.is_parse_successful(block) for block in blocks]
+
+def test_artifact_is_loaded(grammar_file, build_calls, corpus_blocks, get_parser):
+  CYK_Parser(grammar_file, **PARSER_KWARGS).save_grammar_artifact()
+  assert len(build_calls) == 1
+
+  parser = CYK_Parser(grammar_file, **PARSER_KWARGS)
+  assert len(build_calls) == 1
+  check_parser(parser, corpus_blocks[:50], get_parser)
+
+@pytest.mark.parametrize('stale_field', ['magic', 'version', 'checksum'])
+def test_stale_artifact_is_rebuilt(stale_field, grammar_file, build_calls, corpus_blocks, get_parser, monkeypatch):
+  checksum = CYK_Parser(grammar_file, **PARSER_KWARGS).grammar_checksum
+  artifact_file = get_artifact_file(grammar_file)
+
+  # Tables that would break the parser if they were loaded
+  if stale_field == 'magic':
+    monkeypatch.setattr(grammar_artifact, 'ARTIFACT_MAGIC', b'OLDGRAM\0')
+  elif stale_field == 'version':
+    monkeypatch.setattr(grammar_artifact, 'ARTIFACT_VERSION', ARTIFACT_VERSION + 1)
+  save_artifact(artifact_file, checksum if stale_field != 'checksum' else bytes(len(checksum)), {})
+  monkeypatch.setattr(grammar_artifact, 'ARTIFACT_MAGIC', ARTIFACT_MAGIC)
+  monkeypatch.setattr(grammar_artifact, 'ARTIFACT_VERSION', ARTIFACT_VERSION)
+  assert load_artifact(artifact_file, checksum) is None
+
+  parser = CYK_Parser(grammar_file, **PARSER_KWARGS)
+  assert len(build_calls) == 2
+  check_parser(parser, corpus_blocks[:50], get_parser)
+
+# The checksum follows the grammar, so editing it makes the artifact stale
+def test_checksum_follows_grammar(grammar_file):
+  checksum = CYK_Parser(grammar_file, **PARSER_KWARGS).grammar_checksum
+  with open(grammar_file, 'a') as f:
+    f.write('\n')
+  assert grammar_artifact.get_source_checksum(grammar_file, PARSER_KWARGS['grammar_mode']) != checksum
@@ -0,0 +1,51 @@
+import sys
+from k_best_corrections import K_Best_Corrections
+
+# The first of get_block_corrections is get_block_correction, and the others give different tokens that parse.
+# Derivations are as deep as the block is long, so they must be found without recursing once per level
+K = 3
+
+def test_k_best_corrections(beam_corrected_blocks, get_parser):
+  parser = get_parser()
+  found_more = False
+  checked = 0
+  for code in beam_corrected_blocks:
+    first = parser.get_block_correction(code)
+    # The beam's correction needn't make the block parse, where corrections at the same index compose
+    if not parser.is_parse_successful(parser.correction_service.apply_correction(first, code)):
+      continue
+
+    corrections = parser.get_block_corrections(code, K)
+    assert 1 <= len(corrections) <= K
+    assert corrections[0] == first, code
+    found_more = found_more or len(corrections) > 1
+    checked += 1
+
+    corrected_tokens = set()
+    for correction in corrections:
+      corrected_block = parser.correction_service.apply_correction(correction, code)
+      corrected_tokens.add(tuple(token for token, token_id, code_pos in corrected_block))
+      assert parser.is_parse_successful(corrected_block), (code, correction)
+    assert len(corrected_tokens) == len(corrections), (code, corrections)
+  assert checked and found_more
+
+# Composes corrections by concatenating them, which is all a chain of binary edges needs
+class Concatenating_Correction_Service():
+  def compose(self, left, right):
+    return left + right
+
+def test_deep_derivations():
+  # A chain A -> B A over a block longer than the recursion limit, with two leaves for each token
+  length = sys.getrecursionlimit() * 2
+  A, B = 0, 1
+  hyperedges = {}
+  for s in range(length):
+    hyperedges[B, s, 1] = [(0, 0.0, None, ()), (1, 1.0, None, (s,))]
+    hyperedges[A, s, length-s] = [(0, 0.0, (1, B, A), ())] if s < length-1 else [(0, 0.0, None, ())]
+
+  k_best = K_Best_Corrections(hyperedges, {}, Concatenating_Correction_Service())
+  goal = (A, 0, length, True)
+  assert k_best.get_derivation(goal, 0)[0] == 0 and k_best.get_correction(goal, 0) == ()
+  assert k_best.get_derivation(goal, 1)[0] == 1
+  assert len(k_best.get_correction(goal, 1)) == 1
+  assert list(k_best.iter_corrections(goal, 3, seen=((),)))[0] == k_best.get_correction(goal, 1)
@@ -0,0 +1,82 @@
+import glob
+from lexer import Lexer, Streaming_Lexer
+
+# The regex scanner must give the tokens the character by character scanner gives, and the streaming lexer the
+# id mapped form of the tokens Lexer.tokenise gives, on hand written cases, the corpus sources and the files of this
+# repository. Sources one scanner rejects must be rejected by the other with the same error
+EDGE_CASES = [
+  'x = 1\n',
+  'x = 1',
+  'def f(a, b=2, *args, **kwargs):\n  return a + b\n',
+  'class A(B):\n  def __init__(self):\n    self.x = [1, 2,\n      3]\n\n  def g(self):\n    if self.x:\n      return {\'a\': 1, "b": (2, 3)}\n    else:\n      pass\n',
+  's = f\'{x} and {y!r}\'\nt = f"a{b}c"\n',
+  'z = 1.5 + 1e3 - 0x1f * 2 ** 3 // 4 % 5\n',
+  'a = b if c else d\nwhile not e and f or g:\n  h -= 1\n  break\n',
+  'x = (1 +\n     2)\ny = \\\n  3\n',
+  '# comment only\nx = 1 # trailing\n\n\n   \ny = 2\n',
+  '@decorator\ndef f():\n  lambda x: x\n  yield from g()\n',
+  "for i in range(10):\n  for j in range(i):\n    if i == j:\n      continue\n  print(i)\nprint('done')\n",
+  'try:\n  x = a[1:2, ::3]\nexcept ValueError as e:\n  raise\nfinally:\n  del x\n',
+  "with open(f) as g, open(h) as k:\n  assert g is not k, 'msg'\n",
+  'x = [i for i in y if i != 0]\nd = {k: v for k, v in z.items()}\n',
+  'import os\nfrom a.b import c as d, e\nglobal q\nnonlocal r\n',
+  'x = (1,\n# inner comment\n2)\n',
+  'if x:\n  pass\nelif y:\n  pass\nelse:\n  pass\n',
+  'x <= y >= z < w > v\nx += 1\nx *= 2\nx /= 3\n',
+  'x = ...\n',
+  'if x:\n  if y:\n    z\n',
+  'if x:\n\ty = 1\n',
+  "s = 'a\\'b'\n",
+  's = "a\\"b"\n',
+  "s = 'unclosed\n",
+  "x = '''a\n  b'''\ny = 1\n",
+  "x = 'a # b'\ny = 1\n",
+  'x = $\n',
+  '',
+]
+
+def get_sources(corpus):
+  sources = list(EDGE_CASES)
+  for snippet in corpus:
+    sources += [snippet['source'], snippet['valid_source']]
+  for file_name in sorted(glob.glob('*.py')):
+    with open(file_name) as f:
+      sources.append(f.read())
+  return sources
+
+# The tokens and values of a source, or the error lexing it raised
+def get_lexed(source, scan_mode):
+  try:
+    tokens, values_appeared = Lexer(source, scan_mode=scan_mode).tokenise()
+  except Exception as e:
+    return repr(e)
+  return tokens, dict(values_appeared)
+
+def test_regex_scanner_matches_step_scanner(corpus):
+  num_lexed = 0
+  for source in get_sources(corpus):
+    lexed = get_lexed(source, 'regex')
+    assert lexed == get_lexed(source, 'step'), source
+    num_lexed += not isinstance(lexed, str)
+  assert num_lexed > len(EDGE_CASES)
+
+def test_streaming_lexer_matches_lexer(corpus):
+  for source in get_sources(corpus):
+    lexed = get_lexed(source, 'regex')
+    if isinstance(lexed, str):
+      continue
+    tokens, values_appeared = lexed
+    streaming_lexer = Streaming_Lexer(source)
+    try:
+      streaming_tokens = list(streaming_lexer.tokenise())
+    except Exception as e:
+      # Streaming_Lexer lexes one logical line at a time, so it rejects a string Lexer runs on over the markers of
+      # the lines after it
+      assert str(e).startswith('UNCLOSED'), source
+      assert any(token in ('STRING', 'FSTRING_MIDDLE') and ' NEWLINE ' in value for token, value, code_pos in tokens), source
+      continue
+
+    expected = [(token, i, code_pos) for i, (token, value, code_pos) in enumerate(tokens)]
+    assert streaming_tokens == expected, source
+    assert streaming_lexer.value_map == {i: value for i, (token, value, code_pos) in enumerate(tokens)}, source
+    assert dict(streaming_lexer.values_appeared) == values_appeared, source
@@ -0,0 +1,87 @@
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from conftest import GRAMMAR_FILE, PARSER_KWARGS
+from cyk_parser import CYK_Parser
+from debug_log import capture_debug_log
+from parser_pool import Parser_Pool
+
+# Blocks run on a warm Parser_Pool must give the results and diagnostic output of the parser in this process, and a
+# pool broken by a worker dying must be rebuilt by restart_if_broken.
+# The window correction mode logs the windows it corrects from the workers
+THREADS = 2
+POOL_KWARGS = dict(PARSER_KWARGS, correction_mode='window')
+
+@pytest.fixture(scope='module')
+def pool():
+  pool = Parser_Pool(THREADS, (GRAMMAR_FILE,), POOL_KWARGS)
+  pool.warm_up()
+  yield pool
+  pool.shutdown()
+
+def test_warm_up_reaches_every_worker(pool):
+  assert len(pool.worker_pids) == THREADS
+  assert os.getpid() not in pool.worker_pids
+
+def test_run_blocks_on_pool(pool, corpus_blocks, get_parser):
+  parser = get_parser()
+  pool_parser = CYK_Parser(GRAMMAR_FILE, pool=pool, **POOL_KWARGS)
+  blocks = corpus_blocks[:40]
+  assert pool_parser.run_blocks('is_parse_successful', blocks) == parser.run_blocks('is_parse_successful', blocks)
+
+  results = pool_parser.run_blocks('is_parse_successful', blocks, with_metrics=True)
+  assert [result for result, block_metrics in results] == [parser.is_parse_successful(block) for block in blocks]
+  assert [block_metrics['tokens'] for result, block_metrics in results] == [len(block) for block in blocks]
+
+# run_blocks starts the longest blocks first, and gives the results in the order of the blocks
+def test_run_blocks_keeps_order(pool, corpus_blocks, get_parser, monkeypatch):
+  blocks = corpus_blocks[:40]
+  assert sorted(blocks, key=len, reverse=True) != blocks
+  expected = [(get_parser().is_parse_successful(block), len(block)) for block in blocks]
+
+  parser = CYK_Parser(GRAMMAR_FILE, **PARSER_KWARGS)
+  run_lengths = []
+  run_block = parser.run_block
+  def record_run_block(method_name, with_metrics, block):
+    run_lengths.append(len(block))
+    return run_block(method_name, with_metrics, block)
+  monkeypatch.setattr(parser, 'run_block', record_run_block)
+  threads_parser = CYK_Parser(GRAMMAR_FILE, **dict(PARSER_KWARGS, threads=THREADS))
+  pool_parser = CYK_Parser(GRAMMAR_FILE, pool=pool, **POOL_KWARGS)
+
+  for run_parser in (parser, threads_parser, pool_parser):
+    results = run_parser.run_blocks('is_parse_successful', blocks, with_metrics=True)
+    assert [(result, block_metrics['tokens']) for result, block_metrics in results] == expected
+  assert run_lengths == sorted(run_lengths, reverse=True) and len(run_lengths) == len(blocks)
+
+def test_run_blocks_on_pool_captures_debug_log(pool, broken_blocks, get_parser):
+  parser = get_parser(correction_mode='window')
+  pool_parser = CYK_Parser(GRAMMAR_FILE, pool=pool, **POOL_KWARGS)
+  with capture_debug_log() as debug_lines:
+    corrections = parser.run_blocks('get_window_correction', broken_blocks)
+  with capture_debug_log() as pool_debug_lines:
+    assert pool_parser.run_blocks('get_window_correction', broken_blocks) == corrections
+  assert debug_lines and pool_debug_lines == debug_lines
+
+  # Without a capture the results come alone
+  assert pool_parser.run_blocks('get_window_correction', broken_blocks) == corrections
+
+def test_restart_if_broken(pool, corpus_blocks, get_parser):
+  parser = get_parser()
+  pool_parser = CYK_Parser(GRAMMAR_FILE, pool=pool, **POOL_KWARGS)
+  blocks = corpus_blocks[:10]
+  old_worker_pids = pool.worker_pids
+  # A worker exiting while it runs a task breaks the pool
+  with pytest.raises(BrokenProcessPool):
+    pool.executor.submit(os._exit, 1).result()
+  with pytest.raises(BrokenProcessPool):
+    pool_parser.run_blocks('is_parse_successful', blocks)
+
+  pool.restart_if_broken()
+  assert len(pool.worker_pids) == THREADS and not pool.worker_pids & old_worker_pids
+  assert pool_parser.run_blocks('is_parse_successful', blocks) == parser.run_blocks('is_parse_successful', blocks)
+
+  # A pool that isn't broken keeps its workers
+  worker_pids = pool.worker_pids
+  pool.restart_if_broken()
+  assert pool.worker_pids == worker_pids
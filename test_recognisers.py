@@ -0,0 +1,65 @@
+import random
+from corpus import lex
+from utils import split_into_blocks
+
+# The Earley and early exit recognisers must give the same validity as the exact bitset chart, on valid blocks,
+# blocks with the corpus errors and blocks with random tokens deleted, replaced or inserted
+SEED = 0
+MUTATIONS = 2
+TOKENS = ['NAME', 'NUMBER', '(', ')', ':', '=', ',', 'NEWLINE', 'if', 'return', '+', '[', ']']
+
+def get_mutated_blocks(blocks):
+  rng = random.Random(SEED)
+  for block in blocks:
+    for _ in range(MUTATIONS):
+      mutated = list(block)
+      i = rng.randrange(len(mutated))
+      op = rng.randrange(3)
+      if op == 0:
+        del mutated[i]
+      elif op == 1:
+        mutated[i] = (rng.choice(TOKENS),) + mutated[i][1:]
+      else:
+        mutated.insert(i, (rng.choice(TOKENS),) + mutated[i][1:])
+      if mutated:
+        yield mutated
+
+def test_recognisers_match_bitset_chart(corpus_blocks, get_parser):
+  parsers = {mode: get_parser(recogniser_mode=mode) for mode in ('bitset', 'early_exit', 'earley')}
+  num_valid = 0
+  for block in corpus_blocks + list(get_mutated_blocks(corpus_blocks)):
+    is_valid = parsers['bitset'].is_parse_successful(block)
+    num_valid += is_valid
+    for mode in ('early_exit', 'earley'):
+      assert parsers[mode].is_parse_successful(block) == is_valid, (mode, block)
+
+  # Both outcomes are covered
+  assert 0 < num_valid < len(corpus_blocks) * (MUTATIONS + 1)
+
+# The Earley tree of a statement of over 1000 tokens, which is as deep as the statement is long, has the tokens as
+# its leaves and only binary rules of the grammar, or rules with a nullable child, as its nodes
+def test_earley_parse_tree_of_long_statement(get_parser):
+  parser = get_parser()
+  grammar = parser.compiled_grammar
+  rules = set(grammar.binary_rules)
+  for source in ('x = [' + ', '.join(f'a{i}' for i in range(600)) + ']\n', 'x = ' + ' + '.join(f'a{i} * {i}' for i in range(300)) + '\n'):
+    block = split_into_blocks(lex(source))[0][0]
+    assert len(block) > 1000
+    tree = parser.build_parse_tree(block, 'statements')
+    assert tree[0] == 'statements'
+
+    leaves = []
+    stack = [tree]
+    while stack:
+      symbol, children = stack.pop()
+      if not isinstance(children, list):
+        leaves.append(children)
+        continue
+      A = grammar.get_id(symbol)
+      child_ids = [grammar.get_id(child[0]) for child in children]
+      if len(children) == 2:
+        assert (A, *child_ids) in rules, (symbol, children)
+      else:
+        assert any((A, child_ids[0], C) in rules for C in grammar.nullable_ids) or any((A, B, child_ids[0]) in rules for B in grammar.nullable_ids), symbol
+      stack += children[::-1]
+    assert leaves == block
@@ -0,0 +1,41 @@
+from corpus import generate_corpus, lex
+from utils import split_into_blocks
+
+# On blocks with a single error, a window correction must make the block parse, with no more edits than the block
+# correction, which can lose the correction with fewest edits from its beam over the whole block. Where the window
+# grows to the whole block, the window mode gives the block correction itself
+SIZES = [2, 5, 10]
+SNIPPETS_PER_SIZE = 10
+
+def get_single_error_blocks(parser):
+  corpus = generate_corpus(0, SIZES, [1], SNIPPETS_PER_SIZE)
+  blocks = [block for snippet in corpus for blocks in split_into_blocks(lex(snippet['source'])) for block in blocks]
+  return [block for block in blocks if not parser.is_parse_successful(block)]
+
+def get_block_correction_or_none(parser, block):
+  try:
+    return parser.get_block_correction(block)
+  except Exception as e:
+    # The beam over the whole block pruned every parse as statements
+    assert str(e).startswith('FAILED TO PARSE AS STATEMENT'), e
+    return None
+
+def test_window_correction_on_single_errors(get_parser):
+  window = get_parser(correction_mode='window')
+  block = get_parser()
+  num_windows = num_fallbacks = 0
+  for code in get_single_error_blocks(block):
+    window_correction = window.get_window_correction(code)
+    block_correction = get_block_correction_or_none(block, code)
+    if window_correction is None:
+      num_fallbacks += 1
+      assert get_block_correction_or_none(window, code) == block_correction, code
+      continue
+
+    num_windows += 1
+    assert window.get_block_correction(code) == window_correction
+    assert block.is_parse_successful(window.correction_service.apply_correction(window_correction, code)), (code, window_correction)
+    if block_correction is not None:
+      assert len(window_correction) <= len(block_correction), (code, window_correction, block_correction)
+
+  assert num_windows and num_fallbacks
@@ -94,32 +94,26 @@ def split_into_blocks(lexed_code):
     reliant_blocks = json.load(f)
   
   # For each indent level, maintain the blocks at that level
-  indent_block_map = [[]]
-
-  # Parallel array that tracks the indent level of each line
-  indent_line_parallel_arr = []
-  curr_indent = 0
-  
-  # Initialise indent block map and indent map
-  for (token, _id, code_pos) in lexed_code:
-    if token == 'NEWLINE':
-      indent_line_parallel_arr.append(curr_indent)
-      indent_block_map[curr_indent] = [[]]
-    elif token == 'INDENT':
-      curr_indent += 1
-      if curr_indent >= len(indent_block_map):
-        indent_block_map.append([])
-    elif token == 'DEDENT':
-      curr_indent -= 1
-  
+  indent_block_map = [[[]]]
   curr_indent = 0
-  curr_line = 0
 
   # Tracks if prev token is a dedent token
   prev_token_dedent = False
 
+  # Level, index and length of the block the last NEWLINE was added to, which is split after that NEWLINE if the next
+  # line is at the same indent level. Deciding at the next NEWLINE reads the tokens once, so lexed_code can be a generator
+  pending_split = None
+
   # Adds to block map
   for (token, _id, code_pos) in lexed_code:
+    if token == 'NEWLINE' and pending_split is not None:
+      split_indent, block_i, block_len = pending_split
+      if split_indent == curr_indent:
+        blocks = indent_block_map[split_indent]
+        blocks.insert(block_i+1, blocks[block_i][block_len:])
+        del blocks[block_i][block_len:]
+      pending_split = None
+
     if token == 'DEDENT':
       # Start new block
       indent_block_map[curr_indent].append([])
@@ -135,19 +129,16 @@ def split_into_blocks(lexed_code):
       if not prev_token_dedent:
         # If we didn't just dedent, add the NEWLINE to current indent
         indent_block_map[curr_indent][-1].append((token, _id, code_pos))
-
-        # If the next line is at the same indent level we can split into a diff block
-        if curr_line+1 < len(indent_line_parallel_arr) and indent_line_parallel_arr[curr_line+1] == curr_indent:
-          indent_block_map[curr_indent].append([])
+        pending_split = (curr_indent, len(indent_block_map[curr_indent])-1, len(indent_block_map[curr_indent][-1]))
         prev_token_dedent = False
       else:
         prev_token_dedent = True
-        
-      curr_line += 1
     elif token == 'INDENT':
       indent_block_map[curr_indent][-1].append((token, _id, code_pos))
       indent_block_map[curr_indent][-1].append(('STUB-BLOCK', _id+1, ()))
       curr_indent += 1
+      if curr_indent >= len(indent_block_map):
+        indent_block_map.append([[]])
       prev_token_dedent = False
     else:
       indent_block_map[curr_indent][-1].append((token, _id, code_pos))